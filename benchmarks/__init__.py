@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for SETLyze.
+
+Run ``python -m benchmarks.run --help`` for usage information.
+"""
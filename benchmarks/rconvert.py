@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2010-2013, GiMaRIS <info@gimaris.com>
+#
+#  This file is part of SETLyze - A tool for analyzing the settlement
+#  of species on SETL plates.
+#
+#  SETLyze is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SETLyze is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the per-call overhead of converting R test results.
+
+The result of a ``wilcox.test`` call in R is converted to a dictionary in
+several ways, and the time per conversion is printed in microseconds:
+
+``raw``
+  The call to ``wilcox.test`` in R without converting the result.
+
+``get_fields``
+  Converting the result with :func:`setlyze.stats.get_fields`.
+
+``convert_robj``
+  Converting the result with ``pandas.rpy.common.convert_robj``, followed by
+  simplifying the result like SETLyze used to do. Only measured if pandas
+  with its rpy module is installed.
+
+``wilcox_test``
+  A complete call to :func:`setlyze.stats.wilcox_test`.
+
+``wilcox_test_batch``
+  A call to :func:`setlyze.stats.wilcox_test_batch`, per test.
+
+Usage example: ::
+
+    python -m benchmarks.rconvert --number 2000
+"""
+
+import random
+import timeit
+import argparse
+
+from rpy2.rinterface import NULL
+from rpy2.robjects import FloatVector
+
+import setlyze.config
+from setlyze import stats
+
+def simplify(obj):
+    """Simplify the result of ``convert_robj`` like SETLyze used to do."""
+    from pandas.core.series import Series
+
+    if obj is NULL:
+        return None
+    if isinstance(obj, Series):
+        obj = dict(obj)
+    try:
+        _ = (x for x in obj)
+    except TypeError:
+        return obj
+    if isinstance(obj, dict):
+        for k in obj:
+            obj[k] = simplify(obj[k])
+    elif len(obj) == 1:
+        if obj[0] is NULL:
+            return None
+        return obj[0]
+    elif isinstance(obj, list):
+        for i, e in enumerate(obj):
+            obj[i] = simplify(e)
+    return obj
+
+def get_samples(n_values, seed=1):
+    """Return two lists of `n_values` random intra-specific spot distances."""
+    rand = random.Random(seed)
+    distances = sorted(setlyze.config.cfg.get('spot-dist-to-prob-intra'))
+    x = [rand.choice(distances) for i in range(n_values)]
+    y = [rand.choice(distances) for i in range(n_values)]
+    return x, y
+
+def measure(func, number):
+    """Return the time per call of `func` in microseconds."""
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    return seconds / number * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the per-call "
+        "overhead of converting R test results.")
+    parser.add_argument('--number', type=int, default=1000,
+        help="Number of calls per measurement (default: %(default)s).")
+    parser.add_argument('--values', type=int, default=50,
+        help="Number of values per sample (default: %(default)s).")
+    args = parser.parse_args()
+
+    x, y = get_samples(args.values)
+    wilcox = stats.r('wilcox.test')
+    rx, ry = FloatVector(x), FloatVector(y)
+    result = wilcox(rx, ry)
+
+    timings = [
+        ('raw', lambda: wilcox(rx, ry)),
+        ('get_fields', lambda: stats.get_fields(result)),
+    ]
+    try:
+        from pandas.rpy.common import convert_robj
+    except ImportError:
+        print "convert_robj: skipped (pandas.rpy is not installed)"
+    else:
+        timings.append(('convert_robj', lambda: simplify(convert_robj(result))))
+    timings.append(('wilcox_test', lambda: stats.wilcox_test(x, y)))
+
+    for name, func in timings:
+        print "%s: %.1f us per call" % (name, measure(func, args.number))
+
+    # The batch function performs many tests per call, so report the time
+    # per test.
+    samples = [(x, y)] * 100
+    seconds = min(timeit.repeat(lambda: stats.wilcox_test_batch(samples),
+        number=max(args.number // 100, 1), repeat=3))
+    print "wilcox_test_batch: %.1f us per test" % (seconds /
+        (max(args.number // 100, 1) * len(samples)) * 1e6)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2010-2013, GiMaRIS <info@gimaris.com>
+#
+#  This file is part of SETLyze - A tool for analyzing the settlement
+#  of species on SETL plates.
+#
+#  SETLyze is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SETLyze is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the time to open the report dialog for large batch summaries.
+
+A report with a synthetic summary of the spot preference analysis (see
+:meth:`setlyze.gui.Report.add_positive_spots_summary`) is created for each
+number of rows, and for each report the following times are printed in
+seconds:
+
+``open``
+  The time until the report dialog is displayed. This is the time the GUI
+  is blocked.
+
+``loaded``
+  The time until all rows of the summary were added to the tree model by
+  the idle callback of :class:`setlyze.gui.SummaryModel`.
+
+With ``--eager`` all rows are added before the dialog is displayed, like
+the report dialog used to do. Usage example: ::
+
+    python -m benchmarks.report_window --rows 1000 10000 50000
+"""
+
+import sys
+import time
+import random
+import argparse
+
+import pygtk
+pygtk.require('2.0')
+import gtk
+
+import setlyze.report
+import setlyze.gui
+
+# Values for the test result columns of the summary.
+VALUES = (None, 'n', 'ns; 0.5', 's; 0.01', 'at; 0.001', 'rp; 0.001')
+
+def make_report(n_rows, seed=1):
+    """Return a report with a positive spots summary of `n_rows` rows."""
+    rand = random.Random(seed)
+    columns = ['Species', 'n (plates)', 'Wilcoxon 2-24'] + \
+        [str(i) for i in range(2, 25)] + ['Chi sq 2-24'] + \
+        [str(i) for i in range(2, 25)]
+    results = []
+    for i in xrange(n_rows):
+        row = ["Species %d" % i, rand.randint(1, 500)]
+        row.extend(rand.choice(VALUES) for j in range(48))
+        results.append(row)
+
+    report = setlyze.report.Report()
+    report.set_statistics('positive_spots_summary', {
+        'attr': {'columns': columns},
+        'results': results
+    })
+    return report
+
+def flush_events(models=()):
+    """Run the main loop until all rows of the tree `models` are loaded.
+
+    The main loop is iterated at least until no events other than the idle
+    callbacks are pending, so the dialog is drawn.
+    """
+    while gtk.events_pending() and \
+            any(m.n_loaded < len(m.rows) for m in models):
+        gtk.main_iteration(False)
+    # Draw the dialog.
+    gtk.gdk.window_process_all_updates()
+
+def measure(n_rows):
+    """Return the times to open the report dialog for `n_rows` rows and to
+    load all rows.
+    """
+    report = make_report(n_rows)
+
+    start = time.time()
+    dialog = setlyze.gui.Report(report, "Spot Preference - Batch mode")
+    dialog.window.window.process_updates(True)
+    opened = time.time() - start
+
+    flush_events(dialog.summary_models)
+    loaded = time.time() - start
+
+    # Report.on_close would ask for confirmation; destroy directly.
+    dialog.window.destroy()
+    while gtk.events_pending():
+        gtk.main_iteration(False)
+    return opened, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the time to "
+        "open the report dialog for large batch summaries.")
+    parser.add_argument('--rows', type=int, nargs='+',
+        default=[100, 1000, 10000, 50000],
+        help="Numbers of summary rows (default: %(default)s).")
+    parser.add_argument('--eager', action='store_true',
+        help="Add all rows before the dialog is displayed.")
+    args = parser.parse_args()
+
+    if args.eager:
+        setlyze.gui.SummaryModel.chunk_size = sys.maxint
+
+    for n_rows in args.rows:
+        opened, loaded = measure(n_rows)
+        print "%d rows: open %.3f s, loaded %.3f s" % (n_rows, opened, loaded)
+
+if __name__ == "__main__":
+    main()
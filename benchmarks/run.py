@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2010-2013, GiMaRIS <info@gimaris.com>
+#
+#  This file is part of SETLyze - A tool for analyzing the settlement
+#  of species on SETL plates.
+#
+#  SETLyze is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SETLyze is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run the SETLyze benchmark suite.
+
+This script generates synthetic SETL data (see :mod:`benchmarks.synthetic`),
+imports it into a fresh local database and runs each analysis in single and
+in batch mode. The time spent in each stage is measured and the results are
+written as JSON, so they can be compared between versions. Usage example: ::
+
+    python -m benchmarks.run --plates 5000 --species 50 -o results.json
+
+The following stages are timed for each analysis in single mode:
+
+``get_record_ids``, ``set_species_spots``, ``make_plates_unique``
+  Obtaining the records for the selections from the local database.
+
+``distances``
+  Calculating the observed spot distances or plate area totals.
+
+``repeats``
+  The repeated statistical tests with random expected values.
+
+``stats``
+  The statistical tests on the observed and expected values.
+
+``report``
+  Generating the analysis report and exporting it to reStructuredText.
+
+In batch mode the analysis is run for a number of species with a process
+pool, like :class:`~setlyze.analysis.spot_preference.BeginBatch` does. The
+total time and the time for exporting the reports are measured. With
+``--scaling`` each batch is also run with 1 up to ``--processes`` worker
+processes, and the throughput (analyses per second) and the speedup relative
+to a single worker are reported for each number of processes.
+
+The benchmarks run without the GUI, but the modules for the GUI and the
+statistics (PyGTK, R) must be importable.
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import itertools
+import collections
+import multiprocessing
+from sqlite3 import dbapi2 as sqlite
+
+import setlyze
+import setlyze.config
+import setlyze.database
+import setlyze.report
+from setlyze.analysis import spot_preference, attraction_intra, attraction_inter
+from setlyze.analysis.common import calculatestar, init_worker
+
+from benchmarks import synthetic
+
+# The default plate areas definition.
+DEFAULT_AREAS = {'area1': ['A'], 'area2': ['B'], 'area3': ['C'],
+    'area4': ['D']}
+
+# The analysis methods that make up each stage.
+ANALYSES = collections.OrderedDict([
+    ('spot_preference', {
+        'module': spot_preference,
+        'stages': {
+            'distances': ('set_plate_area_totals_observed',
+                'get_defined_areas_totals_observed'),
+            'repeats': ('repeat_wilcoxon_test',),
+            'stats': ('calculate_significance_wilcoxon',
+                'calculate_significance_chisq'),
+            'report': ('generate_report',),
+        },
+    }),
+    ('attraction_intra', {
+        'module': attraction_intra,
+        'stages': {
+            'distances': ('calculate_distances_intra',),
+            'repeats': ('repeat_wilcoxon_test',),
+            'stats': ('calculate_significance',),
+            'report': ('generate_report',),
+        },
+    }),
+    ('attraction_inter', {
+        'module': attraction_inter,
+        'stages': {
+            'distances': ('calculate_distances_inter',),
+            'repeats': ('repeat_wilcoxon_test',),
+            'stats': ('calculate_significance',),
+            'report': ('generate_report',),
+        },
+    }),
+])
+
+# The database methods that are timed as separate stages.
+DB_STAGES = ('get_record_ids', 'set_species_spots', 'make_plates_unique')
+
+class StageTimer(object):
+    """Measure the time spent in methods of classes.
+
+    Methods are replaced by a wrapper with :meth:`patch`, which adds the
+    time spent in the method to a stage. The original methods are restored
+    with :meth:`restore`.
+    """
+
+    def __init__(self):
+        self.timings = collections.OrderedDict()
+        self.patched = []
+
+    def add(self, stage, seconds):
+        """Add `seconds` to the total time for `stage`."""
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def patch(self, cls, name, stage):
+        """Time all calls to method `name` of class `cls` as `stage`."""
+        original = cls.__dict__.get(name)
+        method = getattr(cls, name)
+        timer = self
+
+        def wrapper(*args, **kargs):
+            start = time.time()
+            try:
+                return method(*args, **kargs)
+            finally:
+                timer.add(stage, time.time() - start)
+
+        setattr(cls, name, wrapper)
+        self.patched.append((cls, name, original))
+
+    def restore(self):
+        """Restore all patched methods."""
+        for cls, name, original in reversed(self.patched):
+            if original is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, original)
+        self.patched = []
+
+def make_database(files):
+    """Create a new local database from the data `files` and return the
+    import time in seconds.
+    """
+    for name, path in files.iteritems():
+        setlyze.config.cfg.set(name, path)
+    setlyze.config.cfg.set('data-source', 'data-files')
+    setlyze.config.cfg.set('make-new-db', True)
+
+    start = time.time()
+    setlyze.database.MakeLocalDB().run()
+    elapsed = time.time() - start
+
+    if not setlyze.config.cfg.get('has-local-db'):
+        raise RuntimeError("Importing the synthetic data failed.")
+    return elapsed
+
+def get_selections(n_species):
+    """Return the location IDs and the `n_species` species IDs with the most
+    records in the local database.
+    """
+    connection = sqlite.connect(setlyze.config.cfg.get('db-file'))
+    cursor = connection.cursor()
+    cursor.execute("SELECT loc_id FROM localities")
+    locations = [row[0] for row in cursor]
+    cursor.execute("SELECT rec_spe_id FROM records GROUP BY rec_spe_id "
+        "ORDER BY COUNT(*) DESC, rec_spe_id LIMIT ?", (n_species,))
+    species = [row[0] for row in cursor]
+    cursor.close()
+    connection.close()
+    return locations, species
+
+def get_jobs(name, locations, species):
+    """Return the list of jobs for analysis `name`, as they are created in
+    batch mode.
+    """
+    cls = ANALYSES[name]['module'].Analysis
+    if name == 'spot_preference':
+        return [(cls, (locations, sp, DEFAULT_AREAS)) for sp in species]
+    elif name == 'attraction_intra':
+        return [(cls, (locations, sp)) for sp in species]
+    elif name == 'attraction_inter':
+        return [(cls, ((locations, locations), combo)) for combo in
+            itertools.combinations(species, 2)]
+    raise ValueError("Unknown analysis '%s'." % name)
+
+def bench_single(name, job, output_dir):
+    """Run a single analysis `job` and return the time spent per stage."""
+    timer = StageTimer()
+    cls = job[0]
+    for stage, methods in ANALYSES[name]['stages'].iteritems():
+        for method in methods:
+            timer.patch(cls, method, stage)
+    for method in DB_STAGES:
+        timer.patch(setlyze.database.AccessLocalDB, method, method)
+
+    try:
+        start = time.time()
+        report = calculatestar(job)
+        if report:
+            export_start = time.time()
+            setlyze.report.export(report, os.path.join(output_dir, name),
+                'rst')
+            timer.add('report', time.time() - export_start)
+        timer.timings['total'] = time.time() - start
+    finally:
+        timer.restore()
+
+    return timer.timings
+
+def bench_batch(name, jobs, output_dir, processes):
+    """Run the analysis `jobs` with a process pool and return the timings.
+
+    The workers are initialized like those of the application, so they
+    open the database read-only and have their own temporary folder.
+    """
+    timings = collections.OrderedDict()
+    start = time.time()
+    pool = multiprocessing.Pool(processes, initializer=init_worker,
+        initargs=(multiprocessing.Event(),))
+    try:
+        results = pool.map(calculatestar, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    timings['analyses'] = time.time() - start
+
+    # Export the reports, like PrepareAnalysis.export_reports does.
+    export_start = time.time()
+    results = [r for r in results if r and not r.is_empty()]
+    names = dict([(id(r), "%s_%d.rst" % (name, i)) for i, r in
+        enumerate(results)])
+    setlyze.report.export_reports(results, output_dir,
+        lambda report: names[id(report)])
+    timings['export'] = time.time() - export_start
+    timings['total'] = time.time() - start
+    timings['jobs'] = len(jobs)
+    timings['results'] = len(results)
+    timings['throughput'] = len(jobs) / timings['analyses']
+    return timings
+
+def bench_scaling(name, jobs, output_dir, processes):
+    """Run the analysis `jobs` in batch mode with 1 up to `processes`
+    worker processes and return the throughput (analyses per second) and
+    the speedup relative to one worker for each number of processes.
+    """
+    scaling = collections.OrderedDict()
+    for n in range(1, processes + 1):
+        throughput = bench_batch(name, jobs, output_dir, n)['throughput']
+        if n == 1:
+            base = throughput
+        scaling[str(n)] = collections.OrderedDict([
+            ('throughput', throughput),
+            ('speedup', throughput / base),
+        ])
+        logging.info("%s with %d processes: %.2f analyses per second" %
+            (name, n, throughput))
+    return scaling
+
+def run(args):
+    """Run the benchmarks with the command line arguments `args` and return
+    the results as a dictionary.
+    """
+    work_dir = tempfile.mkdtemp(prefix='setlyze-bench-')
+    try:
+        # Use a separate database, so the user's data is left alone.
+        setlyze.config.cfg.set('data-path', work_dir)
+        setlyze.config.cfg.set('db-file', os.path.join(work_dir, 'setl_local.db'))
+        setlyze.config.cfg.set('snapshot-path',
+            os.path.join(work_dir, 'setl_local.snapshot'))
+        setlyze.config.cfg.set('test-repeats', args.repeats)
+        output_dir = os.path.join(work_dir, 'reports')
+        os.makedirs(output_dir)
+
+        results = collections.OrderedDict()
+        results['setlyze'] = setlyze.__version__
+        results['python'] = platform.python_version()
+        results['platform'] = platform.platform()
+        results['date'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        results['parameters'] = collections.OrderedDict(sorted(vars(args).items()))
+
+        # Generate the data.
+        start = time.time()
+        files = synthetic.generate(os.path.join(work_dir, 'data'),
+            args.locations, args.plates, args.species, args.occupancy,
+            args.density, args.seed, args.format)
+        results['generate'] = time.time() - start
+
+        # Import the data.
+        results['import'] = make_database(files)
+        logging.info("Import finished in %.2f seconds" % results['import'])
+
+        locations, species = get_selections(args.batch_species)
+        results['analyses'] = collections.OrderedDict()
+        for name in args.analyses:
+            jobs = get_jobs(name, locations, species)
+            logging.info("Benchmarking %s..." % name)
+            results['analyses'][name] = collections.OrderedDict([
+                ('single', bench_single(name, jobs[0], output_dir)),
+                ('batch', bench_batch(name, jobs, output_dir, args.processes)),
+            ])
+            if args.scaling:
+                results['analyses'][name]['scaling'] = bench_scaling(name,
+                    jobs, output_dir, args.processes)
+        return results
+    finally:
+        if args.keep:
+            logging.info("Benchmark files kept in %s" % work_dir)
+        else:
+            shutil.rmtree(work_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SETLyze benchmark "
+        "suite and print the results as JSON.")
+    parser.add_argument('--locations', type=int, default=4,
+        help="Number of locations (default: %(default)s).")
+    parser.add_argument('--plates', type=int, default=1000,
+        help="Number of plates (default: %(default)s).")
+    parser.add_argument('--species', type=int, default=100,
+        help="Number of species (default: %(default)s).")
+    parser.add_argument('--occupancy', type=float, default=0.1,
+        help="Probability that a species is recorded on a plate "
+        "(default: %(default)s).")
+    parser.add_argument('--density', type=float, default=0.3,
+        help="Probability that a spot is positive for a recorded species "
+        "(default: %(default)s).")
+    parser.add_argument('--seed', type=int, default=1,
+        help="Seed for the random generator (default: %(default)s).")
+    parser.add_argument('--format', choices=('csv','xlsx'), default='csv',
+        help="Format of the data files (default: %(default)s).")
+    parser.add_argument('--repeats', type=int, default=20,
+        help="Number of repeats for the statistical tests "
+        "(default: %(default)s).")
+    parser.add_argument('--batch-species', type=int, default=10,
+        help="Number of species to analyze in batch mode "
+        "(default: %(default)s).")
+    parser.add_argument('--processes', type=int,
+        default=setlyze.config.cfg.get('concurrent-processes'),
+        help="Number of processes in batch mode (default: %(default)s).")
+    parser.add_argument('--scaling', action='store_true',
+        help="Also run each batch with 1 up to --processes processes and "
+        "report the throughput for each number of processes.")
+    parser.add_argument('--analyses', nargs='+', choices=ANALYSES.keys(),
+        default=ANALYSES.keys(), help="The analyses to run (default: all).")
+    parser.add_argument('-o', '--output', help="Write the results to this "
+        "file instead of standard output.")
+    parser.add_argument('--keep', action='store_true',
+        help="Don't remove the generated data and reports.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(message)s')
+
+    results = run(args)
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump(results, f, indent=2)
+        f.write("\n")
+        f.close()
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2010-2013, GiMaRIS <info@gimaris.com>
+#
+#  This file is part of SETLyze - A tool for analyzing the settlement
+#  of species on SETL plates.
+#
+#  SETLyze is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SETLyze is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the time to open the species selection dialog.
+
+Synthetic SETL data (see :mod:`benchmarks.synthetic`) is imported into a
+new local database in a temporary folder, all locations are selected and
+the following times are printed in milliseconds:
+
+``query``
+  The time to get the species for the locations from the database, which
+  is what opening the dialog used to block on.
+
+``open``
+  The time until the species selection dialog is displayed, the first time
+  it is opened for the selection. The species are loaded in a separate
+  thread.
+
+``loaded``
+  The time until all species were added to the dialog, the first time.
+
+``reopen``
+  The time until the dialog is displayed with all species when it is
+  opened again for the same selection, as happens when the user presses
+  Back and Continue in the wizard. The species come from the cache, so
+  this should be instant. The best of ``--flips`` times is printed.
+
+Usage example: ::
+
+    python -m benchmarks.species_dialog --species 2000 --locations 50
+"""
+
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+import pygtk
+pygtk.require('2.0')
+import gtk
+import gobject
+
+import setlyze.config
+import setlyze.database
+import setlyze.gui
+
+from benchmarks import synthetic
+from benchmarks.run import make_database, get_selections
+
+def open_dialog(locations):
+    """Open the species selection dialog for `locations` and return the
+    dialog, the time until it was displayed and the time until all species
+    were loaded, in milliseconds.
+    """
+    start = time.time()
+    dialog = setlyze.gui.SelectSpecies(locations)
+    dialog.window.process_updates(True)
+    opened = time.time() - start
+
+    # Run the main loop until the loading thread and the idle callbacks
+    # that fill the model are finished.
+    while dialog.label_descr.get_text() != dialog.description:
+        gtk.main_iteration(True)
+    loaded = time.time() - start
+    return dialog, opened * 1000, loaded * 1000
+
+def close_dialog(dialog):
+    """Close the species selection `dialog` like the Back button does."""
+    dialog.destroy()
+    dialog.unset_signal_handlers()
+    while gtk.events_pending():
+        gtk.main_iteration(False)
+
+def run(args):
+    """Run the benchmark with the command line arguments `args`."""
+    work_dir = tempfile.mkdtemp(prefix='setlyze-bench-')
+    try:
+        # Use a separate database, so the user's data is left alone.
+        setlyze.config.cfg.set('data-path', work_dir)
+        setlyze.config.cfg.set('db-file', os.path.join(work_dir, 'setl_local.db'))
+        setlyze.config.cfg.set('snapshot-path',
+            os.path.join(work_dir, 'setl_local.snapshot'))
+
+        files = synthetic.generate(os.path.join(work_dir, 'data'),
+            args.locations, args.plates, args.species, args.occupancy,
+            args.density, args.seed)
+        make_database(files)
+        locations = get_selections(0)[0]
+
+        # Handle the signal that the local database was created before
+        # any dialog is opened.
+        while gtk.events_pending():
+            gtk.main_iteration(False)
+
+        start = time.time()
+        db = setlyze.database.get_database_accessor()
+        n_species = len(db.get_species(locations))
+        db.conn.close()
+        print "query: %.1f ms (%d species)" % ((time.time() - start) * 1000,
+            n_species)
+
+        dialog, opened, loaded = open_dialog(locations)
+        close_dialog(dialog)
+        print "open: %.1f ms" % opened
+        print "loaded: %.1f ms" % loaded
+
+        reopen = []
+        for i in range(args.flips):
+            dialog, opened, loaded = open_dialog(locations)
+            close_dialog(dialog)
+            reopen.append(loaded)
+        print "reopen: %.1f ms" % min(reopen)
+    finally:
+        shutil.rmtree(work_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the time to "
+        "open the species selection dialog.")
+    parser.add_argument('--locations', type=int, default=20,
+        help="Number of locations (default: %(default)s).")
+    parser.add_argument('--plates', type=int, default=5000,
+        help="Number of plates (default: %(default)s).")
+    parser.add_argument('--species', type=int, default=1000,
+        help="Number of species (default: %(default)s).")
+    parser.add_argument('--occupancy', type=float, default=0.05,
+        help="Probability that a species is recorded on a plate "
+        "(default: %(default)s).")
+    parser.add_argument('--density', type=float, default=0.3,
+        help="Probability that a spot is positive for a recorded species "
+        "(default: %(default)s).")
+    parser.add_argument('--seed', type=int, default=1,
+        help="Seed for the random generator (default: %(default)s).")
+    parser.add_argument('--flips', type=int, default=10,
+        help="Number of times the dialog is opened again "
+        "(default: %(default)s).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(message)s')
+    gobject.threads_init()
+    run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2010-2013, GiMaRIS <info@gimaris.com>
+#
+#  This file is part of SETLyze - A tool for analyzing the settlement
+#  of species on SETL plates.
+#
+#  SETLyze is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SETLyze is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Generate synthetic SETL data files.
+
+The generated localities, plates, records and species files have the same
+format as the files exported from the SETL database, so they can be loaded
+into SETLyze like real data. The data is generated from a seed, so the same
+arguments always produce the same files. Usage example: ::
+
+    python -m benchmarks.synthetic --plates 5000 --species 200 /tmp/setl
+
+The scale of the data is set with the number of locations, plates and
+species. The occupancy is the probability that a species is recorded on a
+plate, and the density is the probability that a spot on the plate is
+positive for a recorded species.
+
+Files can be written in CSV format or as Excel 2007 (.xlsx) spread-sheets.
+The spread-sheets are written with Python's standard library, so no extra
+modules are required.
+"""
+
+import os
+import csv
+import random
+import argparse
+import datetime
+import zipfile
+from xml.sax.saxutils import escape
+
+# The number of spots on a SETL plate.
+N_SPOTS = 25
+
+# Headers for the data files.
+HEADER_LOCALITIES = ["LOC_id","LOC_name","LOC_nr","LOC_coordinates",
+    "LOC_description"]
+HEADER_PLATES = ["PLA_id","PLA_LOC_id","PLA_SETL_coordinator","PLA_nr",
+    "PLA_deployment_date","PLA_retrieval_date","PLA_water_temperature",
+    "PLA_salinity","PLA_visibility","PLA_remarks"]
+HEADER_RECORDS = ["REC_id","REC_PLA_id","REC_SPE_id","REC_unknown","REC_O",
+    "REC_R","REC_C","REC_A","REC_E","REC_sur_unknown"] + \
+    ["REC_sur%d" % i for i in range(1, N_SPOTS+1)] + \
+    ["REC_1st","REC_2nd","REC_v","REC_photo_nrs","REC_remarks"]
+HEADER_SPECIES = ["SPE_id","SPE_name_venacular","SPE_name_latin",
+    "SPE_invasive_in_NL","SPE_description","SPE_remarks","SPE_picture",
+    "SPE_Aphia_id","SPE_Kingdom","SPE_Phylum","SPE_Class","SPE_Order",
+    "SPE_Family","SPE_Genus","SPE_Subgenus","SPE_Species","SPE_Subspecies"]
+
+def generate_localities(rand, n_locations):
+    """Return a list of rows for the localities file."""
+    rows = []
+    for loc_id in range(1, n_locations+1):
+        rows.append([loc_id, "Location %d" % loc_id, str(loc_id), "",
+            "Synthetic location %d" % loc_id])
+    return rows
+
+def generate_plates(rand, n_plates, n_locations):
+    """Return a list of rows for the plates file."""
+    rows = []
+    start = datetime.date(2006, 1, 1)
+    for pla_id in range(1, n_plates+1):
+        deployed = start + datetime.timedelta(days=rand.randint(0, 3000))
+        retrieved = deployed + datetime.timedelta(days=91)
+        rows.append([pla_id, rand.randint(1, n_locations), "Synthetic",
+            str(pla_id), deployed.strftime("%m/%d/%Y"),
+            retrieved.strftime("%m/%d/%Y"), "", "", "", ""])
+    return rows
+
+def generate_species(rand, n_species):
+    """Return a list of rows for the species file."""
+    rows = []
+    for spe_id in range(1, n_species+1):
+        genus = "Genus%d" % (spe_id // 10 + 1)
+        name = "species%d" % spe_id
+        invasive = "TRUE" if rand.random() < 0.1 else "FALSE"
+        rows.append([spe_id, "Species %d" % spe_id,
+            "%s %s" % (genus, name), invasive, "", "", "", 100000 + spe_id,
+            "Animalia", "Phylum%d" % (spe_id % 5 + 1),
+            "Class%d" % (spe_id % 11 + 1), "Order%d" % (spe_id % 17 + 1),
+            "Family%d" % (spe_id % 31 + 1), genus, "", name, ""])
+    return rows
+
+def generate_records(rand, n_plates, n_species, occupancy, density):
+    """Return a generator yielding the rows for the records file.
+
+    For each plate, each species is recorded with probability `occupancy`.
+    Each spot of a recorded species is positive with probability `density`,
+    and at least one spot is positive.
+    """
+    rec_id = 0
+    for pla_id in range(1, n_plates+1):
+        for spe_id in range(1, n_species+1):
+            if rand.random() >= occupancy:
+                continue
+            spots = [1 if rand.random() < density else 0
+                for i in range(N_SPOTS)]
+            if not any(spots):
+                spots[rand.randint(0, N_SPOTS-1)] = 1
+
+            rec_id += 1
+            yield [rec_id, pla_id, spe_id, 0, 0, 0, 0, 0, 0, 0] + spots + \
+                [0, 0, 0, "", ""]
+
+def write_csv(path, header, rows):
+    """Write `rows` to CSV file `path` in the format of the SETL database
+    exports.
+    """
+    f = open(path, 'wb')
+    try:
+        writer = csv.writer(f, delimiter=';', quotechar='"')
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+    finally:
+        f.close()
+
+def write_xlsx(path, header, rows):
+    """Write `rows` to Excel 2007 file `path`.
+
+    Numbers are written as numeric cells and everything else as inline
+    strings. Empty strings result in empty cells.
+    """
+    archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        archive.writestr('[Content_Types].xml',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '</Types>')
+        archive.writestr('_rels/.rels',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>')
+        archive.writestr('xl/workbook.xml',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>')
+        archive.writestr('xl/_rels/workbook.xml.rels',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+            '</Relationships>')
+
+        # Write the sheet to a temporary file first, so large sheets don't
+        # have to be kept in memory.
+        tmp_path = path + '.sheet.tmp'
+        f = open(tmp_path, 'w')
+        try:
+            f.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<dimension ref="A1:%s1"/><sheetData>' %
+                get_column_name(len(header) - 1))
+            for rownum, row in enumerate([header], start=1):
+                f.write(get_xlsx_row(rownum, row))
+            for rownum, row in enumerate(rows, start=2):
+                f.write(get_xlsx_row(rownum, row))
+            f.write('</sheetData></worksheet>')
+        finally:
+            f.close()
+        archive.write(tmp_path, 'xl/worksheets/sheet1.xml')
+        os.remove(tmp_path)
+    finally:
+        archive.close()
+
+def get_column_name(index):
+    """Return the spread-sheet column name for zero based column `index`."""
+    name = ""
+    index += 1
+    while index > 0:
+        index, rem = divmod(index - 1, 26)
+        name = chr(ord('A') + rem) + name
+    return name
+
+def get_xlsx_row(rownum, row):
+    """Return the XML for row number `rownum` with values `row`."""
+    cells = []
+    for i, value in enumerate(row):
+        if value == "" or value is None:
+            continue
+        ref = "%s%d" % (get_column_name(i), rownum)
+        if isinstance(value, (int, long, float)):
+            cells.append('<c r="%s"><v>%s</v></c>' % (ref, value))
+        else:
+            cells.append('<c r="%s" t="inlineStr"><is><t>%s</t></is></c>' %
+                (ref, escape(str(value))))
+    return '<row r="%d">%s</row>' % (rownum, ''.join(cells))
+
+def generate(path, n_locations=4, n_plates=1000, n_species=100,
+        occupancy=0.1, density=0.3, seed=1, format='csv'):
+    """Generate the four SETL data files in folder `path`.
+
+    Argument `format` is either ``csv`` or ``xlsx``. Returns a dictionary
+    with the paths to the files, with keys ``localities-file``,
+    ``plates-file``, ``records-file`` and ``species-file`` (the names of the
+    corresponding configurations).
+    """
+    if format not in ('csv', 'xlsx'):
+        raise ValueError("Unsupported format '%s'." % format)
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    # Use a separate random generator, so the data only depends on the seed.
+    rand = random.Random(seed)
+
+    write = write_csv if format == 'csv' else write_xlsx
+    files = {}
+    for name, header, rows in (
+            ('localities', HEADER_LOCALITIES,
+                generate_localities(rand, n_locations)),
+            ('plates', HEADER_PLATES,
+                generate_plates(rand, n_plates, n_locations)),
+            ('species', HEADER_SPECIES,
+                generate_species(rand, n_species)),
+            ('records', HEADER_RECORDS,
+                generate_records(rand, n_plates, n_species, occupancy,
+                    density)),
+        ):
+        filename = os.path.join(path, "SETL_%s.%s" % (name, format))
+        write(filename, header, rows)
+        files['%s-file' % name] = filename
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic SETL "
+        "data files.")
+    parser.add_argument('path', help="Folder to write the data files to.")
+    parser.add_argument('--locations', type=int, default=4,
+        help="Number of locations (default: %(default)s).")
+    parser.add_argument('--plates', type=int, default=1000,
+        help="Number of plates (default: %(default)s).")
+    parser.add_argument('--species', type=int, default=100,
+        help="Number of species (default: %(default)s).")
+    parser.add_argument('--occupancy', type=float, default=0.1,
+        help="Probability that a species is recorded on a plate "
+        "(default: %(default)s).")
+    parser.add_argument('--density', type=float, default=0.3,
+        help="Probability that a spot is positive for a recorded species "
+        "(default: %(default)s).")
+    parser.add_argument('--seed', type=int, default=1,
+        help="Seed for the random generator (default: %(default)s).")
+    parser.add_argument('--format', choices=('csv','xlsx'), default='csv',
+        help="Format of the data files (default: %(default)s).")
+    args = parser.parse_args()
+
+    files = generate(args.path, args.locations, args.plates, args.species,
+        args.occupancy, args.density, args.seed, args.format)
+    for name in sorted(files):
+        print files[name]
+
+if __name__ == "__main__":
+    main()
@@ -37,7 +37,6 @@ in batch mode. Finally the analysis is performed with :class:`Analysis`.
 import itertools
 import logging
 import math
-import multiprocessing
 import os
 import re
 import time
@@ -48,15 +47,48 @@ import setlyze
 from setlyze.analysis.common import (calculatestar, ProcessGateway,
     PrepareAnalysis, AnalysisWorker)
 import setlyze.config
+import setlyze.database
 import setlyze.gui
 import setlyze.locale
 import setlyze.std
-from setlyze.stats import chisq_test, wilcox_test
+from setlyze.stats import chisq_test_batch, wilcox_test_batch
 import setlyze.report
+from setlyze.checkpoint import get_job_key
 
 # The number of progress steps for this analysis.
 PROGRESS_STEPS = 8
 
+def get_batch_jobs(locations, species, execute_queue=None):
+    """Return the jobs for performing the analysis in batch mode.
+
+    A job is created for each species ID in the species selection `species`,
+    with the locations selection `locations`. Returns a list of
+    ``(key, job)`` tuples, where the key identifies the job (see
+    :func:`setlyze.checkpoint.get_job_key`) and the job can be passed to
+    :func:`~setlyze.analysis.common.calculatestar`.
+    """
+    return [(get_job_key(sp), (Analysis, (locations, sp, execute_queue)))
+        for sp in species]
+
+def estimate_costs(locations, species):
+    """Return the estimated cost of the batch job for each species.
+
+    The cost of the analysis grows with the number of records of the species
+    in the locations selection `locations` and with the number of spot
+    distances, which is n*(n-1)/2 for a record with n positive spots.
+    Returns a dictionary with the estimated cost for the job key of each
+    species ID in `species` (see
+    :func:`~setlyze.analysis.common.schedule_jobs`).
+    """
+    db = setlyze.database.get_database_accessor()
+    totals = db.get_species_spot_totals(locations)
+    costs = {}
+    for sp in species:
+        n_records, n_spots, n_spots_sq = totals.get(sp, (0, 0, 0))
+        costs[get_job_key(sp)] = n_records + (n_spots_sq - n_spots) / 2
+    db.close()
+    return costs
+
 class Begin(PrepareAnalysis):
     """Make the preparations for the analysis.
 
@@ -182,13 +214,14 @@ class Begin(PrepareAnalysis):
         gw.start()
 
         # Create a process pool with a single worker.
-        self.pool = multiprocessing.Pool(1)
+        self.pool = self.get_pool(1)
 
         # Create a list with the job.
         jobs = [(Analysis, (locations, species, gw.queue))]
 
         # Add the job to the pool.
-        self.pool.map_async(calculatestar, jobs, callback=self.on_pool_finished)
+        self.pool_result = self.pool.map_async(calculatestar, jobs,
+            callback=self.on_pool_finished)
 
 class BeginBatch(Begin):
     """Make the preparations for the analysis in batch mode.
@@ -220,37 +253,139 @@ class BeginBatch(Begin):
 
         Creates a pool of worker processes. A job is set for each species that
         was selected. The jobs are then added to the pool for execution. If
-        multiple workers were created, analyses will run in parallel. When
-        the results are ready, :meth:`~setlyze.analysis.common.PrepareAnalysis.on_pool_finished`
-        is applied to it.
+        multiple workers were created, analyses will run in parallel. Each
+        report is passed to :meth:`~setlyze.analysis.common.PrepareAnalysis.add_result`
+        as soon as its analysis is finished.
         """
+        # Create a gateway to the main process for child processes.
+        gw = ProcessGateway()
+
+        # Create a list of jobs.
+        jobs = get_batch_jobs(locations, species, gw.queue)
+        logging.info("Adding %d jobs to the queue" % len(jobs))
+
+        # Estimate the cost of each job.
+        costs = estimate_costs(locations, species)
+
+        # Resume the batch if it was interrupted before.
+        self.open_checkpoint('attraction_intra', {'locations': locations,
+            'species': species}, len(jobs))
+
         self.start_time = time.time()
 
         # Create a progress dialog and a handler.
         self.pdialog, self.pdialog_handler = self.get_progress_dialog()
-
-        # Set the total number of times we decide to update the progress dialog.
-        self.pdialog_handler.set_total_steps((PROGRESS_STEPS + self.n_repeats) *
-            len(species))
-
-        # Create a progress task executor.
-        gw = ProcessGateway()
         gw.set_pdialog_handler(self.pdialog_handler)
         gw.start()
 
-        # Create a process pool with workers.
+        # Run the jobs in a process pool with workers, the heaviest jobs
+        # first. The reports are processed as soon as each analysis is
+        # finished.
         cp = setlyze.config.cfg.get('concurrent-processes')
-        self.pool = multiprocessing.Pool(cp)
+        self.start_batch(jobs, PROGRESS_STEPS + self.n_repeats, cp, costs)
 
-        # Create a list of jobs.
-        logging.info("Adding %d jobs to the queue" % len(species))
-        jobs = ((Analysis, (locations, sp, gw.queue)) for sp in species)
+    def summarize_result(self, result):
+        """Return the row for the summary report for analysis report
+        `result`, or None if none of the results in the row were significant.
 
-        # Add the jobs to the pool.
-        self.pool.map_async(calculatestar, jobs, callback=self.on_pool_finished)
+        This method is called for each report as soon as the analysis is
+        finished (see :meth:`~setlyze.analysis.common.PrepareAnalysis.add_result`).
+        See :meth:`summarize_results` for the format of the rows.
+        """
+        chi_squared = None
+        wilcoxon = None
+        species_selection = [s for s in result.species_selections[0].values()]
+        species = species_selection[0]['name_latin']
+        if 'wilcoxon_spots_repeats' in result.statistics:
+            wilcoxon = result.statistics['wilcoxon_spots_repeats'][0]
+        if 'chi_squared_spots' in result.statistics:
+            chi_squared = result.statistics['chi_squared_spots'][0]
+
+        # Figure out for which positive spots number the result was
+        # significant. A result is considered significant if
+        # (confidence level)% of the test repeats were significant.
+        positive_spots = [-24,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24]
+        row = []
+        for spots in positive_spots:
+            if not wilcoxon:
+                row.append(None)
+                continue
+            stats = wilcoxon['results'].get(spots, None)
+            if stats:
+                # Calculate the P-value.
+                # Attraction and repulsion should not be summed up
+                # because they contradict. Only use the major value.
+                if stats['n_attraction'] > stats['n_repulsion']:
+                    major = stats['n_attraction']
+                else:
+                    major = stats['n_repulsion']
+                p = 1 - float(major) / wilcoxon['attr']['repeats']
+
+                if setlyze.std.is_significant(p, self.alpha_level):
+                    if stats['n_attraction'] > stats['n_repulsion']:
+                        code = 'at'
+                    else:
+                        code = 'rp'
+                else:
+                    code = 'ns'
+                row.append("%s; p=%.4f" % (code,p))
+            else:
+                row.append(None)
+
+        # Add the results for the Chi squared tests.
+        for spots in positive_spots:
+            if not chi_squared:
+                row.append(None)
+                continue
+            stats = chi_squared['results'].get(spots, None)
+            if stats:
+                # Check if the result was significant. When all values are
+                # 0 the p-value will be NaN. Function `is_significant` will
+                # raise ValueError if the p-value is NaN.
+                try:
+                    significant = setlyze.std.is_significant(stats['p_value'], self.alpha_level)
+                except ValueError:
+                    significant = False
+
+                if significant:
+                    if stats['mean_observed'] < stats['mean_expected']:
+                        code = 'at'
+                    else:
+                        code = 'rp'
+                else:
+                    code = 'ns'
+
+                row.append("%s; χ²=%.2f; p=%.4f" %
+                    (code, stats['chi_squared'], stats['p_value']))
+            else:
+                # No data.
+                row.append(None)
+
+        # Only return the row if one item in the row was significant.
+        for val in row:
+            if val and re.match('^(s|at|rp);', val):
+                r = [species, result.get_option('Total plates')]
+                r.extend(row)
+                return r
+        return None
+
+    def get_summary_attr(self):
+        """Return the attributes of the summary report, which describe the
+        columns of the rows from :meth:`summarize_result`.
+
+        See :meth:`summarize_results` for the format.
+        """
+        return {
+            'columns_over': ('..', 'Wilcoxon rank sum test', 'Chi-squared test'),
+            'columns_over_spans': (2, 24, 24),
+            'columns': ('Species','n (plates)','2-24','2','3','4','5','6','7','8','9','10','11','12','13','14','15','16','17','18','19','20','21','22','23','24','2-24','2','3','4','5','6','7','8','9','10','11','12','13','14','15','16','17','18','19','20','21','22','23','24')
+        }
 
-    def summarize_results(self, results):
-        """Return a summary report from a list of analysis reports `results`.
+    def summarize_results(self, rows):
+        """Return a summary report from a list of summary rows `rows`.
+
+        The rows are obtained with :meth:`summarize_result` for each analysis
+        report.
 
         Creates a dictionary in the following format ::
 
@@ -268,104 +403,22 @@ class BeginBatch(Begin):
             }
         """
         summary = {
-            'attr': {
-                'columns_over': ('..', 'Wilcoxon rank sum test', 'Chi-squared test'),
-                'columns_over_spans': (2, 24, 24),
-                'columns': ('Species','n (plates)','2-24','2','3','4','5','6','7','8','9','10','11','12','13','14','15','16','17','18','19','20','21','22','23','24','2-24','2','3','4','5','6','7','8','9','10','11','12','13','14','15','16','17','18','19','20','21','22','23','24')
-            },
-            'results': []
+            'attr': self.get_summary_attr(),
+            'results': sorted(rows)
         }
-        for result in results:
-            chi_squared = None
-            wilcoxon = None
-            species_selection = [s for s in result.species_selections[0].values()]
-            species = species_selection[0]['name_latin']
-            if 'wilcoxon_spots_repeats' in result.statistics:
-                wilcoxon = result.statistics['wilcoxon_spots_repeats'][0]
-            if 'chi_squared_spots' in result.statistics:
-                chi_squared = result.statistics['chi_squared_spots'][0]
-
-            # Figure out for which positive spots number the result was
-            # significant. A result is considered significant if
-            # (confidence level)% of the test repeats were significant.
-            positive_spots = [-24,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24]
-            row = []
-            for spots in positive_spots:
-                if not wilcoxon:
-                    row.append(None)
-                    continue
-                stats = wilcoxon['results'].get(spots, None)
-                if stats:
-                    # Calculate the P-value.
-                    # Attraction and repulsion should not be summed up
-                    # because they contradict. Only use the major value.
-                    if stats['n_attraction'] > stats['n_repulsion']:
-                        major = stats['n_attraction']
-                    else:
-                        major = stats['n_repulsion']
-                    p = 1 - float(major) / wilcoxon['attr']['repeats']
-
-                    if setlyze.std.is_significant(p, self.alpha_level):
-                        if stats['n_attraction'] > stats['n_repulsion']:
-                            code = 'at'
-                        else:
-                            code = 'rp'
-                    else:
-                        code = 'ns'
-                    row.append("%s; p=%.4f" % (code,p))
-                else:
-                    row.append(None)
-
-            # Add the results for the Chi squared tests.
-            for spots in positive_spots:
-                if not chi_squared:
-                    row.append(None)
-                    continue
-                stats = chi_squared['results'].get(spots, None)
-                if stats:
-                    # Check if the result was significant. When all values are
-                    # 0 the p-value will be NaN. Function `is_significant` will
-                    # raise ValueError if the p-value is NaN.
-                    try:
-                        significant = setlyze.std.is_significant(stats['p_value'], self.alpha_level)
-                    except ValueError:
-                        significant = False
-
-                    if significant:
-                        if stats['mean_observed'] < stats['mean_expected']:
-                            code = 'at'
-                        else:
-                            code = 'rp'
-                    else:
-                        code = 'ns'
-
-                    row.append("%s; χ²=%.2f; p=%.4f" %
-                        (code, stats['chi_squared'], stats['p_value']))
-                else:
-                    # No data.
-                    row.append(None)
-
-            # Only add the row to the report if one item in the row was
-            # significant.
-            for val in row:
-                if val and re.match('^(s|at|rp);', val):
-                    r = [species, result.get_option('Total plates')]
-                    r.extend(row)
-                    summary['results'].append(r)
-                    break
 
         # Create a report object from the dictionary.
         report = setlyze.report.Report()
         report.set_statistics('positive_spots_summary', summary)
         return report
 
-    def on_display_results(self, sender, results=[]):
+    def on_display_results(self, sender, rows=[]):
         """Create a summary report and display it in a report dialog.
 
         This method is used as a handler for the "pool-finished" signal.
-        The batch results `results` are attached to the signal.
+        The rows for the summary report `rows` are attached to the signal.
         """
-        report = self.summarize_results(results)
+        report = self.summarize_results(rows)
 
         # Set analysis options.
         report.set_option('Alpha level', self.alpha_level)
@@ -389,7 +442,7 @@ class BeginBatch(Begin):
             "Batch report for analysis Attraction within Species",
             'summary-report-attraction-within-species')
         # Enable export of individual reports.
-        if len(self.results) > 0:
+        if len(self.exported) > 0:
             w.toolbutton_save_all.set_sensitive(True)
 
 class Analysis(AnalysisWorker):
@@ -451,63 +504,77 @@ class Analysis(AnalysisWorker):
         Design Part: 1.59
         """
         if not self.stopped():
-            # Make an object that facilitates access to the database.
-            self.db = setlyze.database.get_database_accessor()
-
-            # Create temporary tables.
-            self.db.create_table_species_spots_1()
-            self.db.create_table_plate_spot_totals()
-            self.db.create_table_spot_distances_observed()
-            self.db.create_table_spot_distances_expected()
-            self.db.conn.commit()
-
-            # Get the record IDs that match the locations + species selection.
-            rec_ids = self.db.get_record_ids(self.locations_selection, self.species_selection)
-            logging.info("\tTotal records that match the species+locations selection: %d" % len(rec_ids))
-
-            # Make a spots table for the selected species.
-            logging.info("\tCreating table with species spots...")
-            self.exec_task('progress.increase', "Creating table with species spots...")
-            self.db.set_species_spots(rec_ids, slot=0)
+            with self.stage('prepare'):
+                # Make an object that facilitates access to the database.
+                self.db = setlyze.database.get_database_accessor()
+
+                # Create temporary tables.
+                self.db.create_table_species_spots_1()
+                self.db.create_table_plate_spot_totals()
+                self.db.create_table_spot_distances_observed()
+                self.db.create_table_spot_distances_expected()
+                self.db.conn.commit()
+
+            with self.stage('get_record_ids') as stage:
+                # Get the record IDs that match the locations + species selection.
+                rec_ids = self.db.get_record_ids(self.locations_selection, self.species_selection)
+                logging.info("\tTotal records that match the species+locations selection: %d" % len(rec_ids))
+                stage['rows'] = len(rec_ids)
+
+            with self.stage('set_species_spots') as stage:
+                # Make a spots table for the selected species.
+                logging.info("\tCreating table with species spots...")
+                self.exec_task('progress.increase', "Creating table with species spots...")
+                self.db.set_species_spots(rec_ids, slot=0)
+                stage['rows'] = len(rec_ids)
 
         if not self.stopped():
-            # Combine records with the same plate ID.
-            logging.info("\tCombining records with the same plate ID...")
-            self.exec_task('progress.increase', "Combining records with the same plate ID...")
-            n_plates_unique = self.db.make_plates_unique(slot=0)
-            logging.info("\t  %d records remaining." % (n_plates_unique))
+            with self.stage('make_plates_unique') as stage:
+                # Combine records with the same plate ID.
+                logging.info("\tCombining records with the same plate ID...")
+                self.exec_task('progress.increase', "Combining records with the same plate ID...")
+                n_plates_unique = self.db.make_plates_unique(slot=0)
+                logging.info("\t  %d records remaining." % (n_plates_unique))
+                stage['rows'] = n_plates_unique
 
         if not self.stopped():
-            # Save the positive spot totals for each plate to the database.
-            logging.info("\tSaving the positive spot totals for each plate...")
-            self.exec_task('progress.increase', "Saving the positive spot totals for each plate...")
-            self.affected, skipped = self.db.fill_plate_spot_totals_table('species_spots_1')
-            logging.info("\tSkipping %d records with too few positive spots." % skipped)
-            logging.info("\t  %d records remaining." % self.affected)
-
-            # Calculate the observed spot distances.
-            logging.info("\tCalculating the intra-specific distances for the selected species...")
-            self.exec_task('progress.increase', "Calculating the intra-specific distances for the selected species...")
-            self.calculate_distances_intra()
+            with self.stage('plate_spot_totals') as stage:
+                # Save the positive spot totals for each plate to the database.
+                logging.info("\tSaving the positive spot totals for each plate...")
+                self.exec_task('progress.increase', "Saving the positive spot totals for each plate...")
+                self.affected, skipped = self.db.fill_plate_spot_totals_table('species_spots_1')
+                logging.info("\tSkipping %d records with too few positive spots." % skipped)
+                logging.info("\t  %d records remaining." % self.affected)
+                stage['rows'] = self.affected + skipped
+
+            with self.stage('distances') as stage:
+                # Calculate the observed spot distances.
+                logging.info("\tCalculating the intra-specific distances for the selected species...")
+                self.exec_task('progress.increase', "Calculating the intra-specific distances for the selected species...")
+                self.calculate_distances_intra()
+                stage['rows'] = self.affected
 
         if not self.stopped():
-            # Perform the repeats for the Wilcoxon rank sum test. This will
-            # repeatedly calculate the expected totals. The expected values of
-            # the last repeat will be used for the non-repeated Wilcoxon test.
-            logging.info("\tPerforming statistical tests with %d repeats..." %
-                self.n_repeats)
-            self.exec_task('progress.increase',
-                "Performing statistical tests with %s repeats..." %
-                self.n_repeats)
-            self.repeat_wilcoxon_test(self.n_repeats)
+            with self.stage('repeats') as stage:
+                # Perform the repeats for the Wilcoxon rank sum test. This will
+                # repeatedly calculate the expected totals. The expected values of
+                # the last repeat will be used for the non-repeated Wilcoxon test.
+                logging.info("\tPerforming statistical tests with %d repeats..." %
+                    self.n_repeats)
+                self.exec_task('progress.increase',
+                    "Performing statistical tests with %s repeats..." %
+                    self.n_repeats)
+                self.repeat_wilcoxon_test(self.n_repeats)
+                stage['rows'] = self.affected * self.n_repeats
 
         if not self.stopped():
-            # Perform the Chi-squared and Wilcoxon rank sum test (non-repeated).
-            # The expected values for the last repeat is used for this Wilcoxon
-            # test.
-            logging.info("\tPerforming statistical tests...")
-            self.exec_task('progress.increase', "Performing statistical tests...")
-            self.calculate_significance()
+            with self.stage('significance'):
+                # Perform the Chi-squared and Wilcoxon rank sum test (non-repeated).
+                # The expected values for the last repeat is used for this Wilcoxon
+                # test.
+                logging.info("\tPerforming statistical tests...")
+                self.exec_task('progress.increase', "Performing statistical tests...")
+                self.calculate_significance()
 
         # If the cancel button is pressed don't finish this function.
         if self.stopped():
@@ -515,9 +582,10 @@ class Analysis(AnalysisWorker):
             self.on_exit()
             return None
 
-        # Generate the report.
-        self.exec_task('progress.increase', "Generating the analysis report...")
-        self.generate_report()
+        with self.stage('report'):
+            # Generate the report.
+            self.exec_task('progress.increase', "Generating the analysis report...")
+            self.generate_report()
 
         # Update the progress bar.
         logging.info("%s was completed!" % setlyze.locale.text('analysis-attraction-intra'))
@@ -709,6 +777,9 @@ class Analysis(AnalysisWorker):
         spot_totals = [2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,
             23,24,-24]
 
+        # Collect the distances for each group of plates, so that the tests
+        # for all groups can be performed with a single call to R.
+        groups = []
         for n_spots in spot_totals:
             # Get both sets of distances from plates per total spot numbers.
             observed = self.db.get_distances_matching_spots_total(
@@ -725,88 +796,105 @@ class Analysis(AnalysisWorker):
             # number of positive spots.
             n_plates = self.db.matching_plates_total
 
-            # Get the lengths.
-            count_observed = len(observed)
-            count_expected = len(expected)
-
             # The number of observed and expected spot distances must always
             # be the same.
-            assert count_observed == count_expected, \
+            assert len(observed) == len(expected), \
                 "Number of observed and expected values are not equal."
 
             # A minimum of 2 observed distances is required for the
             # significance test. So skip this spots number if it's less.
-            if count_observed < 2:
+            if len(observed) < 2:
                 continue
 
+            groups.append((n_spots, n_plates, observed, expected))
+
+        # Perform the two sample Wilcoxon test for each group.
+        wilcoxon_results = wilcox_test_batch(
+            [(observed, expected) for n_spots, n_plates, observed, expected in groups],
+            alternative = "two.sided", paired = False,
+            conf_level = 1 - self.alpha_level,
+            conf_int = False)
+
+        # Get the probability for each spot distance (used for the
+        # Chi-squared test).
+        spot_dist_to_prob = setlyze.config.cfg.get('spot-dist-to-prob-intra')
+        probabilities = spot_dist_to_prob.values()
+
+        # Get the frequencies for the observed distances of each group.
+        frequencies = [setlyze.std.distance_frequency(observed, 'intra').values()
+            for n_spots, n_plates, observed, expected in groups]
+
+        # For the Chi-squared test the expected frequencies should not be
+        # less than 5, so only test the groups for which none is.
+        chisq_groups = [i for i, freq in enumerate(frequencies)
+            if sum(freq) * min(probabilities) >= 5]
+
+        # Also perform the Chi-squared test on the frequencies of these
+        # groups.
+        chisq_results = dict(zip(chisq_groups, chisq_test_batch(
+            [frequencies[i] for i in chisq_groups], p = probabilities)))
+
+        for i, (group, wilcoxon) in enumerate(zip(groups, wilcoxon_results)):
+            n_spots, n_plates, observed, expected = group
+
             # Calculate the means.
             mean_observed = setlyze.std.mean(observed)
             mean_expected = setlyze.std.mean(expected)
 
-            # Perform the two sample Wilcoxon test.
-            test_result = wilcox_test(observed, expected,
-                alternative = "two.sided", paired = False,
-                conf_level = 1 - self.alpha_level,
-                conf_int = False)
-
             # Set some test attributes for the report.
-            if not self.statistics['wilcoxon_spots_repeats']['attr']:
+            statistic, p_value, method = wilcoxon
+            if method and not self.statistics['wilcoxon_spots_repeats']['attr']:
                 self.statistics['wilcoxon_spots_repeats']['attr'] = {
-                    'method': test_result['method'],
-                    'alternative': test_result['alternative'],
+                    'method': method,
+                    'alternative': "two.sided",
                     'conf_level': 1 - self.alpha_level,
                     'paired': False,
                     'repeats': self.n_repeats,
                     'groups': 'spots',
                 }
-            if not self.statistics['wilcoxon_spots']['attr']:
+            if method and not self.statistics['wilcoxon_spots']['attr']:
                 self.statistics['wilcoxon_spots']['attr'] = {
-                    'method': test_result['method'],
-                    'alternative': test_result['alternative'],
+                    'method': method,
+                    'alternative': "two.sided",
                     'conf_level': 1 - self.alpha_level,
                     'paired': False,
                     'groups': 'spots',
                 }
 
-            # Save the test result.
-            self.statistics['wilcoxon_spots']['results'][n_spots] = {
-                'n_plates': n_plates,
-                'n_values': count_observed,
-                'p_value': test_result['p.value'],
-                'mean_observed': mean_observed,
-                'mean_expected': mean_expected,
-            }
-
-            # Get the probability for each spot distance (used for the
-            # Chi-squared test).
-            spot_dist_to_prob = setlyze.config.cfg.get('spot-dist-to-prob-intra')
-
-            # Get the frequencies for the observed distances (used for the
-            # Chi-squared test).
-            observed_freq = setlyze.std.distance_frequency(observed, 'intra')
-
-            # Also perform the Chi-squared test.
-            test_result = chisq_test(observed_freq.values(),
-                p = spot_dist_to_prob.values())
+            # Save the test result, unless the test failed.
+            if not method:
+                logging.warning("The Wilcoxon test failed for group %s" %
+                    n_spots)
+            else:
+                self.statistics['wilcoxon_spots']['results'][n_spots] = {
+                    'n_plates': n_plates,
+                    'n_values': len(observed),
+                    'p_value': p_value,
+                    'mean_observed': mean_observed,
+                    'mean_expected': mean_expected,
+                }
 
-            # If we find an expected frequency that is less than 5, do not save
-            # the result.
-            for f in test_result['expected']:
-                if f < 5:
-                    continue
+            # Groups with expected frequencies less than 5 were not tested.
+            if i not in chisq_results:
+                continue
 
-            # Save the test result.
+            # Save the Chi-squared test result.
+            chi_squared, df, p_value, method = chisq_results[i]
+            if not method:
+                logging.warning("The Chi-squared test failed for group %s" %
+                    n_spots)
+                continue
             if not self.statistics['chi_squared_spots']['attr']:
                 self.statistics['chi_squared_spots']['attr'] = {
-                    'method': test_result['method'],
+                    'method': method,
                     'groups': 'spots',
                 }
             self.statistics['chi_squared_spots']['results'][n_spots] = {
                 'n_plates': n_plates,
-                'n_values': count_observed,
-                'chi_squared': test_result['statistic']['X-squared'],
-                'p_value': test_result['p.value'],
-                'df': test_result['parameter']['df'],
+                'n_values': len(observed),
+                'chi_squared': chi_squared,
+                'p_value': p_value,
+                'df': df,
                 'mean_observed': mean_observed,
                 'mean_expected': mean_expected,
             }
@@ -859,6 +947,9 @@ class Analysis(AnalysisWorker):
         spot_totals = [2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,
             23,24,-24]
 
+        # Collect the distances for each group of plates, so that the tests
+        # for all groups can be performed with a single call to R.
+        groups = []
         for n_spots in spot_totals:
             # Get both sets of distances from plates per total spot numbers.
             observed = self.db.get_distances_matching_spots_total(
@@ -871,46 +962,42 @@ class Analysis(AnalysisWorker):
             observed = list(observed)
             expected = list(expected)
 
-            # Get the list lengths.
-            count_observed = len(observed)
-            count_expected = len(expected)
-
             # The number of observed and expected spot distances must always
             # be the same.
-            assert count_observed == count_expected, \
+            assert len(observed) == len(expected), \
                 "Number of observed and expected values are not equal."
 
             # A minimum of 2 observed distances is required for the
             # significance test. So skip this spots number if it's less.
-            if count_observed < 2:
+            if len(observed) < 2:
                 continue
 
-            # Calculate the means.
-            mean_observed = setlyze.std.mean(observed)
-            mean_expected = setlyze.std.mean(expected)
-
             # Check if this spots number is present in the statistics variable.
             # If not, create it.
             if n_spots not in self.statistics['wilcoxon_spots_repeats']['results']:
                 self.statistics['wilcoxon_spots_repeats']['results'][n_spots] = {
                     'n_plates': self.db.matching_plates_total,
-                    'n_values': count_observed,
+                    'n_values': len(observed),
                     'n_significant': 0,
                     'n_attraction': 0,
                     'n_repulsion': 0
                 }
 
-            # Perform two sample Wilcoxon tests.
-            test_result = wilcox_test(observed, expected,
-                alternative = "two.sided", paired = False,
-                conf_level = 1 - self.alpha_level,
-                conf_int = False)
+            groups.append((n_spots, observed, expected))
+
+        # Perform two sample Wilcoxon tests.
+        test_results = wilcox_test_batch(
+            [(observed, expected) for n_spots, observed, expected in groups],
+            alternative = "two.sided", paired = False,
+            conf_level = 1 - self.alpha_level,
+            conf_int = False)
 
+        for (n_spots, observed, expected), test_result in zip(groups, test_results):
             # Check if the result was significant. When all values are
             # 0 the p-value will be NaN. Function `is_significant` will
             # raise ValueError if the p-value is NaN.
             try:
-                significant = setlyze.std.is_significant(test_result['p.value'], self.alpha_level)
+                significant = setlyze.std.is_significant(test_result[1], self.alpha_level)
             except ValueError:
                 significant = False
 
@@ -920,7 +1007,7 @@ class Analysis(AnalysisWorker):
 
                 # If significant, also check if there is preference or
                 # rejection for this plate area.
-                if mean_observed < mean_expected:
+                if setlyze.std.mean(observed) < setlyze.std.mean(expected):
                     # Increase attracion counter with one.
                     self.statistics['wilcoxon_spots_repeats']['results'][n_spots]['n_attraction'] += 1
                 else:
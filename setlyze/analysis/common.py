@@ -22,10 +22,23 @@
 """Common classes and routines for analysis modules."""
 
 import os
+import json
+import shutil
+import socket
 import logging
+import cProfile
+import contextlib
+import collections
 import multiprocessing
+import multiprocessing.pool
+import tempfile
 import threading
 import time
+try:
+    import resource
+except ImportError:
+    # Module resource is not available on Windows.
+    resource = None
 
 import gobject
 import pygtk
@@ -33,18 +46,58 @@ pygtk.require('2.0')
 import gtk
 
 import setlyze
+import setlyze.checkpoint
 import setlyze.config
+import setlyze.database
+import setlyze.distributed
 import setlyze.report
+import setlyze.stats
 from setlyze.gui import ProgressDialogHandler
 from setlyze.std import slugify
 
+# The resource usage measured for each stage of an analysis. See
+# :meth:`AnalysisWorker.stage`.
+USAGE_KEYS = ('wall', 'cpu', 'sql_statements', 'sql_time', 'r_calls', 'r_time')
+
+# The estimated cost of an analysis that doesn't depend on the amount of
+# data, in the unit of the cost estimates of the analysis modules (about the
+# cost of processing one record). See :func:`schedule_jobs`.
+JOB_OVERHEAD = 100
+
+# The number of seconds the collector thread of a batch waits for a result
+# before it checks if it must stop. See :meth:`PrepareAnalysis.collect_results`.
+COLLECT_POLL_TIMEOUT = 1.0
+
+# Event that is set when the analyses in the process pool of the current
+# worker process must be canceled. It is set for each worker process by
+# :func:`init_worker`.
+cancel_event = None
+
+def init_worker(event):
+    """Initialize a worker process of a process pool.
+
+    Argument `event` is a :py:class:`multiprocessing.Event` that is shared by
+    all workers of the pool. Analyses stop at the next stage or repeat once
+    the event is set (see :meth:`AnalysisWorker.stopped`).
+    """
+    global cancel_event
+    cancel_event = event
+
+    # Open the local database read-only and keep temporary files in a folder
+    # of this process, so the workers don't contend for the same files.
+    setlyze.database.init_worker_storage()
+
 def calculate(cls, args):
     """Create an instance of class `cls` and call its run() method.
 
     Arguments `args` are unpacked and passed to `cls` when it is instantiated.
-    Returns the result returned by `cls`.run().
+    Returns the result returned by `cls`.run(). Instances of
+    :class:`AnalysisWorker` are run with
+    :meth:`AnalysisWorker.run_instrumented` instead.
     """
     obj = cls(*args)
+    if isinstance(obj, AnalysisWorker):
+        return obj.run_instrumented()
     result = obj.run()
     return result
 
@@ -59,6 +112,88 @@ def calculatestar(args):
     """
     return calculate(*args)
 
+def calculatechunk(chunk):
+    """Run the batch jobs in the list `chunk`.
+
+    Each item of `chunk` must be a tuple ``(key, job)``, where `job` is a
+    list of two items as expected by :meth:`calculatestar`. Returns a list
+    of tuples ``(key, result, seconds, error)`` with the result of each job,
+    the time in seconds it took to run the job and an error message if the
+    job raised an exception (the result is None in that case).
+    """
+    results = []
+    for key, job in chunk:
+        start = time.time()
+        try:
+            result, error = calculate(*job), None
+        except Exception as e:
+            logging.exception("Analysis %s failed" % key)
+            result, error = None, "%s: %s" % (e.__class__.__name__, e)
+        results.append((key, result, time.time() - start, error))
+    return results
+
+def schedule_jobs(jobs, costs, processes):
+    """Return the batch jobs `jobs` ordered by cost and grouped in chunks.
+
+    Argument `jobs` is a list of ``(key, job)`` tuples and `costs` is a
+    dictionary with the estimated cost for each job key (see the
+    ``estimate_costs()`` functions of the analysis modules). Jobs without
+    an estimate get the mean cost. `processes` is the number of worker
+    processes.
+
+    The jobs are ordered longest first, so the heaviest analyses don't end
+    up at the end of the batch when most workers are idle. The ordered jobs
+    are then grouped in chunks: jobs are added to a chunk as long as its
+    cost stays below the total cost divided by eight times the number of
+    processes. Heavy jobs get a chunk of their own and cheap jobs are
+    combined to limit the overhead of passing jobs to the workers, while
+    the last chunks are small enough for the workers to finish at about
+    the same time.
+
+    Returns a list of chunks for :func:`calculatechunk`.
+    """
+    if not jobs:
+        return []
+    known = [costs[key] for key, job in jobs if key in costs]
+    default = sum(known) / len(known) if known else 0
+    jobs = sorted(jobs, key=lambda x: costs.get(x[0], default), reverse=True)
+
+    processes = processes or setlyze.config.cfg.get('cpu-count')
+    total = sum(costs.get(key, default) + JOB_OVERHEAD for key, job in jobs)
+    target = float(total) / (8 * processes)
+    chunks = []
+    chunk, chunk_cost = [], 0
+    for key, job in jobs:
+        cost = costs.get(key, default) + JOB_OVERHEAD
+        if chunk and chunk_cost + cost > target:
+            chunks.append(chunk)
+            chunk, chunk_cost = [], 0
+        chunk.append((key, job))
+        chunk_cost += cost
+    chunks.append(chunk)
+    return chunks
+
+def get_report_filename(result, prefix=''):
+    """Return the file name for exporting the report `result`.
+
+    Argument `prefix` is an optional prefix for the file name. File names
+    are created in the format ``[prefix]speciesA[_speciesB].rst``.
+    """
+    species_list = []
+    for selection in result.species_selections:
+        species_selection = [s for s in selection.values()]
+        # In batch mode there should be just one species per selection.
+        species = species_selection[0]['name_latin']
+        if not species: species = species_selection[0]['name_common']
+        species_list.append(species)
+
+    if len(species_list) == 2:
+        filename = "%s%s_%s.rst" % (prefix, species_list[0], species_list[1])
+    else:
+        filename = "%s%s.rst" % (prefix, species_list[0])
+    # Remove unwanted characters from the filename.
+    return slugify(filename)
+
 class Pool(threading.Thread):
     """Create a pool of worker processes.
 
@@ -295,20 +430,41 @@ class PrepareAnalysis(object):
     def __init__(self):
         self.alpha_level = None
         self.areas_definition = None
+        self.batch_finished = False
+        self.batch_lock = threading.Lock()
+        self.batch_processes = None
+        self.batch_start = None
+        self.busy_time = 0.0
+        self.cancel_event = None
+        self.checkpoint = None
+        self.collector = None
+        self.collector_stop = threading.Event()
         self.elapsed_time = None
+        self.exported = []
+        self.job_costs = {}
+        self.job_timings = []
         self.locations_selection = None
         self.locations_selections = [None,None]
         self.n_repeats = None
         self.pdialog = None
         self.pdialog_handler = None
         self.pool = None
+        self.pool_result = None
+        self.n_finished = 0
+        self.n_jobs = 0
         self.n_processes = None
+        self.n_results = 0
         self.report_prefix = "report_"
         self.results = []
         self.signal_handlers = {}
+        self.spool_path = None
+        self.stage_times = collections.OrderedDict()
         self.start_time = None
         self.species_selection = None
         self.species_selections = [None,None]
+        self.statistics_table = None
+        self.summary_rows = []
+        self.summary_table = None
 
         self.set_analysis_options()
 
@@ -321,6 +477,412 @@ class PrepareAnalysis(object):
         self.n_processes = setlyze.config.cfg.get('concurrent-processes')
         self.n_repeats = setlyze.config.cfg.get('test-repeats')
 
+    def get_pool(self, processes=None, **kwargs):
+        """Return a process pool with `processes` worker processes.
+
+        The workers share the event `cancel_event`, which is set by
+        :meth:`on_cancel_button` to stop the analyses. Keyword arguments are
+        passed to :py:class:`multiprocessing.Pool`.
+        """
+        self.cancel_event = multiprocessing.Event()
+        return multiprocessing.Pool(processes, initializer=init_worker,
+            initargs=(self.cancel_event,), **kwargs)
+
+    def get_coordinator(self):
+        """Return a coordinator that serves the jobs of a batch to workers on
+        other hosts.
+
+        The coordinator (see :mod:`setlyze.distributed`) listens on the
+        address set with configurations ``coordinator-host`` and
+        ``coordinator-port``. It is used in place of the process pool
+        returned by :meth:`get_pool`. Returns None if no secret key is set
+        or if the coordinator can't listen on the address, in which case the
+        batch runs in a local process pool.
+        """
+        authkey = setlyze.config.cfg.get('coordinator-authkey')
+        if not authkey:
+            logging.warning("Configuration coordinator-authkey is not set, "
+                "running the batch on this computer")
+            return None
+
+        address = (setlyze.config.cfg.get('coordinator-host'),
+            setlyze.config.cfg.get('coordinator-port'))
+        db = setlyze.database.get_database_accessor()
+        fingerprint = db.get_data_fingerprint()
+        # Move the changes in the write-ahead log to the database file, so
+        # the workers get all data with the copy of the file.
+        db.checkpoint_wal()
+        db.close()
+        self.cancel_event = threading.Event()
+        try:
+            return setlyze.distributed.Coordinator(address, authkey,
+                self.cancel_event, setlyze.config.cfg.get('db-file'),
+                fingerprint)
+        except socket.error as e:
+            logging.warning("Cannot listen on %s:%d, running the batch on "
+                "this computer: %s" % (address + (e,)))
+            return None
+
+    def canceled(self):
+        """Return True if the analysis was canceled by the user."""
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def open_checkpoint(self, analysis, parameters, n_jobs):
+        """Open the checkpoint for a batch analysis.
+
+        Argument `analysis` is the name of the analysis module, `parameters`
+        is a dictionary with the keyword arguments for ``get_batch_jobs()``
+        of that module and `n_jobs` is the number of jobs in the batch. If
+        the same batch was interrupted before, the user is asked whether to
+        resume it. Otherwise a new checkpoint is created (see
+        :mod:`setlyze.checkpoint`). The checkpoint is set as attribute
+        `checkpoint`.
+        """
+        self.checkpoint = None
+        if not setlyze.config.cfg.get('checkpoint-batches'):
+            return
+
+        db = setlyze.database.get_database_accessor()
+        fingerprint = setlyze.checkpoint.get_fingerprint(analysis, parameters,
+            db.get_data_fingerprint())
+        db.close()
+        checkpoint = setlyze.checkpoint.find_checkpoint(analysis, fingerprint)
+
+        if checkpoint and checkpoint.completed:
+            dialog = gtk.MessageDialog(parent=None, flags=0,
+                type=gtk.MESSAGE_QUESTION, buttons=gtk.BUTTONS_YES_NO,
+                message_format="Resume batch?")
+            dialog.format_secondary_text("The same batch was started on %s "
+                "and %d of %d analyses were finished. Do you want to resume "
+                "the batch? Otherwise all analyses are performed again." %
+                (checkpoint.manifest['created'].replace('T', ' '),
+                len(checkpoint.completed), checkpoint.manifest['n_jobs']))
+            dialog.set_position(gtk.WIN_POS_CENTER)
+            response = dialog.run()
+            dialog.destroy()
+            if response == gtk.RESPONSE_YES:
+                logging.info("Resuming batch from checkpoint %s" %
+                    checkpoint.name)
+                self.checkpoint = checkpoint
+                return
+
+        checkpoint = setlyze.checkpoint.Checkpoint(
+            setlyze.checkpoint.get_checkpoint_path(analysis, fingerprint))
+        try:
+            checkpoint.create(analysis, parameters, n_jobs, fingerprint)
+        except (IOError, OSError) as e:
+            logging.warning("Failed to create checkpoint: %s" % e)
+            return
+        self.checkpoint = checkpoint
+
+    def start_batch(self, jobs, steps_per_job, processes=None, costs=None,
+            **kwargs):
+        """Run the analysis jobs `jobs` of a batch analysis.
+
+        Argument `jobs` is a list of ``(key, job)`` tuples, as returned by
+        ``get_batch_jobs()`` of the analysis modules. The progress dialog is
+        updated `steps_per_job` times per job. Jobs that were already
+        finished according to the checkpoint (see :meth:`open_checkpoint`)
+        are skipped and their saved reports are used instead.
+
+        The jobs are ordered and grouped in chunks with :func:`schedule_jobs`,
+        using the estimated cost for each job key in the dictionary `costs`.
+        The chunks are added to a process pool with `processes` worker
+        processes (keyword arguments are passed to :meth:`get_pool`), or
+        served to workers on other hosts if configuration
+        ``distributed-batches`` is set (see :meth:`get_coordinator`). Unlike
+        :py:meth:`multiprocessing.Pool.map_async`, the reports are not kept
+        until all analyses are finished. A separate thread collects each
+        report as soon as its analysis is finished (see
+        :meth:`collect_results`), so the memory usage doesn't grow with the
+        number of analyses.
+        """
+        self.remove_spool()
+        self.spool_path = tempfile.mkdtemp(prefix='setlyze-batch-')
+        self.batch_finished = False
+        self.collector_stop.clear()
+        self.exported = []
+        self.n_finished = 0
+        self.n_jobs = len(jobs)
+        self.n_results = 0
+        self.stage_times = collections.OrderedDict()
+        self.summary_rows = []
+        self.open_tables()
+
+        # Skip the jobs that were finished before.
+        resumed = []
+        if self.checkpoint:
+            resumed = [key for key, job in jobs if key in self.checkpoint.completed]
+            jobs = [(key, job) for key, job in jobs if key not in self.checkpoint.completed]
+            logging.info("Skipping %d analyses that were already finished" %
+                len(resumed))
+
+        if self.pdialog_handler:
+            self.pdialog_handler.set_total_steps(steps_per_job * len(jobs))
+
+        # Load the location and species names before the worker processes
+        # are started, so the workers inherit them.
+        setlyze.report.get_metadata()
+
+        # Serve the jobs to workers on other hosts if configured to do so.
+        self.pool = None
+        if setlyze.config.cfg.get('distributed-batches'):
+            self.pool = self.get_coordinator()
+        if self.pool:
+            processes = setlyze.config.cfg.get('distributed-processes')
+            if self.pdialog_handler:
+                self.pdialog_handler.set_action("Waiting for workers on "
+                    "port %d..." % self.pool.address[1])
+        else:
+            self.pool = self.get_pool(processes, **kwargs)
+        self.pool_result = None
+
+        # Order the jobs longest first and group them in chunks.
+        self.job_costs = costs or {}
+        chunks = schedule_jobs(jobs, self.job_costs, processes)
+        logging.info("Scheduled %d jobs in %d chunks" % (len(jobs),
+            len(chunks)))
+
+        self.batch_processes = processes or setlyze.config.cfg.get('cpu-count')
+        self.batch_start = time.time()
+        self.busy_time = 0.0
+        self.job_timings = []
+
+        results = self.pool.imap_unordered(calculatechunk, chunks)
+        # No more jobs will be added to the pool.
+        self.pool.close()
+
+        self.collector = threading.Thread(target=self.collect_results,
+            args=(results, resumed))
+        self.collector.daemon = True
+        self.collector.start()
+
+    def collect_results(self, results, resumed=()):
+        """Pass each report from the iterator `results` to :meth:`add_result`.
+
+        The reports of the resumed jobs with the keys in `resumed` are loaded
+        from the checkpoint first. The other reports are obtained per chunk
+        (see :func:`calculatechunk`) in the order in which the chunks
+        finish. :meth:`finish_batch` is called
+        when all analyses are finished, or when the event `collector_stop`
+        is set (see :meth:`shutdown_pool`). This method runs in a separate
+        thread.
+        """
+        for key in resumed:
+            self.add_result(self.checkpoint.get_report(key))
+
+        # The results of a process pool are polled, so this thread doesn't
+        # wait forever for workers that were terminated. The results of a
+        # coordinator stop by themselves when it is terminated.
+        poll = isinstance(results, multiprocessing.pool.IMapIterator)
+        while True:
+            try:
+                if poll:
+                    chunk = results.next(COLLECT_POLL_TIMEOUT)
+                else:
+                    chunk = results.next()
+            except multiprocessing.TimeoutError:
+                if self.collector_stop.is_set():
+                    logging.info("Stopped collecting the results of the batch")
+                    break
+                continue
+            except StopIteration:
+                break
+            except Exception:
+                logging.exception("A chunk of analyses in the batch failed")
+                continue
+            for key, result, seconds, error in chunk:
+                if error:
+                    # Don't let one failed analysis stop the whole batch.
+                    # The job is not saved to the checkpoint, so it is
+                    # performed again when the batch is resumed.
+                    logging.error("Analysis %s failed: %s" % (key, error))
+                    key = None
+                self.add_result(result, key, seconds)
+        self.finish_batch()
+
+    def add_result(self, result, key=None, seconds=None):
+        """Process the report `result` of a finished analysis in a batch.
+
+        If the job key `key` is set, the report is saved to the checkpoint.
+        The time `seconds` it took to run the job is recorded for
+        :meth:`log_utilisation`. Then the progress dialog is updated, the
+        resource usage is logged, the report is exported to the spool folder
+        and the row for the summary report is obtained with
+        :meth:`summarize_result`. The report itself is not kept.
+        """
+        with self.batch_lock:
+            if self.batch_finished:
+                return
+
+            if seconds is not None:
+                self.busy_time += seconds
+                if key is not None:
+                    self.job_timings.append((key, self.job_costs.get(key),
+                        seconds))
+
+            # Analyses that were stopped because the batch was canceled
+            # return no report. Don't save those, so they are performed
+            # when the batch is resumed.
+            has_report = result and not result.is_empty()
+            if self.checkpoint and key is not None and \
+                    (has_report or not self.canceled()):
+                try:
+                    self.checkpoint.add(key, result)
+                except (IOError, OSError) as e:
+                    logging.warning("Failed to save %s to the checkpoint: %s" %
+                        (key, e))
+
+            self.n_finished += 1
+            # The handler is cleared when the analysis is canceled, so get
+            # it once.
+            handler = self.pdialog_handler
+            if handler:
+                handler.set_action("Finished %d of %d analyses" %
+                    (self.n_finished, self.n_jobs))
+            if not has_report:
+                return
+            self.n_results += 1
+
+            # Add the time spent in each stage to the totals.
+            if result.instrumentation:
+                self.write_instrumentation([result])
+                self.add_stage_times(self.stage_times, result)
+
+            # Export the report, so the individual reports can be saved
+            # without keeping them in memory.
+            path = os.path.join(self.spool_path,
+                get_report_filename(result, self.report_prefix))
+            try:
+                setlyze.report.export(result, path, 'rst')
+            except Exception:
+                logging.exception("Failed to export report to %s" % path)
+            else:
+                self.exported.append(path)
+
+            # Fold the report into the summary.
+            row = self.summarize_result(result)
+            if row:
+                self.summary_rows.append(row)
+
+            # Add the rows to the batch tables.
+            try:
+                if self.summary_table and row:
+                    self.summary_table.write_row(row)
+                if self.statistics_table:
+                    for stats in setlyze.report.iter_statistics_rows(result):
+                        self.statistics_table.write_row(stats)
+            except (IOError, OSError) as e:
+                logging.warning("Failed to write the batch tables: %s" % e)
+                self.close_tables()
+
+    def finish_batch(self):
+        """Finish a batch analysis once all reports are collected.
+
+        The rows for the summary report are sent along with the
+        "pool-finished" signal (see :meth:`emit_results`). The checkpoint is
+        removed if all analyses of the batch were finished. This method does
+        nothing if the batch was already finished.
+        """
+        with self.batch_lock:
+            if self.batch_finished:
+                return
+            self.batch_finished = True
+            self.close_tables()
+
+        if self.checkpoint and self.checkpoint.is_complete():
+            self.checkpoint.remove()
+            self.checkpoint = None
+
+        if self.stage_times:
+            self.log_stage_times(self.stage_times, self.n_results)
+        # The number of remote worker processes is only known afterwards.
+        if getattr(self.pool, 'n_workers', None):
+            self.batch_processes = self.pool.n_workers
+        self.log_utilisation()
+        self.emit_results(self.summary_rows, self.n_results)
+
+    def open_tables(self):
+        """Open the tables to which the batch summary and the statistics of
+        each analysis are written.
+
+        The tables are written row by row by :meth:`add_result`, so other
+        programs can process the results without parsing the reports. They
+        are saved in the format set with configuration
+        ``batch-table-format`` to the folder set with configuration
+        ``batch-table-path``, or to the spool folder, in which case they are
+        saved along with the individual reports. The summary table has the
+        columns from :meth:`get_summary_attr` and the statistics table the
+        columns from :data:`setlyze.report.STATISTICS_HEADERS`.
+        """
+        self.summary_table = None
+        self.statistics_table = None
+        table_format = setlyze.config.cfg.get('batch-table-format')
+        if table_format not in ('csv', 'tsv'):
+            return
+
+        path = setlyze.config.cfg.get('batch-table-path') or self.spool_path
+        name = "%s_%s" % (self.__module__.split('.')[-1],
+            time.strftime('%Y%m%d-%H%M%S'))
+        delimiter = '\t' if table_format == 'tsv' else ','
+        try:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            attr = self.get_summary_attr()
+            if attr:
+                self.summary_table = setlyze.report.TableWriter(
+                    os.path.join(path, "%s_summary.%s" % (name, table_format)),
+                    setlyze.report.get_table_headers(attr), delimiter)
+            self.statistics_table = setlyze.report.TableWriter(
+                os.path.join(path, "%s_statistics.%s" % (name, table_format)),
+                setlyze.report.STATISTICS_HEADERS, delimiter)
+        except (IOError, OSError) as e:
+            logging.warning("Failed to create the batch tables: %s" % e)
+            self.close_tables()
+
+    def close_tables(self):
+        """Close the batch tables opened by :meth:`open_tables`.
+
+        Tables in the spool folder are added to the exported files, so
+        they are saved along with the individual reports.
+        """
+        for table in (self.summary_table, self.statistics_table):
+            if not table:
+                continue
+            table.close()
+            if self.spool_path and \
+                    os.path.dirname(table.path) == self.spool_path:
+                self.exported.append(table.path)
+            else:
+                logging.info("Batch table saved to %s" % table.path)
+        self.summary_table = None
+        self.statistics_table = None
+
+    def get_summary_attr(self):
+        """Return the attributes of the summary report of a batch analysis,
+        or None if there is no summary.
+
+        The attributes describe the columns of the rows returned by
+        :meth:`summarize_result`. This method must be redefined in the
+        subclass for batch mode.
+        """
+        return None
+
+    def summarize_result(self, result):
+        """Return the row for the summary report of a batch analysis for the
+        analysis report `result`, or None if the row should be left out.
+
+        This method must be redefined in the subclass for batch mode.
+        """
+        return None
+
+    def remove_spool(self):
+        """Remove the folder with the reports exported by :meth:`add_result`."""
+        if self.spool_path:
+            shutil.rmtree(self.spool_path, ignore_errors=True)
+            self.spool_path = None
+        self.exported = []
+
     def get_progress_dialog(self):
         """Return a progress dialog and a handler for the dialog."""
         pd = setlyze.gui.ProgressDialog(title="Performing analysis",
@@ -365,31 +927,85 @@ class PrepareAnalysis(object):
         This method does the following:
 
         * Close the progress dialog.
-        * Stop the worker processes.
+        * Set the cancel event of the process pool. Running analyses stop
+          at the next stage or repeat and analyses that haven't started yet
+          are skipped. The reports of analyses that were already finished
+          are kept and displayed by the "pool-finished" handler.
+        * Wait in a separate thread for the workers to stop. Workers that
+          are still running after ``cancel-timeout`` seconds are terminated.
         * Show an info dialog.
         """
         # Destroy the progress dialog.
         if self.pdialog:
             self.pdialog.destroy()
+            self.pdialog = None
+        # The collector thread of a batch uses the handler while holding
+        # the batch lock.
+        with self.batch_lock:
+            self.pdialog_handler = None
 
         # Stop all workers.
         if self.pool:
-            # TODO: Find a more elegant way to stop processes.
-            self.pool.terminate()
-            self.pool.join()
+            self.cancel_event.set()
+            self.pool.close()
+            t = threading.Thread(target=self.shutdown_pool,
+                args=(setlyze.config.cfg.get('cancel-timeout'),))
+            t.daemon = True
+            t.start()
 
         # Show an info dialog.
         dialog = gtk.MessageDialog(parent=None, flags=0,
             type=gtk.MESSAGE_INFO, buttons=gtk.BUTTONS_OK,
             message_format="Analysis canceled")
-        dialog.format_secondary_text("Analysis aborted by user.")
+        if self.in_batch_mode():
+            dialog.format_secondary_text("Analysis aborted by user. The "
+                "results of the analyses that were already finished will be "
+                "displayed.")
+        else:
+            dialog.format_secondary_text("Analysis aborted by user.")
         dialog.set_position(gtk.WIN_POS_CENTER)
         dialog.run()
         dialog.destroy()
 
-        # Method on_pool_finished() will not be called when calling
-        # pool.terminate(), so close manually.
-        self.on_analysis_closed()
+        if not self.pool:
+            self.on_analysis_closed()
+
+    def shutdown_pool(self, timeout):
+        """Wait for the workers of a canceled analysis to stop.
+
+        If the workers stopped within `timeout` seconds, the results were
+        passed to :meth:`on_pool_finished` or :meth:`finish_batch`. Otherwise
+        the workers are terminated. In batch mode the reports that were
+        already collected are displayed, otherwise the finished results are
+        lost and the analysis is closed.
+        """
+        if self.collector:
+            self.collector.join(timeout)
+            stopped = not self.collector.is_alive()
+        else:
+            if self.pool_result:
+                self.pool_result.wait(timeout)
+            stopped = self.pool_result and self.pool_result.ready()
+        if stopped:
+            self.pool.join()
+            return
+
+        logging.warning("Workers did not stop within %s seconds, "
+            "terminating them" % timeout)
+        self.pool.terminate()
+        self.pool.join()
+
+        if self.collector:
+            # The results of the terminated workers never arrive, so stop
+            # the collector thread and finish with the reports collected so
+            # far.
+            self.collector_stop.set()
+            self.collector.join()
+            self.finish_batch()
+        else:
+            # Method on_pool_finished() will not be called when calling
+            # pool.terminate(), so close manually.
+            self.on_analysis_closed()
 
     def on_analysis_closed(self, sender=None, data=None, timeout=0):
         """Exit an analysis elegantly.
@@ -417,6 +1033,9 @@ class PrepareAnalysis(object):
         # the result that callback functions are called multiple times.
         self.unset_signal_handlers()
 
+        # Remove the reports exported during a batch analysis.
+        self.remove_spool()
+
     def on_pool_finished(self, results):
         """Collect the analysis results when a process pool is finished.
 
@@ -437,37 +1056,178 @@ class PrepareAnalysis(object):
            works fine on GNU/Linux systems, this causes the GUI to hang on
            Windows.
         """
+        # Log the resource usage of the analyses.
+        self.log_instrumentation(results)
+
+        # Only keep the non-empty results.
+        results[:] = [r for r in results if r and not r.is_empty()]
+
+        # Save the results locally.
+        self.results = results
+
+        self.emit_results(results, len(results))
+
+    def emit_results(self, results, n_results):
+        """Send the "pool-finished" signal with `results` attached.
+
+        This method is called by :meth:`on_pool_finished` and
+        :meth:`finish_batch` when all analyses are finished. It calculates
+        the elapsed time since the start of the analyses and sets the
+        progress dialog to 100%. If there are no non-empty reports
+        (`n_results` is 0), emit signal "no-results" and close the analysis
+        instead.
+        """
         # Set the elapsed time if the start time was set.
         if self.start_time:
             self.elapsed_time = time.time() - self.start_time
             logging.info("Time elapsed: %.2f seconds" % (self.elapsed_time))
 
         # Set the progress dialog to 100%. Since we are using the progress
-        # dialog handler to do this, this is thread safe.
-        if self.pdialog_handler:
-            self.pdialog_handler.complete()
-
-        # Only keep the non-empty results.
-        results[:] = [r for r in results if r and not r.is_empty()]
+        # dialog handler to do this, this is thread safe. The handler is
+        # cleared when the analysis is canceled, so get it once.
+        handler = self.pdialog_handler
+        if handler:
+            handler.complete()
+
+        # The user was already informed if the analysis was canceled, so
+        # only close the analysis if none of the analyses were finished.
+        if self.canceled():
+            logging.info("Analysis canceled, keeping %d finished results" %
+                n_results)
+            if n_results == 0:
+                self.on_analysis_closed()
+                return
 
         # Check if there are any reports to display. If not, close the
         # analysis after a short timeout. The timeout gives signal handlers
         # a chance to catch any last minute signals from the analysis.
-        if len(results) == 0:
+        if n_results == 0:
             gobject.idle_add(setlyze.sender.emit, 'no-results')
             logging.info("No results to show.")
             self.on_analysis_closed(timeout=2)
             return
 
-        # Save the results locally.
-        self.results = results
-
         # Let the signal handler handle the results.
         gobject.idle_add(setlyze.sender.emit, 'pool-finished', results)
 
+    def log_instrumentation(self, results):
+        """Log the resource usage of the analyses.
+
+        The time spent in each stage is summed for all reports in the list
+        `results` and logged (see :meth:`log_stage_times`). The resource
+        usage of each analysis is written with :meth:`write_instrumentation`.
+        """
+        reports = [r for r in results if r and r.instrumentation]
+        if not reports:
+            return
+
+        # Log the total time per stage for all analyses.
+        totals = collections.OrderedDict()
+        for report in reports:
+            self.add_stage_times(totals, report)
+        self.log_stage_times(totals, len(reports))
+
+        self.write_instrumentation(reports)
+
+    def add_stage_times(self, totals, report):
+        """Add the time spent in each stage of the analysis for `report` to
+        the dictionary `totals`.
+        """
+        for name, usage in report.instrumentation['stages'].iteritems():
+            totals[name] = totals.get(name, 0.0) + usage['wall']
+
+    def log_stage_times(self, totals, n_reports):
+        """Log the total time per stage `totals` for `n_reports` analyses."""
+        logging.info("Time per stage for %d analyses: %s" % (n_reports,
+            ", ".join(["%s %.2fs" % x for x in totals.iteritems()])))
+
+    def write_instrumentation(self, reports):
+        """Write the resource usage of the analyses for `reports`.
+
+        If configuration ``instrumentation-log`` is set, the resource usage
+        of each analysis is appended to that file as a line of JSON. The lines
+        have the format ::
+
+            {"analysis": "...", "pid": 1234, "total": {...},
+             "stages": {"stage": {"wall": 0.1, "cpu": 0.1, ...}, ...}}
+        """
+        self.append_instrumentation_log([r.instrumentation for r in reports])
+
+    def append_instrumentation_log(self, items):
+        """Append the dictionaries `items` as lines of JSON to the file set
+        with configuration ``instrumentation-log``, if set.
+        """
+        path = setlyze.config.cfg.get('instrumentation-log')
+        if not path:
+            return
+        try:
+            f = open(path, 'a')
+            try:
+                for item in items:
+                    f.write(json.dumps(item) + "\n")
+            finally:
+                f.close()
+        except IOError as e:
+            logging.warning("Failed to write to %s: %s" % (path, e))
+
+    def log_utilisation(self):
+        """Log the utilisation of the process pool of a batch analysis.
+
+        The utilisation is the time the workers spent on analyses, divided
+        by the running time of the batch times the number of workers. The
+        correlation between the estimated cost (see :func:`schedule_jobs`)
+        and the actual time of the analyses is logged as well. The estimated
+        and actual cost of each analysis are appended to the file set with
+        configuration ``instrumentation-log`` as a line of JSON in the
+        format ::
+
+            {"batch": "...", "processes": 4, "wall": 12.3, "busy": 45.6,
+             "utilisation": 0.93, "jobs": [["key", 1234, 0.5], ...],
+             "connections": {"opened": 2, "reused": 14, "idle": 2}}
+
+        where ``connections`` are the database connections of the main
+        process (see :class:`setlyze.database.ConnectionManager`).
+        """
+        if not self.job_timings or not self.batch_start:
+            return
+        wall = time.time() - self.batch_start
+        utilisation = self.busy_time / (wall * self.batch_processes)
+        logging.info("Pool utilisation: %.0f%% (%.1f seconds of analyses "
+            "for %d processes in %.1f seconds)" % (utilisation * 100,
+            self.busy_time, self.batch_processes, wall))
+
+        # Calculate Pearson's correlation coefficient for the estimated and
+        # the actual costs.
+        pairs = [(p, a) for key, p, a in self.job_timings if p is not None]
+        if len(pairs) > 1:
+            n = float(len(pairs))
+            mean_p = sum(p for p, a in pairs) / n
+            mean_a = sum(a for p, a in pairs) / n
+            cov = sum((p - mean_p) * (a - mean_a) for p, a in pairs)
+            var_p = sum((p - mean_p) ** 2 for p, a in pairs)
+            var_a = sum((a - mean_a) ** 2 for p, a in pairs)
+            if var_p > 0 and var_a > 0:
+                logging.info("Correlation between estimated and actual cost "
+                    "of %d analyses: %.2f" % (n,
+                    cov / (var_p * var_a) ** 0.5))
+
+        self.append_instrumentation_log([{
+            'batch': self.__module__.split('.')[-1],
+            'processes': self.batch_processes,
+            'wall': wall,
+            'busy': self.busy_time,
+            'utilisation': utilisation,
+            'jobs': self.job_timings,
+            'connections': setlyze.database.connections.get_stats(),
+        }])
+
     def on_save_individual_reports(self, sender=None):
-        """Save reports for the individual analyses."""
-        if len(self.results) == 0:
+        """Save reports for the individual analyses.
+
+        In batch mode the reports were already exported when the analyses
+        finished, so these are copied to the selected folder.
+        """
+        if len(self.results) == 0 and len(self.exported) == 0:
             return
 
         # Let the user select the output folder.
@@ -481,7 +1241,10 @@ class PrepareAnalysis(object):
 
         response = chooser.run()
         if response == gtk.RESPONSE_OK:
-            self.export_reports(self.results, chooser.get_filename(), self.report_prefix)
+            if self.exported:
+                self.copy_reports(self.exported, chooser.get_filename())
+            else:
+                self.export_reports(self.results, chooser.get_filename(), self.report_prefix)
         chooser.destroy()
 
     def on_no_results(self, sender=None):
@@ -502,31 +1265,24 @@ class PrepareAnalysis(object):
     def export_reports(self, results, path, prefix=''):
         """Export all reports from a list of report objects `results`.
 
-        Reports are exported to directory `path`. Argument `prefix` is an
-        optional prefix for exported reports. File names are created in the
-        format ``[prefix]speciesA[_speciesB].rst``.
+        Reports are exported to directory `path` with
+        :func:`setlyze.report.export_reports`. Argument `prefix` is an
+        optional prefix for exported reports. File names are created with
+        :func:`get_report_filename`.
         """
         if not os.path.isdir(path):
             return
 
-        for result in results:
-            species_list = []
-            for selection in result.species_selections:
-                species_selection = [s for s in selection.values()]
-                # In batch mode there should be just one species per selection.
-                species = species_selection[0]['name_latin']
-                if not species: species = species_selection[0]['name_common']
-                species_list.append(species)
-
-            if len(species_list) == 2:
-                filename = "%s%s_%s.rst" % (prefix, species_list[0], species_list[1])
-            else:
-                filename = "%s%s.rst" % (prefix, species_list[0])
-            # Remove unwanted characters from the filename.
-            filename = slugify(filename)
-            # Export the report.
-            output_dir = os.path.join(path, filename)
-            setlyze.report.export(result, output_dir, 'rst')
+        setlyze.report.export_reports(results, path,
+            lambda result: get_report_filename(result, prefix))
+
+    def copy_reports(self, files, path):
+        """Copy the exported reports `files` to directory `path`."""
+        if not os.path.isdir(path):
+            return
+
+        for filename in files:
+            shutil.copy(filename, path)
 
     def on_display_results(self, sender, results=[]):
         """Display each report from the list `results` in a report window.
@@ -554,6 +1310,149 @@ class AnalysisWorker(object):
         self.execute_queue = execute_queue
         self.n_repeats = setlyze.config.cfg.get('test-repeats')
         self.result = setlyze.report.Report()
+        self.stages = collections.OrderedDict()
+        # The SQL statement counters and the trace summary of the database
+        # connection, saved by on_exit() before the connection is returned
+        # to the pool, which resets them.
+        self.sql_usage = {'sql_statements': 0, 'sql_time': 0.0}
+        self.sql_trace = None
+
+    def get_usage(self):
+        """Return a dictionary with the current resource usage counters.
+
+        The counters are the wall clock time, the CPU time of this process,
+        the number of SQL statements executed on the database connection and
+        the time spent executing them, and the number of calls to R and the
+        time spent in R. See :data:`USAGE_KEYS`. Once the connection was
+        returned to the pool by :meth:`on_exit`, the SQL counters saved by
+        that method are used.
+        """
+        times = os.times()
+        usage = {
+            'wall': time.time(),
+            'cpu': times[0] + times[1],
+            'sql_statements': 0,
+            'sql_time': 0.0,
+            'r_calls': setlyze.stats.r_usage['calls'],
+            'r_time': setlyze.stats.r_usage['time'],
+        }
+        conn = getattr(self.db, 'conn', None)
+        if hasattr(conn, 'n_statements'):
+            usage['sql_statements'] = conn.n_statements
+            usage['sql_time'] = conn.statement_time
+        else:
+            usage.update(self.sql_usage)
+        return usage
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure the resources used by stage `name` of the analysis.
+
+        This is a context manager for the code of a stage. It yields a
+        dictionary in which the number of processed rows can be set with key
+        ``rows``. Once the stage is finished, the resource usage (see
+        :meth:`get_usage`) during the stage is saved to this dictionary,
+        which is stored in the `stages` attribute. Usage example: ::
+
+            with self.stage('records') as stage:
+                rec_ids = self.db.get_record_ids(locations, species)
+                stage['rows'] = len(rec_ids)
+        """
+        usage = collections.OrderedDict([('rows', None)])
+        start = self.get_usage()
+        try:
+            yield usage
+        finally:
+            end = self.get_usage()
+            for key in USAGE_KEYS:
+                usage[key] = end[key] - start[key]
+            self.stages[name] = usage
+
+    def run_instrumented(self):
+        """Call :meth:`run` and add the resource usage to the report.
+
+        The resource usage of the analysis as a whole and of each stage
+        (see :meth:`stage`) is saved to the report with
+        :meth:`~setlyze.report.Report.set_instrumentation`, and a summary is
+        added to the report options.
+
+        If configuration ``profile-analyses`` is set, the analysis is run
+        with :py:mod:`cProfile` and the profile is saved to the folder set
+        with configuration ``profile-path``. The path to the profile is
+        saved in the resource usage with key ``profile``.
+        """
+        profiler = None
+        if setlyze.config.cfg.get('profile-analyses'):
+            profiler = cProfile.Profile()
+
+        start = self.get_usage()
+        if profiler:
+            result = profiler.runcall(self.run)
+        else:
+            result = self.run()
+        end = self.get_usage()
+
+        total = collections.OrderedDict()
+        for key in USAGE_KEYS:
+            total[key] = end[key] - start[key]
+        if resource:
+            # The peak memory usage of this process in kilobytes. Worker
+            # processes of a pool are reused, so this is the peak for all
+            # analyses performed by the process so far.
+            total['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        instrumentation = collections.OrderedDict([
+            ('analysis', self.__module__),
+            ('pid', os.getpid()),
+            ('total', total),
+            ('stages', self.stages),
+        ])
+        if profiler:
+            instrumentation['profile'] = self.save_profile(profiler)
+        # The number of database connections opened and reused by this
+        # process so far (see setlyze.database.ConnectionManager).
+        instrumentation['connections'] = setlyze.database.connections.get_stats()
+        conn = getattr(self.db, 'conn', None)
+        if getattr(conn, 'trace', False):
+            self.sql_trace = conn.get_trace_summary()
+        if self.sql_trace is not None:
+            instrumentation['sql'] = [collections.OrderedDict([
+                ('template', template), ('executes', executes),
+                ('time', seconds), ('rows', rows)]) for
+                template, executes, seconds, rows in self.sql_trace]
+
+        if not result:
+            return result
+
+        result.set_instrumentation(instrumentation)
+        result.set_option('Time per stage', ", ".join(["%s %.2fs" %
+            (name, usage['wall']) for name, usage in self.stages.iteritems()]))
+        result.set_option('CPU time', "%.2fs" % total['cpu'])
+        result.set_option('SQL statements', "%d (%.2fs)" %
+            (total['sql_statements'], total['sql_time']))
+        result.set_option('R calls', "%d (%.2fs)" %
+            (total['r_calls'], total['r_time']))
+        return result
+
+    def save_profile(self, profiler):
+        """Save the profile from :py:class:`cProfile.Profile` instance
+        `profiler` and return the path to the profile.
+
+        The profile can be inspected with :py:mod:`pstats`.
+        """
+        path = setlyze.config.cfg.get('profile-path')
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # Another process may have created it in the meantime.
+                pass
+        filename = "%s_%d_%d.prof" % (self.__module__.split('.')[-1],
+            os.getpid(), int(time.time() * 1000))
+        path = os.path.join(path, filename)
+        profiler.dump_stats(path)
+        logging.info("Profile saved to %s" % path)
+        return path
 
     def stop(self):
         """Stop the analysis."""
@@ -561,7 +1460,13 @@ class AnalysisWorker(object):
         self._stop = True
 
     def stopped(self):
-        """Return True if the analysis was stopped, False otherwise."""
+        """Return True if the analysis was stopped, False otherwise.
+
+        The analysis is also stopped if the cancel event of the process pool
+        was set (see :func:`init_worker`).
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            return True
         return self._stop
 
     def exec_task(self, task, *args, **kargs):
@@ -582,7 +1487,20 @@ class AnalysisWorker(object):
 
         Tasks:
 
-        * Close the connection to the database.
+        * Save the SQL statement counters and log the SQL trace summary if
+          SQL tracing is enabled. These are reset when the connection is
+          returned to the pool, so :meth:`run_instrumented` uses the saved
+          ones.
+        * Return the connection to the database to the connection pool.
         """
-        if self.db:
-            self.db.conn.close()
+        if self.db and self.db.conn:
+            conn = self.db.conn
+            self.sql_usage = {
+                'sql_statements': getattr(conn, 'n_statements', 0),
+                'sql_time': getattr(conn, 'statement_time', 0.0),
+            }
+            if getattr(conn, 'trace', False):
+                self.sql_trace = conn.get_trace_summary()
+                conn.log_trace_summary("%s (process %d)" %
+                    (self.__module__, os.getpid()))
+            self.db.close()
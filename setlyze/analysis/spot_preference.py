@@ -50,7 +50,7 @@ in batch mode. Finally the analysis is performed with :class:`Analysis`.
 import collections
 import logging
 import math
-import multiprocessing
+import random
 import re
 import time
 
@@ -60,18 +60,56 @@ pygtk.require('2.0')
 import gtk
 
 import setlyze
+import setlyze.areas
 import setlyze.config
+import setlyze.database
 import setlyze.gui
 import setlyze.locale
 import setlyze.std
 import setlyze.report
+from setlyze.checkpoint import get_job_key
 from setlyze.analysis.common import (calculatestar, ProcessGateway,
     PrepareAnalysis, AnalysisWorker)
-from setlyze.stats import chisq_test, wilcox_test
+from setlyze.stats import chisq_test, wilcox_test_batch
 
 # The number of progress steps for this analysis.
 PROGRESS_STEPS = 7
 
+# The groups of plate areas for which the Wilcoxon tests are performed.
+AREA_GROUPS = (('A',),('B',),('C',),('D',),('A','B'),('C','D'),
+    ('A','B','C'),('B','C','D'))
+
+def get_batch_jobs(locations, species, areas_definition, execute_queue=None):
+    """Return the jobs for performing the analysis in batch mode.
+
+    A job is created for each species ID in the species selection `species`,
+    with the locations selection `locations` and the plate areas definition
+    `areas_definition`. Returns a list of ``(key, job)`` tuples, where the
+    key identifies the job (see :func:`setlyze.checkpoint.get_job_key`) and
+    the job can be passed to
+    :func:`~setlyze.analysis.common.calculatestar`.
+    """
+    return [(get_job_key(sp), (Analysis, (locations, sp, areas_definition,
+        execute_queue))) for sp in species]
+
+def estimate_costs(locations, species):
+    """Return the estimated cost of the batch job for each species.
+
+    The cost of the analysis grows with the number of records of the species
+    in the locations selection `locations`, for which the plate area totals
+    are calculated and tested. Returns a dictionary with the estimated cost
+    for the job key of each species ID in `species` (see
+    :func:`~setlyze.analysis.common.schedule_jobs`).
+    """
+    db = setlyze.database.get_database_accessor()
+    totals = db.get_species_spot_totals(locations)
+    costs = {}
+    for sp in species:
+        n_records, n_spots, n_spots_sq = totals.get(sp, (0, 0, 0))
+        costs[get_job_key(sp)] = n_records
+    db.close()
+    return costs
+
 class Begin(PrepareAnalysis):
     """Make the preparations for the analysis.
 
@@ -223,13 +261,14 @@ class Begin(PrepareAnalysis):
         gw.start()
 
         # Create a process pool with a single worker.
-        self.pool = multiprocessing.Pool(1)
+        self.pool = self.get_pool(1)
 
         # Create a list with the job.
         jobs = [(Analysis, (locations, species, areas_definition, gw.queue))]
 
         # Add the job to the pool.
-        self.pool.map_async(calculatestar, jobs, callback=self.on_pool_finished)
+        self.pool_result = self.pool.map_async(calculatestar, jobs,
+            callback=self.on_pool_finished)
 
 class BeginBatch(Begin):
     """Make the preparations for the analysis in batch mode.
@@ -265,37 +304,142 @@ class BeginBatch(Begin):
 
         Creates a pool of worker processes. A job is set for each species that
         was selected. The jobs are then added to the pool for execution. If
-        multiple workers were created, analyses will run in parallel. When
-        the results are ready, :meth:`~setlyze.analysis.common.PrepareAnalysis.on_pool_finished`
-        is applied to it.
+        multiple workers were created, analyses will run in parallel. Each
+        report is passed to :meth:`~setlyze.analysis.common.PrepareAnalysis.add_result`
+        as soon as its analysis is finished.
         """
+        # Create a gateway to the main process for child processes.
+        gw = ProcessGateway()
+
+        # Create a list of jobs.
+        jobs = get_batch_jobs(locations, species, areas_definition, gw.queue)
+        logging.info("Adding %d jobs to the queue" % len(jobs))
+
+        # Estimate the cost of each job.
+        costs = estimate_costs(locations, species)
+
+        # Resume the batch if it was interrupted before.
+        self.open_checkpoint('spot_preference', {'locations': locations,
+            'species': species, 'areas_definition': areas_definition},
+            len(jobs))
+
         self.start_time = time.time()
 
         # Create a progress dialog and a handler.
         self.pdialog, self.pdialog_handler = self.get_progress_dialog()
-
-        # Set the total number of times we decide to update the progress dialog.
-        self.pdialog_handler.set_total_steps((PROGRESS_STEPS + self.n_repeats) *
-            len(species))
-
-        # Create a gateway to the main process for child processes.
-        gw = ProcessGateway()
         gw.set_pdialog_handler(self.pdialog_handler)
         gw.start()
 
-        # Create a process pool with workers.
+        # Run the jobs in a process pool with workers, the heaviest jobs
+        # first. The reports are processed as soon as each analysis is
+        # finished.
         cp = setlyze.config.cfg.get('concurrent-processes')
-        self.pool = multiprocessing.Pool(cp)
+        self.start_batch(jobs, PROGRESS_STEPS + self.n_repeats, cp, costs)
 
-        # Create a list of jobs.
-        logging.info("Adding %d jobs to the queue" % len(species))
-        jobs = ((Analysis, (locations, sp, areas_definition, gw.queue)) for sp in species)
+    def summarize_result(self, result):
+        """Return the row for the summary report for analysis report
+        `result`, or None if none of the results in the row were significant.
 
-        # Add the jobs to the pool.
-        self.pool.map_async(calculatestar, jobs, callback=self.on_pool_finished)
+        This method is called for each report as soon as the analysis is
+        finished (see :meth:`~setlyze.analysis.common.PrepareAnalysis.add_result`).
+        See :meth:`summarize_results` for the format of the rows.
+        """
+        chi_squared = None
+        wilcoxon = None
+        species_selection = [s for s in result.species_selections[0].values()]
+        species = species_selection[0]['name_latin']
+        if 'wilcoxon_areas_repeats' in result.statistics:
+            wilcoxon = result.statistics['wilcoxon_areas_repeats'][0]
+        if 'chi_squared_areas' in result.statistics:
+            chi_squared = result.statistics['chi_squared_areas'][0]
+
+        # Figure out for which plate areas the result was significant. A
+        # result is considered significant if (confidence level)% of the
+        # test repeats were significant.
+        areas = ['A','B','C','D','A+B','C+D','A+B+C','B+C+D']
+        row = []
+        for plate_area in areas:
+            if not wilcoxon:
+                row.append(None)
+                continue
+            stats = wilcoxon['results'].get(plate_area, None)
+            if stats:
+                # Calculate the P-value.
+                # Preference and rejection should not be summed up
+                # because they contradict. Only use the major value.
+                if stats['n_preference'] > stats['n_rejection']:
+                    major = stats['n_preference']
+                else:
+                    major = stats['n_rejection']
+                p = 1 - float(major) / wilcoxon['attr']['repeats']
 
-    def summarize_results(self, results):
-        """Return a summary report from a list of analysis reports `results`.
+                if setlyze.std.is_significant(p, self.alpha_level):
+                    # Significant: preference or rejection.
+                    if stats['n_preference'] > stats['n_rejection']:
+                        row.append("pr; p=%.4f" % p)
+                    else:
+                        row.append("rj; p=%.4f" % p)
+                else:
+                    # Not significant.
+                    row.append("ns; p=%.4f" % p)
+            else:
+                # No data.
+                row.append(None)
+
+        # Add the results for the Chi squared test.
+        if chi_squared:
+            # Check if the result was significant. When all values are
+            # 0 the p-value will be NaN. Function `is_significant` will
+            # raise ValueError if the p-value is NaN.
+            try:
+                significant = setlyze.std.is_significant(chi_squared['results']['p_value'], self.alpha_level)
+            except ValueError:
+                significant = False
+
+            if significant:
+                code = 's'
+            else:
+                code = 'ns'
+
+            row.append("%s; χ²=%.2f; p=%.4f" %
+                (code, chi_squared['results']['chi_squared'],
+                chi_squared['results']['p_value']))
+        else:
+            row.append(None)
+
+        # Only return the row if one item in the row was significant.
+        for val in row:
+            if val and re.match('^(s|pr|rj);', val):
+                r = [species, result.get_option('Total plates')]
+                r.extend(row)
+                return r
+        return None
+
+    def get_summary_attr(self):
+        """Return the attributes of the summary report, which describe the
+        columns of the rows from :meth:`summarize_result`.
+
+        See :meth:`summarize_results` for the format.
+        """
+        attr = {
+            'columns_over': ('..', 'Wilcoxon rank sum test', 'Chi-sq'),
+            'columns_over_spans': (2, 8, 1),
+            'columns': ['Species','n (plates)','A','B','C','D','A+B','C+D','A+B+C','B+C+D','A,B,C,D']
+        }
+
+        # Set the plate areas definition as the column name for the Chi-squared
+        # test (last column).
+        if self.areas_definition:
+            definition = ['+'.join(area) for area in self.areas_definition.values()]
+            definition.sort()
+            attr['columns'][10] = ','.join(definition)
+        return attr
+
+    def summarize_results(self, rows):
+        """Return a summary report from a list of summary rows `rows`.
+
+        The rows are obtained with :meth:`summarize_result` for each analysis
+        report.
 
         Creates a dictionary in the following format ::
 
@@ -313,109 +457,22 @@ class BeginBatch(Begin):
             }
         """
         summary = {
-            'attr': {
-                'columns_over': ('..', 'Wilcoxon rank sum test', 'Chi-sq'),
-                'columns_over_spans': (2, 8, 1),
-                'columns': ['Species','n (plates)','A','B','C','D','A+B','C+D','A+B+C','B+C+D','A,B,C,D']
-            },
-            'results': []
+            'attr': self.get_summary_attr(),
+            'results': sorted(rows)
         }
-        for result in results:
-            chi_squared = None
-            wilcoxon = None
-            species_selection = [s for s in result.species_selections[0].values()]
-            species = species_selection[0]['name_latin']
-            if 'wilcoxon_areas_repeats' in result.statistics:
-                wilcoxon = result.statistics['wilcoxon_areas_repeats'][0]
-            if 'chi_squared_areas' in result.statistics:
-                chi_squared = result.statistics['chi_squared_areas'][0]
-
-            # Figure out for which plate areas the result was significant. A
-            # result is considered significant if (confidence level)% of the
-            # test repeats were significant.
-            areas = ['A','B','C','D','A+B','C+D','A+B+C','B+C+D']
-            row = []
-            for plate_area in areas:
-                if not wilcoxon:
-                    row.append(None)
-                    continue
-                stats = wilcoxon['results'].get(plate_area, None)
-                if stats:
-                    # Calculate the P-value.
-                    # Preference and rejection should not be summed up
-                    # because they contradict. Only use the major value.
-                    if stats['n_preference'] > stats['n_rejection']:
-                        major = stats['n_preference']
-                    else:
-                        major = stats['n_rejection']
-                    p = 1 - float(major) / wilcoxon['attr']['repeats']
-
-                    if setlyze.std.is_significant(p, self.alpha_level):
-                        # Significant: preference or rejection.
-                        if stats['n_preference'] > stats['n_rejection']:
-                            row.append("pr; p=%.4f" % p)
-                        else:
-                            row.append("rj; p=%.4f" % p)
-                    else:
-                        # Not significant.
-                        row.append("ns; p=%.4f" % p)
-                else:
-                    # No data.
-                    row.append(None)
-
-            # Add the results for the Chi squared test.
-            if chi_squared:
-                # Check if the result was significant. When all values are
-                # 0 the p-value will be NaN. Function `is_significant` will
-                # raise ValueError if the p-value is NaN.
-                try:
-                    significant = setlyze.std.is_significant(chi_squared['results']['p_value'], self.alpha_level)
-                except ValueError:
-                    significant = False
-
-                if significant:
-                    code = 's'
-                else:
-                    code = 'ns'
-
-                row.append("%s; χ²=%.2f; p=%.4f" %
-                    (code, chi_squared['results']['chi_squared'],
-                    chi_squared['results']['p_value']))
-            else:
-                row.append(None)
-
-            # Only add the row to the summary if one item in the row was
-            # significant.
-            for val in row:
-                if val and re.match('^(s|pr|rj);', val):
-                    r = [species, result.get_option('Total plates')]
-                    r.extend(row)
-                    summary['results'].append(r)
-                    break
-
-        # Set the plate areas definition as the column name for the Chi-squared
-        # test (last column).
-        definition = getattr(results[0], 'plate_areas_definition', None)
-        if definition:
-            for key, area in definition.iteritems():
-                definition[key] = '+'.join(area)
-            definition = definition.values()
-            definition.sort()
-            definition = ','.join(definition)
-            summary['attr']['columns'][10] = definition
 
         # Create a report object from the dictionary.
         report = setlyze.report.Report()
         report.set_statistics('plate_areas_summary', summary)
         return report
 
-    def on_display_results(self, sender, results=[]):
+    def on_display_results(self, sender, rows=[]):
         """Create a summary report and display it in a report dialog.
 
         This method is used as a handler for the "pool-finished" signal.
-        The batch results `results` are attached to the signal.
+        The rows for the summary report `rows` are attached to the signal.
         """
-        report = self.summarize_results(results)
+        report = self.summarize_results(rows)
 
         # Set analysis options.
         report.set_option('Alpha level', self.alpha_level)
@@ -439,7 +496,7 @@ class BeginBatch(Begin):
             "Batch report for analysis Sport Preference",
             'summary-report-spot-preference')
         # Enable export of individual reports.
-        if len(self.results) > 0:
+        if len(self.exported) > 0:
             w.toolbutton_save_all.set_sensitive(True)
 
 class Analysis(AnalysisWorker):
@@ -472,6 +529,10 @@ class Analysis(AnalysisWorker):
         self.areas_definition = areas_definition
         self.chisq_observed = None # Design Part: 2.25
         self.chisq_expected = None # Design Part: 2.26
+        self.area_matrix = None
+        self.spot_counts = None
+        self.area_totals_observed = None
+        self.area_totals_expected = None
         self.statistics = {
             'chi_squared_areas': {'attr': None, 'results': {}},
             'wilcoxon_areas': {'attr': None, 'results': collections.OrderedDict()},
@@ -485,6 +546,21 @@ class Analysis(AnalysisWorker):
         :class:`setlyze.gui.DefinePlateAreas`.
         """
         self.areas_definition = definition
+        self.area_matrix = None
+
+    def get_area_matrix(self):
+        """Return the :class:`~setlyze.areas.AreaMatrix` for the area groups
+        of the Wilcoxon tests (see :data:`AREA_GROUPS`) and the user defined
+        plate areas.
+
+        The Wilcoxon groups are named like ``A+B`` and the user defined
+        areas keep their names from the plate areas definition.
+        """
+        if self.area_matrix is None:
+            groups = [("+".join(group), group) for group in AREA_GROUPS]
+            groups.extend(sorted(self.areas_definition.items()))
+            self.area_matrix = setlyze.areas.AreaMatrix(groups)
+        return self.area_matrix
 
     def run(self):
         """Perform the analysis and return the analysis report.
@@ -508,42 +584,49 @@ class Analysis(AnalysisWorker):
         Design Part: 1.58
         """
         if not self.stopped():
-            # Make an object that facilitates access to the database.
-            self.db = setlyze.database.get_database_accessor()
-
-            assert isinstance(self.db, setlyze.database.AccessLocalDB), \
-                "Expected an instance of AccessLocalDB. Got %s" % self.db.__class__.__name__
-
-            # Create temporary tables.
-            self.db.create_table_species_spots_1()
-            self.db.create_table_plate_area_totals_observed()
-            self.db.create_table_plate_area_totals_expected()
-            self.db.conn.commit()
-
-            # Get the record IDs that match the localities+species selection.
-            rec_ids = self.db.get_record_ids(self.locations_selection, self.species_selection)
-            logging.info("\tTotal records that match the species+locations selection: %d" % len(rec_ids))
-
-            # Make a spots table for the selected species.
-            logging.info("\tCreating table with species spots...")
-            self.exec_task('progress.increase', "Creating table with species spots...")
-            self.db.set_species_spots(rec_ids, slot=0)
-
-            # Combine records with the same plate ID.
-            logging.info("\tCombining records with the same plate ID...")
-            self.exec_task('progress.increase', "Combining records with the same plate ID...")
-            self.n_plates_unique = self.db.make_plates_unique(slot=0)
-            logging.info("\t  %d records remaining." % (self.n_plates_unique))
+            with self.stage('prepare'):
+                # Make an object that facilitates access to the database.
+                self.db = setlyze.database.get_database_accessor()
+
+                assert isinstance(self.db, setlyze.database.AccessLocalDB), \
+                    "Expected an instance of AccessLocalDB. Got %s" % self.db.__class__.__name__
+
+                # Create temporary tables.
+                self.db.create_table_species_spots_1()
+                self.db.conn.commit()
+
+            with self.stage('get_record_ids') as stage:
+                # Get the record IDs that match the localities+species selection.
+                rec_ids = self.db.get_record_ids(self.locations_selection, self.species_selection)
+                logging.info("\tTotal records that match the species+locations selection: %d" % len(rec_ids))
+                stage['rows'] = len(rec_ids)
+
+            with self.stage('set_species_spots') as stage:
+                # Make a spots table for the selected species.
+                logging.info("\tCreating table with species spots...")
+                self.exec_task('progress.increase', "Creating table with species spots...")
+                self.db.set_species_spots(rec_ids, slot=0)
+                stage['rows'] = len(rec_ids)
+
+            with self.stage('make_plates_unique') as stage:
+                # Combine records with the same plate ID.
+                logging.info("\tCombining records with the same plate ID...")
+                self.exec_task('progress.increase', "Combining records with the same plate ID...")
+                self.n_plates_unique = self.db.make_plates_unique(slot=0)
+                logging.info("\t  %d records remaining." % (self.n_plates_unique))
+                stage['rows'] = self.n_plates_unique
 
         if not self.stopped():
-            # Calculate the expected totals.
-            logging.info("\tCalculating the observed plate area totals for each plate...")
-            self.exec_task('progress.increase', "Calculating the observed plate area totals for each plate...")
-            self.set_plate_area_totals_observed()
+            with self.stage('area_totals') as stage:
+                # Calculate the expected totals.
+                logging.info("\tCalculating the observed plate area totals for each plate...")
+                self.exec_task('progress.increase', "Calculating the observed plate area totals for each plate...")
+                self.set_plate_area_totals_observed()
 
-            # Calculate the observed species encounters for the user defined
-            # plate areas.
-            self.chisq_observed = self.get_defined_areas_totals_observed()
+                # Calculate the observed species encounters for the user defined
+                # plate areas.
+                self.chisq_observed = self.get_defined_areas_totals_observed()
+                stage['rows'] = self.n_plates_unique
 
             # Make sure that spot area totals are not all zero. If so, abort
             # the analysis, because we can't divide by zero (unless you're
@@ -561,21 +644,24 @@ class Analysis(AnalysisWorker):
                 return None
 
         if not self.stopped():
-            # Perform the repeats for the Wilcoxon rank sum test. This will
-            # repeatedly calculate the expected totals. The expected values of
-            # the last repeat will be used for the non-repeated Wilcoxon test.
-            logging.info("\tPerforming Wilcoxon tests with %d repeats..." % self.n_repeats)
-            self.exec_task('progress.increase', "Performing Wilcoxon tests with %s repeats..." % self.n_repeats)
-            self.repeat_wilcoxon_test(self.n_repeats)
+            with self.stage('repeats') as stage:
+                # Perform the repeats for the Wilcoxon rank sum test. This will
+                # repeatedly calculate the expected totals. The expected values of
+                # the last repeat will be used for the non-repeated Wilcoxon test.
+                logging.info("\tPerforming Wilcoxon tests with %d repeats..." % self.n_repeats)
+                self.exec_task('progress.increase', "Performing Wilcoxon tests with %s repeats..." % self.n_repeats)
+                self.repeat_wilcoxon_test(self.n_repeats)
+                stage['rows'] = self.n_plates_unique * self.n_repeats
 
         if not self.stopped():
-            # Perform the Chi-squared and Wilcoxon rank sum test (non-repeated).
-            # The expected values for the last repeat is used for this Wilcoxon
-            # test.
-            logging.info("\tPerforming statistical tests...")
-            self.exec_task('progress.increase', "Performing statistical tests...")
-            self.calculate_significance_wilcoxon()
-            self.calculate_significance_chisq()
+            with self.stage('significance'):
+                # Perform the Chi-squared and Wilcoxon rank sum test (non-repeated).
+                # The expected values for the last repeat is used for this Wilcoxon
+                # test.
+                logging.info("\tPerforming statistical tests...")
+                self.exec_task('progress.increase', "Performing statistical tests...")
+                self.calculate_significance_wilcoxon()
+                self.calculate_significance_chisq()
 
         # If the cancel button is pressed don't finish this function.
         if self.stopped():
@@ -583,9 +669,10 @@ class Analysis(AnalysisWorker):
             self.on_exit()
             return None
 
-        # Generate the report.
-        self.exec_task('progress.increase', "Generating the analysis report...")
-        self.generate_report()
+        with self.stage('report'):
+            # Generate the report.
+            self.exec_task('progress.increase', "Generating the analysis report...")
+            self.generate_report()
 
         # Update the progress dialog.
         logging.info("%s was completed!" % setlyze.locale.text('analysis-spot-preference'))
@@ -598,151 +685,43 @@ class Analysis(AnalysisWorker):
         return self.result
 
     def set_plate_area_totals_observed(self):
-        """Fills the "plate_area_totals_observed" table in the local database.
+        """Calculate the observed plate area totals for each plate.
+
+        The positive spots of each plate in the "species_spots_1" table are
+        obtained as bit masks with a single query. The number of positive
+        spots in each area group (see :meth:`get_area_matrix`) is then
+        calculated for all plates at once. The totals are saved in attribute
+        `area_totals_observed`, a dictionary with a list of totals per plate
+        for each area group. The number of positive spots of each plate is
+        saved in attribute `spot_counts`.
 
         See :ref:`design-part-data-2.41`.
 
         Design Part: 1.62
         """
-
-        # From plate area to spot numbers.
-        area2spots = {'A': (1,5,21,25),
-            'B': (2,3,4,6,10,11,15,16,20,22,23,24),
-            'C': (7,8,9,12,14,17,18,19),
-            'D': (13,),
-            }
-
-        connection = self.db.conn
-        cursor = connection.cursor()
-        cursor2 = connection.cursor()
-
-        # Empty the plate_area_totals table.
-        cursor.execute("DELETE FROM plate_area_totals_observed")
-        connection.commit()
-
-        # Get all records from the table.
-        cursor.execute( "SELECT rec_pla_id,"
-                        "rec_sur1,rec_sur2,rec_sur3,rec_sur4,rec_sur5,"
-                        "rec_sur6,rec_sur7,rec_sur8,rec_sur9,rec_sur10,"
-                        "rec_sur11,rec_sur12,rec_sur13,rec_sur14,rec_sur15,"
-                        "rec_sur16,rec_sur17,rec_sur18,rec_sur19,rec_sur20,"
-                        "rec_sur21,rec_sur22,rec_sur23,rec_sur24,rec_sur25 "
-                        "FROM species_spots_1")
-
-        # Fill the totals table.
-        for record in cursor:
-            # From plate area to total spots for a record.
-            area_totals = {'A': 0, 'B': 0, 'C': 0, 'D': 0}
-
-            # Check for each spot in the record row if the species is
-            # present. 'precence' == 1 if the species is present on
-            # that spot.
-            for spot, precence in enumerate(record[1:], start=1):
-                # In case the 'precence' boolean is False, just continue
-                # with the next spot.
-                if not precence:
-                    continue
-
-                # If we pass here, the species is present on this spot.
-                # Walk through each area in the area2spots dictionary.
-                for area, area_spots in area2spots.iteritems():
-                    # Check if the current spot ID belongs to that area.
-                    if spot in area_spots:
-                        # If so, add 1 to the species total of that area.
-                        area_totals[area] += 1
-                        # Once a match was found, that same spot ID can't
-                        # belong to another area. So continue with the next
-                        # spot for this record.
-                        break
-
-            # Save the plate area totals for this record to the database.
-            cursor2.execute("INSERT INTO plate_area_totals_observed VALUES (?,?,?,?,?)",
-                            (record[0],
-                            area_totals['A'],
-                            area_totals['B'],
-                            area_totals['C'],
-                            area_totals['D'])
-                            )
-
-        # Commit the database transaction.
-        connection.commit()
-
-        # Close connection with the local database.
+        cursor = self.db.conn.cursor()
+        cursor.execute("SELECT %s FROM species_spots_1" %
+            setlyze.areas.get_mask_sql())
+        masks = [row[0] for row in cursor]
         cursor.close()
-        cursor2.close()
+
+        self.spot_counts = map(setlyze.areas.count_spots, masks)
+        self.area_totals_observed = self.get_area_matrix().apply(masks)
 
     def set_plate_area_totals_expected(self):
-        """Fills the "plate_area_totals_expected" table in the local database.
+        """Calculate the expected plate area totals for each plate.
+
+        For each plate, the same number of positive spots as observed is
+        placed on random spots. The totals for the area groups are saved in
+        attribute `area_totals_expected`, in the same format as
+        `area_totals_observed` (see :meth:`set_plate_area_totals_observed`).
 
         See :ref:`design-part-data-2.42`.
 
         Design Part: 1.63
         """
-
-        # From plate area to spot numbers.
-        area2spots = {'A': (1,5,21,25),
-            'B': (2,3,4,6,10,11,15,16,20,22,23,24),
-            'C': (7,8,9,12,14,17,18,19),
-            'D': (13,),
-            }
-
-        # Make a connection with the local database.
-        connection = self.db.conn
-        cursor = connection.cursor()
-        cursor2 = connection.cursor()
-
-        # Empty the plate_area_totals_expected table before we use it
-        # again.
-        cursor.execute("DELETE FROM plate_area_totals_expected")
-        connection.commit()
-
-        # Get the number of positive spots for each plate. This
-        # will serve as a template for the random spots.
-        cursor.execute( "SELECT pla_id, area_a, area_b, area_c, area_d "
-                        "FROM plate_area_totals_observed"
-                        )
-
-        for pla_id, area_a, area_b, area_c, area_d in cursor:
-            # Calculate the number of positive spots by summing the spot totals
-            # of all plate areas for the current plate.
-            n_spots = area_a + area_b + area_c + area_d
-
-            # Use that number of spots to generate the same number of
-            # random spots.
-            random_spots = setlyze.std.get_random_for_plate(n_spots)
-
-            # From plate area to total spots for a record.
-            area_totals = {'A': 0, 'B': 0, 'C': 0, 'D': 0}
-
-            # Sort the random positive spots in the correct areas in
-            # 'area_totals'.
-            for spot in random_spots:
-                # Walk through each area in the area2spots dictionary.
-                for area, area_spots in area2spots.iteritems():
-                    # Check if the current spot ID belongs to that area.
-                    if spot in area_spots:
-                        # If so, add 1 to the species total of that area.
-                        area_totals[area] += 1
-                        # Once a match was found, that same spot ID can't
-                        # belong to another area. So continue with the next
-                        # spot for this record.
-                        break
-
-            # Save the plate area totals for this record to the database.
-            cursor2.execute("INSERT INTO plate_area_totals_expected VALUES (?,?,?,?,?)",
-                            (pla_id,
-                            area_totals['A'],
-                            area_totals['B'],
-                            area_totals['C'],
-                            area_totals['D'])
-                            )
-
-        # Commit the database transaction.
-        connection.commit()
-
-        # Close connection with the local database.
-        cursor.close()
-        cursor2.close()
+        masks = setlyze.areas.get_random_masks(self.spot_counts, random)
+        self.area_totals_expected = self.get_area_matrix().apply(masks)
 
     def calculate_significance_wilcoxon(self):
         """Perform statistical tests to check for significant differences.
@@ -800,41 +779,34 @@ class Analysis(AnalysisWorker):
         Design Part: 1.98
         """
 
-        # The area groups to perfom the test on.
-        area_groups = [('A'),('B'),('C'),('D'),('A','B'),('C','D'),
-            ('A','B','C'),('B','C','D')]
-
-        for area_group in area_groups:
+        # Collect the plate area totals for each area group, so that the
+        # tests for all groups can be performed with a single call to R.
+        groups = []
+        for area_group in AREA_GROUPS:
             # Get area totals per area group per plate.
-            observed = self.db.get_area_totals(
-                'plate_area_totals_observed', area_group)
-            expected = self.db.get_area_totals(
-                'plate_area_totals_expected', area_group)
-
-            # Iterators cannot be used directly by RPy, so convert them to
-            # lists first.
-            observed = list(observed)
-            expected = list(expected)
-
-            # Calculate the number of species encounters for the current
-            # area group.
-            species_encouters_observed = sum(observed)
-            species_encouters_expected = sum(expected)
-
-            # Get the lengths.
-            count_observed = len(observed)
-            count_expected = len(expected)
+            observed = self.area_totals_observed["+".join(area_group)]
+            expected = self.area_totals_expected["+".join(area_group)]
 
             # The number of observed and expected plate area totals must
             # always be the same.
-            assert count_observed == count_expected, \
+            assert len(observed) == len(expected), \
                 "Number of observed and expected values are not equal."
 
             # A minimum of two positive spots totals are required for the
             # significance test. So skip this plate area if it's less.
-            if count_observed < 2:
+            if len(observed) < 2:
                 continue
 
+            groups.append((area_group, observed, expected))
+
+        # Perform two sample Wilcoxon tests.
+        test_results = wilcox_test_batch(
+            [(observed, expected) for area_group, observed, expected in groups],
+            alternative = "two.sided", paired = False,
+            conf_level = 1 - self.alpha_level,
+            conf_int = False)
+
+        for (area_group, observed, expected), test_result in zip(groups, test_results):
             # Calculate the means.
             mean_observed = setlyze.std.mean(observed)
             mean_expected = setlyze.std.mean(expected)
@@ -842,38 +814,39 @@ class Analysis(AnalysisWorker):
             # Create a human readable string with the areas in the area group.
             area_group_str = "+".join(area_group)
 
-            # Perform two sample Wilcoxon tests.
-            test_result = wilcox_test(observed, expected,
-                alternative = "two.sided", paired = False,
-                conf_level = 1 - self.alpha_level,
-                conf_int = False)
-
             # Set the attributes for the tests.
-            if not self.statistics['wilcoxon_areas_repeats']['attr']:
+            statistic, p_value, method = test_result
+            if method and not self.statistics['wilcoxon_areas_repeats']['attr']:
                 self.statistics['wilcoxon_areas_repeats']['attr'] = {
-                    'method': test_result['method'],
-                    'alternative': test_result['alternative'],
+                    'method': method,
+                    'alternative': "two.sided",
                     'conf_level': 1 - self.alpha_level,
                     'paired': False,
                     'groups': "areas",
                     'repeats': self.n_repeats,
                 }
 
-            if not self.statistics['wilcoxon_areas']['attr']:
+            if method and not self.statistics['wilcoxon_areas']['attr']:
                 self.statistics['wilcoxon_areas']['attr'] = {
-                    'method': test_result['method'],
-                    'alternative': test_result['alternative'],
+                    'method': method,
+                    'alternative': "two.sided",
                     'conf_level': 1 - self.alpha_level,
                     'paired': False,
                     'groups': "areas",
                 }
 
-            # Save the results for each test.
+            # Save the results for each test, unless the test failed. The
+            # species encounters are the sums of the totals for the current
+            # area group.
+            if not method:
+                logging.warning("The Wilcoxon test failed for area group %s" %
+                    area_group_str)
+                continue
             self.statistics['wilcoxon_areas']['results'][area_group_str] = {
-                'n_values': count_observed,
-                'n_sp_observed': species_encouters_observed,
-                'n_sp_expected': species_encouters_expected,
-                'p_value': test_result['p.value'],
+                'n_values': len(observed),
+                'n_sp_observed': sum(observed),
+                'n_sp_expected': sum(expected),
+                'p_value': p_value,
                 'mean_observed': mean_observed,
                 'mean_expected': mean_expected,
             }
@@ -1000,67 +973,53 @@ class Analysis(AnalysisWorker):
         Design Part: 1.100
         """
 
-        # The plate area groups to perfom the test on.
-        area_groups = [('A'),('B'),('C'),('D'),('A','B'),('C','D'),
-            ('A','B','C'),('B','C','D')]
-
-        # Perform the test on each area group.
-        for area_group in area_groups:
+        # Collect the plate area totals for each area group, so that the
+        # tests for all groups can be performed with a single call to R.
+        groups = []
+        for area_group in AREA_GROUPS:
             # Create a human readable string with the areas in the area group.
             area_group_str = "+".join(area_group)
 
             # Get area totals per area group per plate.
-            observed = self.db.get_area_totals(
-                'plate_area_totals_observed', area_group)
-            expected = self.db.get_area_totals(
-                'plate_area_totals_expected', area_group)
-
-            # Iterators cannot be used directly by RPy, so convert them to
-            # lists first.
-            observed = list(observed)
-            expected = list(expected)
-
-            # A minimum of two positive spots totals are required for the
-            # significance test. So skip this spots number if it's less.
-            count_observed = len(observed)
-            count_expected = len(expected)
+            observed = self.area_totals_observed[area_group_str]
+            expected = self.area_totals_expected[area_group_str]
 
             # The number of observed and expected plate area totals must
             # always be the same.
-            assert count_observed == count_expected, \
+            assert len(observed) == len(expected), \
                 "Number of observed and expected values are not equal."
 
             # A minimum of two positive spots totals are required for the
             # significance test. So skip this plate area if it's less.
-            if count_observed < 2:
+            if len(observed) < 2:
                 continue
 
             # Check if this area group is present in the statistics variable.
             # If not, create it.
             if area_group_str not in self.statistics['wilcoxon_areas_repeats']['results']:
                 self.statistics['wilcoxon_areas_repeats']['results'][area_group_str] = {
-                    'n_values': count_observed,
+                    'n_values': len(observed),
                     'n_sp_observed': sum(observed),
                     'n_significant': 0,
                     'n_preference': 0,
                     'n_rejection': 0
                 }
 
-            # Calculate the means.
-            mean_observed = setlyze.std.mean(observed)
-            mean_expected = setlyze.std.mean(expected)
+            groups.append((area_group_str, observed, expected))
 
-            # Perform two sample Wilcoxon tests.
-            test_result = wilcox_test(observed, expected,
-                alternative = "two.sided", paired = False,
-                conf_level = 1 - self.alpha_level,
-                conf_int = False)
+        # Perform two sample Wilcoxon tests.
+        test_results = wilcox_test_batch(
+            [(observed, expected) for area_group_str, observed, expected in groups],
+            alternative = "two.sided", paired = False,
+            conf_level = 1 - self.alpha_level,
+            conf_int = False)
 
+        for (area_group_str, observed, expected), test_result in zip(groups, test_results):
             # Check if the result was significant. When all values are 0
             # the p-value will be NaN. Function `is_significant` will raise
             # ValueError if the p-value is NaN.
             try:
-                significant = setlyze.std.is_significant(test_result['p.value'], self.alpha_level)
+                significant = setlyze.std.is_significant(test_result[1], self.alpha_level)
             except ValueError:
                 continue
 
@@ -1071,7 +1030,7 @@ class Analysis(AnalysisWorker):
 
                 # If significant, also check if there is preference or
                 # rejection for this plate area.
-                if mean_observed > mean_expected:
+                if setlyze.std.mean(observed) > setlyze.std.mean(expected):
                     # Increase preference counter with one.
                     self.statistics['wilcoxon_areas_repeats']['results'][area_group_str]['n_preference'] += 1
                 else:
@@ -1098,14 +1057,10 @@ class Analysis(AnalysisWorker):
             'area4': 0,
         }
 
-        for area_name, area_group in self.areas_definition.iteritems():
-            # Get both sets of distances from plates per total spot numbers.
-            observed = self.db.get_area_totals('plate_area_totals_observed',
-                area_group)
-
-            # Sum all totals in the correct area name.
-            for total in observed:
-                areas_totals_observed[area_name] += total
+        for area_name in self.areas_definition:
+            # Sum the totals of all plates for this area.
+            areas_totals_observed[area_name] = \
+                sum(self.area_totals_observed[area_name])
 
         # Remove unused areas from the variable.
         delete = []
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2010-2013, GiMaRIS <info@gimaris.com>
+#
+#  This file is part of SETLyze - A tool for analyzing the settlement
+#  of species on SETL plates.
+#
+#  SETLyze is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SETLyze is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Aggregation of positive spots into plate areas.
+
+The 25 spots of a SETL plate belong to the default plate areas A, B, C and
+D (see :class:`setlyze.gui.DefinePlateAreas`). The analyses need the number
+of positive spots in groups of these areas for each plate, e.g. in ``A+B``
+or in the areas defined by the user.
+
+The positive spots of a plate are handled as a bit mask, like in the
+records snapshot (see :mod:`setlyze.snapshot`): bit 0 is set if spot 1 is
+positive, bit 1 for spot 2, and so on. The masks are calculated by SQLite
+(see :func:`get_mask_sql`). An :class:`AreaMatrix` holds the membership of
+the 25 spots in `k` area groups, and turns a list of masks into the totals
+for all area groups at once: with a single matrix multiplication if NumPy
+is installed, or with a lookup of the totals of each mask otherwise. No
+Python loops over the spots are needed.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The number of spots on a SETL plate.
+N_SPOTS = 25
+
+# The spots in each of the default plate areas.
+AREA_SPOTS = {
+    'A': (1,5,21,25),
+    'B': (2,3,4,6,10,11,15,16,20,22,23,24),
+    'C': (7,8,9,12,14,17,18,19),
+    'D': (13,),
+}
+
+# The bit for each spot in a spots mask. Bit 0 is for spot 1.
+SPOT_BITS = tuple([1 << i for i in range(N_SPOTS)])
+
+# NumPy is only used for at least this many masks. For fewer masks the
+# lookups are faster than converting the masks to an array.
+NUMPY_MIN_MASKS = 256
+
+# The maximum number of masks for which the totals are kept by an
+# AreaMatrix. Random masks are rarely repeated, so this limits the memory
+# used by the repeats of an analysis.
+CACHE_SIZE = 65536
+
+def get_area_mask(areas):
+    """Return the bit mask of the spots in the sequence of default plate
+    areas `areas` (e.g. ``('A','B')``).
+    """
+    mask = 0
+    for area in areas:
+        for spot in AREA_SPOTS[area]:
+            mask |= SPOT_BITS[spot-1]
+    return mask
+
+def get_mask_sql(prefix='rec_sur'):
+    """Return an SQL expression for the bit mask of the positive spots of
+    a record.
+
+    The spot columns are named `prefix` followed by the spot number, as in
+    the spots tables of the local database. Like in Python, spots that are
+    NULL, 0 or an empty string (from Excel files) are not positive.
+    """
+    return "|".join(["((COALESCE(NULLIF(%s%d,''),0) != 0) << %d)" %
+        (prefix, spot, spot-1) for spot in range(1, N_SPOTS+1)])
+
+def count_spots(mask):
+    """Return the number of positive spots in bit mask `mask`."""
+    return bin(mask).count('1')
+
+def get_random_masks(counts, rand):
+    """Return a list of random spot masks with the number of positive spots
+    from the list `counts`.
+
+    The positive spots of each mask are selected with the
+    :py:meth:`~random.Random.sample` method of random generator `rand`, like
+    :func:`setlyze.std.get_random_for_plate` does.
+    """
+    sample = rand.sample
+    return [sum(sample(SPOT_BITS, n)) for n in counts]
+
+class AreaMatrix(object):
+    """Membership matrix of the 25 spots of a SETL plate in `k` area
+    groups.
+
+    Argument `groups` is a sequence of ``(name, areas)`` tuples, where
+    `areas` is a sequence of default plate areas (e.g. ``('A','B')``). A
+    plate areas definition as saved by
+    :class:`setlyze.gui.DefinePlateAreas` can be passed with
+    ``definition.items()``.
+
+    Attribute `membership` is the 25 x k matrix as a list of rows, where
+    ``membership[i][j]`` is 1 if spot ``i+1`` belongs to group `j`.
+    """
+
+    def __init__(self, groups):
+        self.names = [name for name, areas in groups]
+        self.masks = [get_area_mask(areas) for name, areas in groups]
+        self.membership = [[int(bool(mask & bit)) for mask in self.masks]
+            for bit in SPOT_BITS]
+        if numpy is not None:
+            self.matrix = numpy.array(self.membership, dtype=numpy.int32)
+        # The totals for each group for masks that were seen before.
+        self.cache = {}
+
+    def get_totals(self, mask):
+        """Return a tuple with the number of positive spots in each area
+        group for spots mask `mask`.
+        """
+        totals = self.cache.get(mask)
+        if totals is None:
+            totals = tuple([bin(mask & m).count('1') for m in self.masks])
+            if len(self.cache) < CACHE_SIZE:
+                self.cache[mask] = totals
+        return totals
+
+    def apply(self, masks):
+        """Return the totals of the area groups for the list of spots masks
+        `masks`.
+
+        Returns a dictionary with a list for each group name, with the
+        number of positive spots of the group for each mask.
+        """
+        if numpy is not None and len(masks) >= NUMPY_MIN_MASKS:
+            # Turn the masks into an n x 25 matrix of spot booleans, and
+            # multiply it with the membership matrix.
+            masks = numpy.asarray(masks, dtype=numpy.uint32)
+            bits = numpy.arange(N_SPOTS, dtype=numpy.uint32)
+            spots = ((masks[:, numpy.newaxis] >> bits) & 1).astype(numpy.int32)
+            columns = numpy.dot(spots, self.matrix).T.tolist()
+        elif masks:
+            columns = [list(c) for c in zip(*map(self.get_totals, masks))]
+        else:
+            columns = [[] for name in self.names]
+        return dict(zip(self.names, columns))
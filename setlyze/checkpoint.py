@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2010-2013, GiMaRIS <info@gimaris.com>
+#
+#  This file is part of SETLyze - A tool for analyzing the settlement
+#  of species on SETL plates.
+#
+#  SETLyze is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SETLyze is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Checkpoints for analyses in batch mode.
+
+A batch analysis over many species (or species combinations) can take hours.
+So that an interrupted batch doesn't have to start all over, the reports of
+finished analyses are saved to a checkpoint folder in the folder set with
+configuration ``checkpoint-path``. Each checkpoint folder contains:
+
+``manifest.json``
+  The name of the analysis, the parameters needed to create the jobs of the
+  batch (the locations and species selections and the plate areas
+  definition), the number of jobs and the input fingerprint.
+
+``completed.log``
+  A line for each finished job with the job key (see :func:`get_job_key`)
+  and the status ``done`` or ``empty``. Lines are only appended, so an
+  interrupted batch loses at most the last line.
+
+``reports``
+  A folder with the pickled report of each job with status ``done``.
+
+The input fingerprint (see :func:`get_fingerprint`) changes if different
+SETL data is loaded or if the options of the analysis change. A batch is only
+resumed if the fingerprint still matches.
+
+In the GUI a batch is resumed by starting the same batch analysis again. From
+the command line the remaining jobs of a checkpoint can be run with: ::
+
+    python -m setlyze.checkpoint list
+    python -m setlyze.checkpoint resume spot_preference-0123456789ab
+
+The checkpoint is removed when all analyses of a batch are finished and the
+summary report is displayed in the GUI.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import importlib
+import multiprocessing
+import cPickle as pickle
+
+import setlyze
+import setlyze.config
+
+# The version of the checkpoint format.
+CHECKPOINT_VERSION = 1
+
+# The status of a finished job with a non-empty report.
+STATUS_DONE = 'done'
+
+# The status of a finished job without results.
+STATUS_EMPTY = 'empty'
+
+def get_job_key(species):
+    """Return the key for the batch job for species `species`.
+
+    Argument `species` is a species ID, or a tuple of species IDs for
+    analysis Attraction between Species. The key is unique within a batch
+    and safe to use in file names.
+    """
+    if isinstance(species, (tuple, list)):
+        return '_'.join([str(s) for s in species])
+    return str(species)
+
+def get_fingerprint(analysis, parameters, data_fingerprint):
+    """Return the input fingerprint for a batch analysis.
+
+    The fingerprint is a SHA-1 hex digest of the name of the analysis
+    `analysis`, the parameters of the batch `parameters` (a dictionary that
+    can be serialized to JSON), the fingerprint of the SETL data
+    `data_fingerprint` (see
+    :meth:`setlyze.database.AccessDBGeneric.get_data_fingerprint`), the
+    analysis options and the version of SETLyze.
+    """
+    data = {
+        'analysis': analysis,
+        'parameters': parameters,
+        'data': data_fingerprint,
+        'alpha-level': setlyze.config.cfg.get('alpha-level'),
+        'test-repeats': setlyze.config.cfg.get('test-repeats'),
+        'setlyze': setlyze.__version__,
+    }
+    return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+def get_checkpoint_path(analysis, fingerprint):
+    """Return the path to the checkpoint folder for a batch of analysis
+    `analysis` with input fingerprint `fingerprint`.
+    """
+    return os.path.join(setlyze.config.cfg.get('checkpoint-path'),
+        "%s-%s" % (analysis, fingerprint[:12]))
+
+def find_checkpoint(analysis, fingerprint):
+    """Return the checkpoint for a batch of analysis `analysis` with input
+    fingerprint `fingerprint`, or None if there is no such checkpoint.
+    """
+    path = get_checkpoint_path(analysis, fingerprint)
+    if not os.path.isfile(os.path.join(path, 'manifest.json')):
+        return None
+    try:
+        checkpoint = Checkpoint(path)
+        checkpoint.load()
+    except (IOError, ValueError, KeyError) as e:
+        logging.warning("Ignoring invalid checkpoint %s: %s" % (path, e))
+        return None
+    if checkpoint.manifest['fingerprint'] != fingerprint:
+        return None
+    return checkpoint
+
+def list_checkpoints():
+    """Return a list of all valid checkpoints, oldest first."""
+    path = setlyze.config.cfg.get('checkpoint-path')
+    if not os.path.isdir(path):
+        return []
+    checkpoints = []
+    for name in sorted(os.listdir(path)):
+        checkpoint = Checkpoint(os.path.join(path, name))
+        try:
+            checkpoint.load()
+        except (IOError, ValueError, KeyError):
+            continue
+        checkpoints.append(checkpoint)
+    checkpoints.sort(key=lambda c: c.manifest['created'])
+    return checkpoints
+
+class Checkpoint(object):
+    """A checkpoint of a batch analysis in folder `path`.
+
+    A new checkpoint is created with :meth:`create`. An existing checkpoint
+    is opened with :meth:`load`, or with :func:`find_checkpoint`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = None
+        self.completed = {}
+
+    @property
+    def name(self):
+        """The name of the checkpoint folder."""
+        return os.path.basename(self.path)
+
+    def create(self, analysis, parameters, n_jobs, fingerprint):
+        """Create a new checkpoint for a batch of analysis `analysis`.
+
+        Argument `parameters` is a dictionary with the keyword arguments for
+        ``get_batch_jobs()`` of the analysis module, `n_jobs` is the number
+        of jobs in the batch and `fingerprint` is the input fingerprint (see
+        :func:`get_fingerprint`). An existing checkpoint in the same folder
+        is replaced.
+        """
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(os.path.join(self.path, 'reports'))
+
+        self.manifest = {
+            'version': CHECKPOINT_VERSION,
+            'setlyze': setlyze.__version__,
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'analysis': analysis,
+            'parameters': parameters,
+            'n_jobs': n_jobs,
+            'fingerprint': fingerprint,
+        }
+        # Write the manifest to a temporary file first, so there is never an
+        # incomplete manifest.
+        path = os.path.join(self.path, 'manifest.json')
+        f = open(path + '.tmp', 'w')
+        try:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(path + '.tmp', path)
+
+        open(os.path.join(self.path, 'completed.log'), 'w').close()
+        self.completed = {}
+
+    def load(self):
+        """Load the manifest and the list of finished jobs.
+
+        Raises ValueError if the checkpoint has an unsupported format.
+        """
+        f = open(os.path.join(self.path, 'manifest.json'))
+        try:
+            manifest = json.load(f)
+        finally:
+            f.close()
+        if manifest.get('version') != CHECKPOINT_VERSION:
+            raise ValueError("Unsupported checkpoint version %s" %
+                manifest.get('version'))
+        self.manifest = manifest
+
+        self.completed = {}
+        f = open(os.path.join(self.path, 'completed.log'))
+        try:
+            for line in f:
+                # Skip a line that was not completely written.
+                if not line.endswith("\n"):
+                    break
+                fields = line.rstrip("\n").split("\t")
+                # Skip the remains of a line that was not completely
+                # written before the batch was resumed (see add()).
+                if len(fields) != 2 or fields[1] not in (STATUS_DONE,
+                        STATUS_EMPTY):
+                    continue
+                key, status = fields
+                # Skip jobs of which the report is missing, so they are run
+                # again.
+                if status == STATUS_DONE and not \
+                        os.path.isfile(self.get_report_path(key)):
+                    continue
+                self.completed[key] = status
+        finally:
+            f.close()
+
+    def get_report_path(self, key):
+        """Return the path to the report file for job `key`."""
+        return os.path.join(self.path, 'reports', "%s.pickle" % key)
+
+    def add(self, key, report):
+        """Save the report `report` of the finished job `key`.
+
+        Empty reports are not saved, only the status of the job.
+        """
+        if report and not report.is_empty():
+            path = self.get_report_path(key)
+            f = open(path + '.tmp', 'wb')
+            try:
+                pickle.dump(report, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            # Windows doesn't allow renaming to an existing file.
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(path + '.tmp', path)
+            status = STATUS_DONE
+        else:
+            status = STATUS_EMPTY
+
+        line = "%s\t%s\n" % (key, status)
+        f = open(os.path.join(self.path, 'completed.log'), 'a+')
+        try:
+            # End a line that was not completely written when the batch was
+            # interrupted, so this line is not appended to it.
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != "\n":
+                    line = "\n" + line
+                f.seek(0, os.SEEK_END)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        self.completed[key] = status
+
+    def get_report(self, key):
+        """Return the saved report for job `key`, or None if the job had no
+        results or the report could not be loaded.
+        """
+        if self.completed.get(key) != STATUS_DONE:
+            return None
+        try:
+            f = open(self.get_report_path(key), 'rb')
+            try:
+                return pickle.load(f)
+            finally:
+                f.close()
+        except Exception as e:
+            logging.warning("Failed to load report %s from checkpoint: %s" %
+                (key, e))
+            return None
+
+    def is_complete(self):
+        """Return True if all jobs of the batch are finished."""
+        return len(self.completed) >= self.manifest['n_jobs']
+
+    def remove(self):
+        """Remove the checkpoint folder."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def resume(checkpoint, processes=None, output=None):
+    """Run the remaining jobs of checkpoint `checkpoint`.
+
+    The jobs are run with `processes` worker processes, which are
+    initialized like the workers of a batch in the GUI (see
+    :func:`setlyze.analysis.common.init_worker`). A job that fails doesn't
+    stop the other jobs; it is not saved to the checkpoint, so it is run
+    again on the next resume. If `output` is set, the reports of all
+    finished jobs are exported to that folder. Returns a list with the keys
+    of the failed jobs. Raises ValueError if the input fingerprint no longer
+    matches.
+    """
+    import setlyze.database
+    import setlyze.report
+    from setlyze.analysis.common import calculatechunk, get_report_filename, \
+        init_worker
+
+    analysis = checkpoint.manifest['analysis']
+    parameters = checkpoint.manifest['parameters']
+    module = importlib.import_module('setlyze.analysis.%s' % analysis)
+
+    # Make sure the reports are obtained from the same data and with the
+    # same options.
+    db = setlyze.database.get_database_accessor()
+    fingerprint = get_fingerprint(analysis, parameters,
+        db.get_data_fingerprint())
+    db.close()
+    if fingerprint != checkpoint.manifest['fingerprint']:
+        raise ValueError("The SETL data or the analysis options changed "
+            "since the batch was started.")
+
+    jobs = [(key, job) for key, job in module.get_batch_jobs(**parameters)
+        if key not in checkpoint.completed]
+    logging.info("Resuming %s: %d of %d analyses finished, %d remaining" %
+        (checkpoint.name, len(checkpoint.completed),
+        checkpoint.manifest['n_jobs'], len(jobs)))
+
+    failed = []
+    if jobs:
+        pool = multiprocessing.Pool(processes, initializer=init_worker,
+            initargs=(multiprocessing.Event(),))
+        try:
+            # Run each job as a chunk of its own, so the errors are
+            # captured per job.
+            chunks = pool.imap_unordered(calculatechunk,
+                [[job] for job in jobs])
+            for i, chunk in enumerate(chunks, start=1):
+                key, report, seconds, error = chunk[0]
+                if error:
+                    logging.error("Analysis %s failed: %s" % (key, error))
+                    failed.append(key)
+                    continue
+                checkpoint.add(key, report)
+                logging.info("Finished %d of %d analyses" % (i, len(jobs)))
+        finally:
+            pool.close()
+            pool.join()
+
+    if output:
+        if not os.path.isdir(output):
+            os.makedirs(output)
+        # Load the reports one at a time while they are exported.
+        reports = (checkpoint.get_report(key) for key in
+            checkpoint.completed.keys())
+        setlyze.report.export_reports((r for r in reports if r), output,
+            lambda report: get_report_filename(report, "%s_" % analysis))
+
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="List and resume "
+        "interrupted batch analyses.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('list', help="List the checkpoints.")
+    parser_resume = subparsers.add_parser('resume', help="Run the remaining "
+        "analyses of a batch.")
+    parser_resume.add_argument('name', help="Name of the checkpoint.")
+    parser_resume.add_argument('--processes', type=int,
+        default=setlyze.config.cfg.get('concurrent-processes'),
+        help="Number of worker processes (default: %(default)s).")
+    parser_resume.add_argument('-o', '--output', help="Export the reports "
+        "of the finished analyses to this folder.")
+    parser_remove = subparsers.add_parser('remove', help="Remove a "
+        "checkpoint.")
+    parser_remove.add_argument('name', help="Name of the checkpoint.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    if args.command == 'list':
+        for checkpoint in list_checkpoints():
+            print "%s\t%s\t%d/%d" % (checkpoint.name,
+                checkpoint.manifest['created'], len(checkpoint.completed),
+                checkpoint.manifest['n_jobs'])
+        return
+
+    checkpoint = Checkpoint(os.path.join(
+        setlyze.config.cfg.get('checkpoint-path'), args.name))
+    try:
+        checkpoint.load()
+    except (IOError, ValueError, KeyError) as e:
+        sys.exit("Cannot open checkpoint %s: %s" % (args.name, e))
+
+    if args.command == 'remove':
+        checkpoint.remove()
+    elif args.command == 'resume':
+        try:
+            failed = resume(checkpoint, args.processes, args.output)
+        except ValueError as e:
+            sys.exit("Cannot resume %s: %s" % (args.name, e))
+        if failed:
+            sys.exit("%d analyses failed and can be resumed again: %s" %
+                (len(failed), ", ".join(map(str, failed))))
+
+if __name__ == "__main__":
+    main()
@@ -48,6 +48,19 @@ DATA_PATH = appdirs.user_data_dir("SETLyze", "GiMaRIS")
 # Path to the local database file.
 DB_FILE = os.path.join(DATA_PATH, 'setl_local.db')
 
+# Path to the folder with the snapshot of the records table.
+SNAPSHOT_PATH = os.path.join(DATA_PATH, 'setl_local.snapshot')
+
+# Path to the folder where profiles of analyses are saved.
+PROFILE_PATH = os.path.join(DATA_PATH, 'profiles')
+
+# Path to the folder where checkpoints of batch analyses are saved.
+CHECKPOINT_PATH = os.path.join(DATA_PATH, 'checkpoints')
+
+# Path to the folder where worker processes keep their copy of the local
+# database of the coordinator.
+WORKER_CACHE_PATH = os.path.join(DATA_PATH, 'worker')
+
 # Path to the configurations file.
 CONF_FILE = os.path.join(DATA_PATH, 'setlyze.conf')
 
@@ -115,8 +128,10 @@ DEFAULT_CONFIG = [
     ('data-path', DATA_PATH),
     # Absolute path to the local database file.
     ('db-file', DB_FILE),
+    # Absolute path to the folder with the snapshot of the records table.
+    ('snapshot-path', SNAPSHOT_PATH),
     # Minimum database version required.
-    ('minimum-db-version', 0.4),
+    ('minimum-db-version', 0.6),
     # Path to localities file.
     ('localities-file', None),
     # Path to species file.
@@ -138,6 +153,77 @@ DEFAULT_CONFIG = [
     ('cpu-count', CPU_COUNT),
     # Number of concurrent processes for batch mode.
     ('concurrent-processes', processes),
+    # Number of rows to insert at once when importing SETL data files.
+    ('import-batch-size', 1000),
+    # Maximum number of row batches waiting to be inserted when importing
+    # SETL data files.
+    ('import-queue-size', 16),
+    # Run each analysis with cProfile and save the profile to the
+    # profile-path folder.
+    ('profile-analyses', False),
+    # Absolute path to the folder where profiles of analyses are saved.
+    ('profile-path', PROFILE_PATH),
+    # Absolute path to a file to which the resource usage of each analysis
+    # is appended as a JSON line. Set to None to disable.
+    ('instrumentation-log', None),
+    # Trace the SQL statements executed by the analyses. Can also be enabled
+    # by setting environment variable SETLYZE_SQL_TRACE to 1.
+    ('sql-trace', False),
+    # Statements that take at least this many seconds are logged with their
+    # query plan when tracing is enabled.
+    ('sql-slow-query-time', 0.1),
+    # Maximum number of seconds to wait for running analyses to stop after
+    # the user canceled an analysis. Workers are terminated after this time.
+    ('cancel-timeout', 30),
+    # Save the reports of finished analyses in batch mode to a checkpoint, so
+    # an interrupted batch can be resumed.
+    ('checkpoint-batches', True),
+    # Absolute path to the folder where checkpoints of batch analyses are
+    # saved.
+    ('checkpoint-path', CHECKPOINT_PATH),
+    # Format of the tables with the summary and the statistics of batch
+    # analyses that are written while the analyses finish: "csv", "tsv", or
+    # None to disable.
+    ('batch-table-format', 'tsv'),
+    # Absolute path to the folder to which the batch tables are written. If
+    # None, they are saved along with the individual reports.
+    ('batch-table-path', None),
+    # Number of threads used to export the reports of a batch analysis.
+    ('export-threads', 4),
+    # Serve the jobs of batch analyses to worker processes on other hosts
+    # instead of running them in a local process pool (see
+    # setlyze.distributed).
+    ('distributed-batches', False),
+    # Host name or address on which the coordinator listens for workers. An
+    # empty string means all interfaces.
+    ('coordinator-host', ''),
+    # Port on which the coordinator listens for workers.
+    ('coordinator-port', 6650),
+    # Secret key shared by the coordinator and the workers. The coordinator
+    # doesn't start if it isn't set.
+    ('coordinator-authkey', None),
+    # The expected total number of worker processes on all hosts, used to
+    # size the chunks of jobs that are handed out.
+    ('distributed-processes', 32),
+    # Absolute path to the folder where worker processes keep their copy of
+    # the local database of the coordinator.
+    ('worker-cache-path', WORKER_CACHE_PATH),
+    # Maximum number of idle connections to the local database that are
+    # kept for reuse by each process.
+    ('connection-pool-size', 4),
+    # Size of the page cache of each database connection. A negative value
+    # is the size in KiB, a positive value the number of pages.
+    ('sqlite-cache-size', -16384),
+    # Maximum number of bytes of the database file that are memory-mapped.
+    # Set to 0 to disable memory-mapped I/O.
+    ('sqlite-mmap-size', 268435456),
+    # Where TEMP tables are stored: MEMORY, FILE or DEFAULT.
+    ('sqlite-temp-store', 'MEMORY'),
+    # Use write-ahead logging for the local database.
+    ('sqlite-wal', True),
+    # Open the local database read-only in the worker processes of batch
+    # analyses (if SQLite supports URI filenames).
+    ('sqlite-worker-read-only', True),
 ]
 
 class ConfigManager(object):
@@ -168,8 +254,13 @@ class ConfigManager(object):
         The default location of the configuration file is
         ``~/.setlyze/setlyze.cfg``.
         """
-        ints = ('test-repeats','concurrent-processes')
-        floats = ('alpha-level')
+        ints = ('test-repeats','concurrent-processes','cancel-timeout',
+            'coordinator-port','distributed-processes','export-threads',
+            'connection-pool-size','sqlite-cache-size','sqlite-mmap-size',
+            'import-batch-size','import-queue-size')
+        floats = ('alpha-level','sql-slow-query-time')
+        booleans = ('profile-analyses','sql-trace','checkpoint-batches',
+            'distributed-batches','sqlite-wal','sqlite-worker-read-only')
         parser = ConfigParser.SafeConfigParser()
         files = parser.read(CONF_FILE)
         if len(files) > 0:
@@ -180,6 +271,8 @@ class ConfigManager(object):
                             self.set(name, parser.getint(section, name))
                         elif name in floats:
                             self.set(name, parser.getfloat(section, name))
+                        elif name in booleans:
+                            self.set(name, parser.getboolean(section, name))
                         else:
                             self.set(name, parser.get(section, name))
                     except:
@@ -33,12 +33,22 @@ can interact with. We refer to this database as the remote database.
 import sys
 import os
 import csv
+import shutil
+import Queue
+import cPickle as pickle
+import urllib
+import hashlib
 import logging
+import tempfile
 import threading
+import multiprocessing
+import multiprocessing.util
 import itertools
 from sqlite3 import dbapi2 as sqlite
 import re
 import time
+import zipfile
+from xml.etree import cElementTree as ElementTree
 import xlrd
 
 import gobject
@@ -46,10 +56,16 @@ import gobject
 import setlyze
 import setlyze.config
 import setlyze.gui
+import setlyze.report
+import setlyze.snapshot
 import setlyze.std
 
 # The current version of the local database.
-DB_VERSION = 0.5
+DB_VERSION = 0.6
+
+# Cache for the species of locations selections (see get_species).
+species_cache = {}
+species_cache_lock = threading.Lock()
 
 def get_database_accessor():
     """Return an object that facilitates access to the database.
@@ -68,6 +84,400 @@ def get_database_accessor():
         raise ValueError("Invalid data source '%s'." % data_source)
     return db
 
+def get_data_fingerprint(connection):
+    """Return a fingerprint of the SETL data in the local database that
+    is accessed through SQLite connection `connection`.
+
+    The fingerprint is a SHA-1 hex digest of the database information,
+    and the number of rows and the sums of the ID columns of the data
+    tables. It changes when different SETL data is loaded, so it can be
+    used to check that saved results were obtained from the same data.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT name,value FROM info ORDER BY name;")
+    items = [tuple(row) for row in cursor]
+    for table, columns in (
+            ('localities', ('loc_id',)),
+            ('species', ('spe_id',)),
+            ('plates', ('pla_id','pla_loc_id')),
+            ('records', ('rec_id','rec_pla_id','rec_spe_id')),
+        ):
+        sums = ", ".join(["TOTAL(%s)" % c for c in columns])
+        cursor.execute("SELECT COUNT(*), %s FROM %s;" % (sums, table))
+        items.append((table,) + tuple(cursor.fetchone()))
+    cursor.close()
+    return hashlib.sha1(repr(items)).hexdigest()
+
+def get_species_cache_key(locations):
+    """Return the key for the species of locations selection `locations`
+    in the species cache.
+    """
+    dbfile = setlyze.config.cfg.get('db-file')
+    return (setlyze.snapshot.get_file_key(dbfile), tuple(sorted(set(locations))))
+
+def get_cached_species(locations):
+    """Return the cached species for locations selection `locations`, or
+    None if they are not in the cache (see :func:`get_species`).
+    """
+    with species_cache_lock:
+        return species_cache.get(get_species_cache_key(locations))
+
+def get_species(locations):
+    """Return the species that match a locations selection `locations`.
+
+    The species are returned in the format of
+    :meth:`AccessLocalDB.get_species`. The result is cached per process
+    with the sorted location IDs as the key, so the species selection
+    dialog opens instantly when the user goes back and forth in the
+    wizard. The cache is cleared if the local database file was modified
+    or replaced. This function may be called from any thread.
+    """
+    key = get_species_cache_key(locations)
+    with species_cache_lock:
+        if key in species_cache:
+            return species_cache[key]
+
+    # Query outside the lock, so a slow query doesn't block other
+    # selections. The connection is created in the calling thread.
+    db = get_database_accessor()
+    species = db.get_species(locations)
+    db.close()
+
+    with species_cache_lock:
+        # Drop entries for an older version of the database file.
+        for k in species_cache.keys():
+            if k[0] != key[0]:
+                del species_cache[k]
+        species_cache[key] = species
+    return species
+
+def clear_species_cache():
+    """Remove all species lists cached by :func:`get_species`."""
+    with species_cache_lock:
+        species_cache.clear()
+
+def iter_csv_rows(filename, delimiter=';', quotechar='"'):
+    """Return a generator yielding the rows from CSV file `filename`.
+
+    Rows are read from the file one at a time, so the file is never loaded
+    into memory as a whole. If the first field of the first row is not an
+    integer, the first row is treated as a header and is skipped.
+    """
+    f = open(filename, 'r')
+    try:
+        # Use Python's CSV module to create a CSV reader.
+        setl_reader = csv.reader(f, delimiter=delimiter, quotechar=quotechar)
+
+        for rownum,row in enumerate(setl_reader):
+            # Check if the first row contains headers by checking if the first
+            # field in the first row is a string. If so, skip the first row.
+            if rownum == 0:
+                try:
+                    row[0] = int(row[0])
+                except:
+                    continue
+            yield row
+    finally:
+        f.close()
+
+def iter_xls_rows(filename):
+    """Return a generator yielding the rows from the first sheet of Excel
+    file `filename`.
+
+    Excel 2007 (.xlsx) files are streamed with :func:`iter_xlsx_rows`, so
+    only one row is kept in memory at a time. Older Excel (.xls) files are
+    opened by xlrd with on-demand loading, which means that only the first
+    sheet is parsed. The resources used by xlrd are released as soon as all
+    rows have been read.
+
+    If the first field of the first row is a string, the first row is
+    treated as a header and is skipped.
+    """
+    if filename.lower().endswith('.xlsx'):
+        rows = iter_xlsx_rows(filename)
+    else:
+        rows = _iter_xlrd_rows(filename)
+
+    for rownum,values in enumerate(rows):
+        # Check if the first row contains headers by checking if the first
+        # field in the first row is a string. If so, skip the first row.
+        if rownum == 0 and values and isinstance(values[0], basestring):
+            continue
+        yield values
+
+def _iter_xlrd_rows(filename):
+    """Return a generator yielding the rows from the first sheet of Excel
+    file `filename` using xlrd.
+    """
+    book = xlrd.open_workbook(filename, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        for rownum in xrange(sheet.nrows):
+            yield sheet.row_values(rownum)
+    finally:
+        book.release_resources()
+
+def validate_localities_rows(rows):
+    """Return a generator yielding the rows from iterable `rows` after
+    checking that they are valid rows for the localities table.
+    """
+    for row in rows:
+        if len(row) != 5:
+            raise ValueError("Expecting 5 fields per row for the "
+                "localities file, found %d fields." % len(row))
+        yield row
+
+def validate_plates_rows(rows):
+    """Return a generator yielding the rows from iterable `rows` after
+    checking that they are valid rows for the plates table.
+    """
+    for row in rows:
+        if len(row) != 10:
+            raise ValueError("Expecting 10 fields per row for the "
+                "plates file, found %d fields." % len(row))
+        yield row
+
+def validate_records_rows(rows, exact=False):
+    """Return a generator yielding the first 38 fields of the rows from
+    iterable `rows` after checking that they are valid rows for the records
+    table.
+
+    If `exact` is True, each row must have exactly 40 fields (the format
+    of the CSV files). Otherwise each row must have at least 38 fields.
+    """
+    for row in rows:
+        if exact and len(row) != 40:
+            raise ValueError("Expecting 40 fields per row for the "
+                "records file, found %d fields." % len(row))
+        elif len(row) < 38:
+            raise ValueError("Expecting at least 38 fields per row for the "
+                "records file, found %d fields." % len(row))
+        yield row[:38]
+
+def validate_species_rows(rows):
+    """Return a generator yielding the rows from iterable `rows` converted
+    to valid rows for the species table.
+
+    Rows are padded to 17 fields. Empty fields are set to None and the
+    strings "TRUE" and "FALSE" are converted to booleans.
+    """
+    for row in rows:
+        n = len(row)
+        if n > 17:
+            raise ValueError("Expecting at most 17 fields per row for the "
+                "species file, found %d fields." % n)
+
+        row_new = []
+        for i in range(17):
+            try:
+                val = row[i]
+                if val == '':
+                    row_new.append(None)
+                elif val == 'FALSE':
+                    row_new.append(False)
+                elif val == 'TRUE':
+                    row_new.append(True)
+                else:
+                    row_new.append(val)
+            except:
+                row_new.append(None)
+        yield row_new
+
+# The number of fields for each table that is filled from the SETL data
+# files.
+DATA_TABLE_FIELDS = {
+    'localities': 5,
+    'plates': 10,
+    'records': 38,
+    'species': 17,
+}
+
+# The number of seconds the importer waits for rows from the parser
+# processes before it checks if the parsers are still running.
+IMPORT_POLL_TIMEOUT = 1.0
+
+def iter_data_file_rows(table, filename):
+    """Return a generator yielding the validated rows for table `table`
+    from SETL data file `filename`.
+
+    The file is read as an Excel file if it has the .xls or .xlsx extension,
+    and as a CSV file otherwise.
+    """
+    # Regular expression for matching Excel files. Because we support
+    # .xlsx files, Python module xlrd version 0.8.0 or later is
+    # required.
+    if re.match(".*\.(xls|xlsx)$", filename):
+        rows = iter_xls_rows(filename)
+        exact = False
+    else:
+        rows = iter_csv_rows(filename)
+        exact = True
+
+    if table == 'localities':
+        return validate_localities_rows(rows)
+    elif table == 'plates':
+        return validate_plates_rows(rows)
+    elif table == 'records':
+        return validate_records_rows(rows, exact)
+    elif table == 'species':
+        return validate_species_rows(rows)
+    raise ValueError("Unknown table '%s'." % table)
+
+def parse_data_file(table, filename, queue, batch_size):
+    """Put the validated rows for table `table` from SETL data file
+    `filename` on `queue` in batches of `batch_size` rows.
+
+    This function is the target for the worker processes started by
+    :meth:`MakeLocalDB.insert_data_files_parallel`. Items put on the queue
+    are tuples ``(task, table, data)``, where `task` is one of:
+
+    ``rows``
+      `data` is a list of rows to be inserted into `table`.
+
+    ``done``
+      All rows from the file have been put on the queue.
+
+    ``error``
+      Parsing failed and `data` is the exception that was raised.
+    """
+    try:
+        rows = iter_data_file_rows(table, filename)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            queue.put(('rows', table, batch))
+        queue.put(('done', table, None))
+    except Exception as e:
+        # The exception is pickled by the queue. If it can't be pickled and
+        # unpickled, pass the error message instead, or the error would be
+        # lost.
+        try:
+            pickle.loads(pickle.dumps(e, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            e = ValueError("%s: %s" % (e.__class__.__name__, e))
+        queue.put(('error', table, e))
+
+# XML namespaces used in Excel 2007 (.xlsx) files.
+XLSX_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+XLSX_NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+def iter_xlsx_rows(filename):
+    """Return a generator yielding the rows from the first sheet of Excel
+    2007 file `filename`.
+
+    The sheet is parsed with an incremental XML parser, and each row element
+    is discarded as soon as its values have been yielded. This keeps memory
+    usage bounded, even for very large records sheets. Cell values are
+    returned like xlrd does; numbers as floats, text as unicode and empty
+    cells as empty strings. Rows are padded to the width of the sheet if the
+    sheet defines its dimension.
+    """
+    archive = zipfile.ZipFile(filename)
+    try:
+        strings = _get_xlsx_shared_strings(archive)
+        sheet_path = _get_xlsx_first_sheet_path(archive)
+
+        ncols = 0
+        sheet_data = None
+        f = archive.open(sheet_path)
+        try:
+            for event, elem in ElementTree.iterparse(f, events=('start','end')):
+                if event == 'start':
+                    if elem.tag == XLSX_NS_MAIN + 'sheetData':
+                        sheet_data = elem
+                    continue
+
+                if elem.tag == XLSX_NS_MAIN + 'dimension':
+                    # The dimension is something like "A1:AN2500".
+                    ref = elem.get('ref', '').split(':')[-1]
+                    ncols = _get_xlsx_column_index(ref) + 1
+                elif elem.tag == XLSX_NS_MAIN + 'row':
+                    values = []
+                    for cell in elem.iter(XLSX_NS_MAIN + 'c'):
+                        # Fill the gaps left by empty cells.
+                        col = _get_xlsx_column_index(cell.get('r'), len(values))
+                        values.extend([''] * (col - len(values)))
+                        values.append(_get_xlsx_cell_value(cell, strings))
+                    values.extend([''] * (ncols - len(values)))
+
+                    # Free the parsed row before continuing.
+                    elem.clear()
+                    if sheet_data is not None:
+                        sheet_data.clear()
+                    yield values
+        finally:
+            f.close()
+    finally:
+        archive.close()
+
+def _get_xlsx_shared_strings(archive):
+    """Return the list of shared strings from Excel 2007 file `archive`."""
+    strings = []
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return strings
+    f = archive.open('xl/sharedStrings.xml')
+    try:
+        for event, elem in ElementTree.iterparse(f):
+            if elem.tag == XLSX_NS_MAIN + 'si':
+                # Rich text strings consist of multiple text elements.
+                text = u''.join(t.text or u'' for t in
+                    elem.iter(XLSX_NS_MAIN + 't'))
+                strings.append(unicode(text))
+                elem.clear()
+    finally:
+        f.close()
+    return strings
+
+def _get_xlsx_first_sheet_path(archive):
+    """Return the path of the first sheet in Excel 2007 file `archive`."""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find(XLSX_NS_MAIN + 'sheets/' + XLSX_NS_MAIN + 'sheet')
+    rel_id = sheet.get(XLSX_NS_REL + 'id')
+
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(XLSX_NS_PKG_REL + 'Relationship'):
+        if rel.get('Id') == rel_id:
+            target = rel.get('Target')
+            if target.startswith('/'):
+                return target[1:]
+            return 'xl/' + target
+    raise ValueError("The Excel file does not contain any sheets.")
+
+def _get_xlsx_column_index(ref, default=0):
+    """Return the zero based column index for cell reference `ref` (e.g.
+    "AB12"). Return `default` if `ref` is not set.
+    """
+    if not ref:
+        return default
+    index = 0
+    for char in ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + (ord(char.upper()) - ord('A') + 1)
+    return index - 1
+
+def _get_xlsx_cell_value(cell, strings):
+    """Return the value for cell element `cell`."""
+    cell_type = cell.get('t', 'n')
+    if cell_type == 'inlineStr':
+        return unicode(u''.join(t.text or u'' for t in
+            cell.iter(XLSX_NS_MAIN + 't')))
+
+    value = cell.findtext(XLSX_NS_MAIN + 'v')
+    if value is None:
+        return ''
+    if cell_type == 's':
+        return strings[int(value)]
+    elif cell_type == 'n':
+        return float(value)
+    elif cell_type == 'b':
+        return int(value)
+    elif cell_type == 'e':
+        return ''
+    return unicode(value)
+
 class MakeLocalDB(threading.Thread):
     """Create a local SQLite database with default tables and fill some
     tables based on the data source.
@@ -142,6 +552,9 @@ class MakeLocalDB(threading.Thread):
             # Exit gracefully.
             self.on_exit()
 
+            # The cached species lists are no longer valid.
+            clear_species_cache()
+
             # Emit the signal that the local database has been created.
             # Note that the signal will be sent from a separate thread,
             # so we must use gobject.idle_add.
@@ -164,6 +577,9 @@ class MakeLocalDB(threading.Thread):
         characters. Excel (\*.xls) files must have the same format as the CSV
         files and must not have a header.
 
+        The four files are parsed concurrently in separate processes. See
+        :meth:`insert_data_files_parallel`.
+
         Design Part: 1.32
         """
         logging.info("Loading SETL data from local files...")
@@ -189,46 +605,23 @@ class MakeLocalDB(threading.Thread):
 
         # Set the total number of times we're going to update the progress
         # dialog.
-        self.pdialog_handler.set_total_steps(4)
+        self.pdialog_handler.set_total_steps(5)
+        self.pdialog_handler.set_action("Importing data files")
+
+        # The data files to import, as (table, filename) pairs.
+        files = (
+            ('localities', localities_file),
+            ('plates', plates_file),
+            ('records', records_file),
+            ('species', species_file),
+        )
 
         # Insert the data from the data files into the local database.
         try:
-            filename = os.path.split(localities_file)[1]
-            self.pdialog_handler.set_action("Importing %s" % filename)
+            self.insert_data_files_parallel(files)
 
-            # Regular expression for matching Excel files. Because we support
-            # .xlsx files, Python module xlrd version 0.8.0 or later is
-            # required.
-            re_excel = ".*\.(xls|xlsx)$"
-
-            if re.match(re_excel, localities_file):
-                self.insert_locations_from_xls(localities_file)
-            else:
-                self.insert_locations_from_csv(localities_file)
-
-            filename = os.path.split(plates_file)[1]
-            self.pdialog_handler.increase("Importing %s" % filename)
-
-            if re.match(re_excel, plates_file):
-                self.insert_plates_from_xls(plates_file)
-            else:
-                self.insert_plates_from_csv(plates_file)
-
-            filename = os.path.split(records_file)[1]
-            self.pdialog_handler.increase("Importing %s" % filename)
-
-            if re.match(re_excel, records_file):
-                self.insert_records_from_xls(records_file)
-            else:
-                self.insert_records_from_csv(records_file)
-
-            filename = os.path.split(species_file)[1]
-            self.pdialog_handler.increase("Importing %s" % filename)
-
-            if re.match(re_excel, species_file):
-                self.insert_species_from_xls(species_file)
-            else:
-                self.insert_species_from_csv(species_file)
+            # Fill the species index for the locations.
+            self.fill_location_species_table()
 
             # Commit the database changes.
             self.connection.commit()
@@ -241,6 +634,16 @@ class MakeLocalDB(threading.Thread):
             gobject.idle_add(setlyze.sender.emit, 'file-import-failed', e)
             return
 
+        # Write a snapshot of the records table for fast access to the
+        # records by the analyses. This is optional, so the import doesn't
+        # fail if the snapshot can't be written.
+        if setlyze.snapshot.is_available():
+            try:
+                setlyze.snapshot.write_snapshot(self.connection,
+                    get_data_fingerprint(self.connection))
+            except Exception as e:
+                logging.warning("Failed to write snapshot: %s" % e)
+
         # If we are here, the import was successful.
         self.pdialog_handler.increase("")
         logging.info("Local database populated.")
@@ -248,6 +651,133 @@ class MakeLocalDB(threading.Thread):
 
         return True
 
+    def insert_data_files_parallel(self, files):
+        """Import SETL data files concurrently into the local database.
+
+        Argument `files` is a sequence of (table, filename) pairs. Each file
+        is parsed in a separate worker process by :func:`parse_data_file`,
+        which puts batches of validated rows on a shared queue. This thread
+        is the only writer to the database; it takes the batches from the
+        queue and inserts them in the corresponding tables. The size of the
+        queue is limited by configuration ``import-queue-size``, so workers
+        wait when the writer can't keep up.
+
+        If parsing one of the files fails, the other workers are terminated
+        and the error is raised. A :exc:`RuntimeError` is raised if a worker
+        exits before it finished parsing its file (e.g. when it was killed).
+        """
+        batch_size = setlyze.config.cfg.get('import-batch-size')
+        queue = multiprocessing.Queue(setlyze.config.cfg.get('import-queue-size'))
+
+        # Start a worker process for each data file.
+        workers = {}
+        for table, filename in files:
+            worker = multiprocessing.Process(target=parse_data_file,
+                args=(table, filename, queue, batch_size))
+            worker.daemon = True
+            worker.start()
+            workers[table] = worker
+
+        filenames = dict((table, os.path.basename(filename))
+            for table, filename in files)
+        counts = dict((table, 0) for table, filename in files)
+        start_time = time.time()
+        finished = False
+        try:
+            unfinished = set(workers)
+            while unfinished:
+                try:
+                    task, table, data = queue.get(timeout=IMPORT_POLL_TIMEOUT)
+                except Queue.Empty:
+                    self.check_import_workers(queue, workers, unfinished,
+                        filenames)
+                    continue
+                if task == 'rows':
+                    placeholders = ','.join('?' * DATA_TABLE_FIELDS[table])
+                    self.cursor.executemany("INSERT INTO %s VALUES (%s)" %
+                        (table, placeholders), data)
+                    counts[table] += len(data)
+                    self.pdialog_handler.set_action("Importing %s (%d rows)" %
+                        (filenames[table], counts[table]))
+                elif task == 'done':
+                    unfinished.discard(table)
+                    logging.info("Inserted %d rows into table %s" %
+                        (counts[table], table))
+                    self.pdialog_handler.increase()
+                elif task == 'error':
+                    raise data
+            finished = True
+        finally:
+            for worker in workers.itervalues():
+                # Don't leave workers behind if the import failed.
+                if not finished and worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+        # Log the throughput of the import.
+        elapsed = time.time() - start_time
+        total = sum(counts.values())
+        logging.info("Imported %d rows from %d data files in %.2f seconds "
+            "(%.0f rows/s)" % (total, len(files), elapsed,
+            total / elapsed if elapsed > 0 else 0))
+
+    def check_import_workers(self, queue, workers, unfinished, filenames):
+        """Raise an error if a worker of :meth:`insert_data_files_parallel`
+        exited without finishing its data file.
+
+        This is called when no rows arrived on `queue` for a while.
+        Argument `workers` is a dictionary with the worker process for each
+        table, `unfinished` the set of tables for which the worker didn't
+        report that it's done, and `filenames` the file name for each table.
+        """
+        exited = [table for table in unfinished
+            if not workers[table].is_alive()]
+        if not exited:
+            return
+
+        # A worker flushes everything it put on the queue before it exits,
+        # so if the queue is still empty, the exited workers never reported
+        # that they were done.
+        if not queue.empty():
+            return
+
+        table = exited[0]
+        raise RuntimeError("Failed to import %s: the parser process exited "
+            "unexpectedly (exit code %s)." % (filenames[table],
+            workers[table].exitcode))
+
+    def insert_rows(self, table, rows, n_fields, filename=None):
+        """Insert the rows from iterable `rows` into table `table` of the
+        local database.
+
+        Each row must contain `n_fields` values. The rows are inserted in
+        batches of ``import-batch-size`` rows, so only one batch of rows is
+        held in memory at a time. If `filename` is set, the progress dialog
+        shows the number of rows imported from that file after each batch.
+
+        Returns the number of inserted rows.
+        """
+        batch_size = setlyze.config.cfg.get('import-batch-size')
+        placeholders = ','.join('?' * n_fields)
+        sql = "INSERT INTO %s VALUES (%s)" % (table, placeholders)
+
+        rows = iter(rows)
+        n_rows = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            self.cursor.executemany(sql, batch)
+            n_rows += len(batch)
+
+            # Report the progress for this file.
+            if filename:
+                self.pdialog_handler.set_action("Importing %s (%d rows)" %
+                    (filename, n_rows))
+
+        logging.info("Inserted %d rows into table %s" % (n_rows, table))
+        return n_rows
+
     def insert_locations_from_csv(self, filename, delimiter=';', quotechar='"'):
         """Insert the SETL localities from a CSV file into the local
         database.
@@ -264,30 +794,9 @@ class MakeLocalDB(threading.Thread):
         Design Part: 1.34
         """
         logging.info("Importing localities data from %s" % filename)
-
-        # Try to open the CSV file.
-        f = open(filename, 'r')
-
-        # Use Python's CSV module to create a CSV reader.
-        setl_reader = csv.reader(f, delimiter=delimiter, quotechar=quotechar)
-
-        # Read through every row in the CSV file and insert that row
-        # into the local database.
-        for rownum,row in enumerate(setl_reader):
-            if len(row) != 5:
-                raise ValueError("Expecting 5 fields per row for the "
-                    "localities file, found %d fields." % len(row))
-
-            # Check if the first row contains headers by checking if the first
-            # field in the first row is a string. If so, skip the first row.
-            if rownum == 0:
-                try:
-                    row[0] = int(row[0])
-                except:
-                    continue
-
-            self.cursor.execute("INSERT INTO localities VALUES (?,?,?,?,?)",
-                row)
+        rows = iter_csv_rows(filename, delimiter, quotechar)
+        self.insert_rows('localities', validate_localities_rows(rows), 5,
+            os.path.basename(filename))
 
     def insert_species_from_csv(self, filename, delimiter=';', quotechar='"'):
         """Insert the species from a CSV file into the local database.
@@ -304,49 +813,9 @@ class MakeLocalDB(threading.Thread):
         Design Part: 1.35
         """
         logging.info("Importing species data from %s" % filename)
-
-        # Try to open the CSV file.
-        f = open(filename, 'r')
-
-        # Use Python's CSV module to create a CSV reader.
-        setl_reader = csv.reader(f, delimiter=delimiter, quotechar=quotechar)
-
-        # Read through every row in the CSV file and insert that row
-        # into the local database.
-        for rownum,row in enumerate(setl_reader):
-            n = len(row)
-            if n > 17:
-                raise ValueError("Expecting at most 17 fields per row for the "
-                    "species file, found %d fields." % n)
-
-            # Check if the first row contains headers by checking if the first
-            # field in the first row is a string. If so, skip the first row.
-            if rownum == 0:
-                try:
-                    row[0] = int(row[0])
-                except:
-                    continue
-
-            row_new = []
-            for i in range(17):
-                try:
-                    val = row[i]
-                    if val == '':
-                        row_new.append(None)
-                    elif val == 'FALSE':
-                        row_new.append(False)
-                    elif val == 'TRUE':
-                        row_new.append(True)
-                    else:
-                        row_new.append(val)
-                except:
-                    row_new.append(None)
-
-            placeholders = ','.join('?' * 17)
-            self.cursor.execute("INSERT INTO species VALUES (%s)" %
-                placeholders,
-                row_new
-            )
+        rows = iter_csv_rows(filename, delimiter, quotechar)
+        self.insert_rows('species', validate_species_rows(rows), 17,
+            os.path.basename(filename))
 
     def insert_plates_from_csv(self, filename, delimiter=';', quotechar='"'):
         """Insert the plates from a CSV file into the local database.
@@ -363,30 +832,9 @@ class MakeLocalDB(threading.Thread):
         Design Part: 1.36
         """
         logging.info("Importing plates data from %s" % filename)
-
-        # Try to open the CSV file.
-        f = open(filename, 'r')
-
-        # Use Python's CSV module to create a CSV reader.
-        setl_reader = csv.reader(f, delimiter=delimiter, quotechar=quotechar)
-
-        # Read through every row in the CSV file and insert that row
-        # into the local database.
-        for rownum,row in enumerate(setl_reader):
-            if len(row) != 10:
-                raise ValueError("Expecting 10 fields per row for the "
-                    "plates file, found %d fields." % len(row))
-
-            # Check if the first row contains headers by checking if the first
-            # field in the first row is a string. If so, skip the first row.
-            if rownum == 0:
-                try:
-                    row[0] = int(row[0])
-                except:
-                    continue
-
-            self.cursor.execute("INSERT INTO plates VALUES (?,?,?,?,?,?,?,?,?,?)",
-                row)
+        rows = iter_csv_rows(filename, delimiter, quotechar)
+        self.insert_rows('plates', validate_plates_rows(rows), 10,
+            os.path.basename(filename))
 
     def insert_records_from_csv(self, filename, delimiter=';', quotechar='"'):
         """Insert the records from a CSV file into the local database.
@@ -403,31 +851,9 @@ class MakeLocalDB(threading.Thread):
         Design Part: 1.37
         """
         logging.info("Importing records data from %s" % filename)
-
-        # Try to open the CSV file.
-        f = open(filename, 'r')
-
-        # Use Python's CSV module to create a CSV reader.
-        setl_reader = csv.reader(f, delimiter=delimiter, quotechar=quotechar)
-
-        # Read through every row in the CSV file and insert that row
-        # into the local database.
-        placeholders = ','.join('?' * 38)
-        for rownum,row in enumerate(setl_reader):
-            if len(row) != 40:
-                raise ValueError("Expecting 40 fields per row for the "
-                    "records file, found %d fields." % len(row))
-
-            # Check if the first row contains headers by checking if the first
-            # field in the first row is a string. If so, skip the first row.
-            if rownum == 0:
-                try:
-                    row[0] = int(row[0])
-                except:
-                    continue
-
-            self.cursor.execute("INSERT INTO records VALUES (%s)" % placeholders,
-                row[:38])
+        rows = iter_csv_rows(filename, delimiter, quotechar)
+        self.insert_rows('records', validate_records_rows(rows, exact=True),
+            38, os.path.basename(filename))
 
     def insert_locations_from_xls(self, filename):
         """Insert the SETL localities from a XLS file into the local
@@ -439,28 +865,9 @@ class MakeLocalDB(threading.Thread):
         Design Part: TODO
         """
         logging.info("Importing localities data from %s" % filename)
-
-        # Try to open the XLS file.
-        f = xlrd.open_workbook(filename)
-
-        # Use Python's xlrd module to create a XLS reader.
-        setl_reader = f.sheet_by_index(0)
-
-        # Read through every row in the XLS file and insert that row
-        # into the local database.
-        for rownum in range(setl_reader.nrows):
-            values = setl_reader.row_values(rownum)
-            if len(values) != 5:
-                raise ValueError("Expecting 5 fields per row for the "
-                    "localities file, found %d fields." % len(values))
-
-            # Check if the first row contains headers by checking if the first
-            # field in the first row is a string. If so, skip the first row.
-            if rownum == 0 and isinstance(values[0], unicode):
-                continue
-
-            self.cursor.execute("INSERT INTO localities VALUES (?,?,?,?,?)",
-                values)
+        rows = iter_xls_rows(filename)
+        self.insert_rows('localities', validate_localities_rows(rows), 5,
+            os.path.basename(filename))
 
     def insert_plates_from_xls(self, filename):
         """Insert the plates from a XLS file into the local database.
@@ -471,63 +878,25 @@ class MakeLocalDB(threading.Thread):
         Design Part: TODO
         """
         logging.info("Importing plates data from %s" % filename)
-
-        # Try to open the XLS file.
-        f = xlrd.open_workbook(filename)
-
-        # Use Python's xlrd module to create a XLS reader.
-        setl_reader = f.sheet_by_index(0)
-
-        # Read through every row in the XLS file and insert that row
-        # into the local database.
-        for rownum in range(setl_reader.nrows):
-            values = setl_reader.row_values(rownum)
-
-            if len(values) != 10:
-                raise ValueError("Expecting 10 fields per row for the "
-                    "plates file, found %d fields." % len(values))
-
-            # Check if the first row contains headers by checking if the first
-            # field in the first row is a string. If so, skip the first row.
-            if rownum == 0 and isinstance(values[0], unicode):
-                continue
-
-            self.cursor.execute("INSERT INTO plates VALUES (?,?,?,?,?,?,?,?,?,?)",
-                values)
+        rows = iter_xls_rows(filename)
+        self.insert_rows('plates', validate_plates_rows(rows), 10,
+            os.path.basename(filename))
 
     def insert_records_from_xls(self, filename):
         """Insert the records from a XLS file into the local database.
 
+        The rows are streamed from the file (see :func:`iter_xls_rows`), so
+        large records sheets can be imported with bounded memory usage.
+
         For a description of the format for the localities file, refer
         to :ref:`design-part-data-2.21`.
 
         Design Part: TODO
         """
         logging.info("Importing records data from %s" % filename)
-
-        # Try to open the XLS file.
-        f = xlrd.open_workbook(filename)
-
-        # Use Python's xlrd module to create a XLS reader.
-        setl_reader = f.sheet_by_index(0)
-
-        # Read through every row in the xls file and insert that row
-        # into the local database.
-        placeholders = ','.join('?' * 38)
-        for rownum in range(setl_reader.nrows):
-            values = setl_reader.row_values(rownum)
-
-            if len(values) < 38:
-                raise ValueError("Expecting at least 38 fields per row for the "
-                    "records file, found %d fields." % len(values))
-
-            # Check if the first row contains headers by checking if the first
-            # field in the first row is a string. If so, skip the first row.
-            if rownum == 0 and isinstance(values[0], unicode):
-                continue
-
-            self.cursor.execute("INSERT INTO records VALUES (%s)" % placeholders,
-                values[:38])
+        rows = iter_xls_rows(filename)
+        self.insert_rows('records', validate_records_rows(rows), 38,
+            os.path.basename(filename))
 
     def insert_species_from_xls(self, filename):
         """Insert the species from a XLS file into the local database.
@@ -538,44 +907,9 @@ class MakeLocalDB(threading.Thread):
         Design Part: 1.35(b) TODO
         """
         logging.info("Importing species data from %s" % filename)
-
-        # Try to open the XLS file.
-        f = xlrd.open_workbook(filename)
-
-        # Use Python's xlrd module to create a XLS reader.
-        setl_reader = f.sheet_by_index(0)
-
-        # Read through every row in the XLS file and insert that row
-        # into the local database.
-        for rownum in range(setl_reader.nrows):
-            values = setl_reader.row_values(rownum)
-
-            n = len(values)
-            if n > 17:
-                raise ValueError("Expecting at most 17 fields per row for the "
-                    "species file, found %d fields." % n)
-
-            # Check if the first row contains headers by checking if the first
-            # field in the first row is a string. If so, skip the first row.
-            if rownum == 0 and isinstance(values[0], unicode):
-                continue
-
-            placeholders = ','.join('?' * 17)
-            row = []
-            for i in range(17):
-                try:
-                    val = values[i]
-                    if val == '':
-                        row.append(None)
-                    else:
-                        row.append(val)
-                except:
-                    row.append(None)
-
-            self.cursor.execute("INSERT INTO species VALUES (%s);" %
-                placeholders,
-                row
-            )
+        rows = iter_xls_rows(filename)
+        self.insert_rows('species', validate_species_rows(rows), 17,
+            os.path.basename(filename))
 
     def insert_from_db(self):
         """Create a new local database and load localities and species
@@ -636,9 +970,15 @@ class MakeLocalDB(threading.Thread):
             logging.info("Creating data folder %s" % (data_path))
             os.makedirs(data_path)
 
-        # Delete the current database file.
-        if os.path.isfile(self.dbfile):
-            self.remove_db_file()
+        # Close the pooled connections to the current database file, so
+        # its write-ahead log is no longer in use.
+        connections.close()
+
+        # Delete the current database file and its write-ahead log.
+        self.remove_db_file()
+
+        # Delete the snapshot of the old records table.
+        setlyze.snapshot.remove_snapshot()
 
         # Create a new database.
         self.connection = sqlite.connect(self.dbfile)
@@ -650,6 +990,7 @@ class MakeLocalDB(threading.Thread):
         self.create_table_species()
         self.create_table_plates()
         self.create_table_records()
+        self.create_table_location_species()
 
         # Commit the transaction.
         self.connection.commit()
@@ -660,6 +1001,12 @@ class MakeLocalDB(threading.Thread):
     def remove_db_file(self, tries=0):
         """Remove the database file.
 
+        The write-ahead log (``-wal``) and shared memory (``-shm``) files of
+        the database are removed as well. Otherwise a write-ahead log left
+        behind by a connection that wasn't closed could be applied to the
+        new database with the same file name. The pooled connections must
+        be closed first (see :meth:`ConnectionManager.close`).
+
         This method does three tries if for some reason the database file
         could not be deleted (e.g. the file is in use by a different process).
         """
@@ -667,7 +1014,10 @@ class MakeLocalDB(threading.Thread):
             raise EnvironmentError("Failed to delete database file %s. "
                 "It may be in use by a different process." % self.dbfile)
         try:
-            os.remove(self.dbfile)
+            for path in (self.dbfile, self.dbfile + '-wal',
+                    self.dbfile + '-shm'):
+                if os.path.isfile(path):
+                    os.remove(path)
         except:
             tries += 1
             time.sleep(2)
@@ -819,6 +1169,502 @@ class MakeLocalDB(threading.Thread):
             rec_v INTEGER \
         )")
 
+    def create_table_location_species(self):
+        """Create the "location_species" table.
+
+        This table is an index of the species found on the plates of each
+        location, with the number of plates and records per species per
+        location. It is filled by :meth:`fill_location_species_table` after
+        the SETL data has been imported, and allows the species for a
+        locations selection to be obtained without scanning the records.
+        """
+        self.cursor.execute("CREATE TABLE location_species (\
+            loc_id INTEGER, \
+            spe_id INTEGER, \
+            n_plates INTEGER, \
+            n_records INTEGER, \
+            PRIMARY KEY (loc_id, spe_id) \
+        )")
+
+    def fill_location_species_table(self):
+        """Populate table "location_species" from the plates and records
+        tables.
+        """
+        logging.info("Creating the species index for the locations...")
+        self.cursor.execute("INSERT INTO location_species "
+            "SELECT p.pla_loc_id, r.rec_spe_id, "
+                "COUNT(DISTINCT r.rec_pla_id), COUNT(r.rec_id) "
+            "FROM records AS r "
+            "INNER JOIN plates AS p ON r.rec_pla_id = p.pla_id "
+            "WHERE r.rec_spe_id != '' "
+            "GROUP BY p.pla_loc_id, r.rec_spe_id")
+
+def fill_id_table(cursor, table, ids):
+    """Fill temporary table `table` with the IDs from `ids`.
+
+    Argument `cursor` is a cursor for an SQLite connection and `ids` is an
+    iterable of integer IDs, or a single integer. The table is created in
+    the temporary database of the connection if it doesn't exist yet, and
+    emptied otherwise. It has a single column ``id``, which is the primary
+    key, so queries can join on it without building long query strings.
+    For example: ::
+
+        fill_id_table(cursor, 'ids_records', rec_ids)
+        cursor.execute("SELECT * FROM records "
+            "WHERE rec_id IN (SELECT id FROM temp.ids_records)")
+
+    Duplicate IDs are ignored. Returns the name of the table.
+    """
+    if isinstance(ids, (int, long)):
+        ids = [ids]
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS %s "
+        "(id INTEGER PRIMARY KEY)" % table)
+    cursor.execute("DELETE FROM temp.%s" % table)
+    cursor.executemany("INSERT OR IGNORE INTO temp.%s VALUES (?)" % table,
+        ((id,) for id in ids))
+    return table
+
+def sql_trace_enabled():
+    """Return True if SQL tracing is enabled.
+
+    Tracing is enabled with configuration ``sql-trace`` or by setting the
+    environment variable ``SETLYZE_SQL_TRACE`` to a value other than ``0``.
+    """
+    if setlyze.config.cfg.get('sql-trace'):
+        return True
+    return os.environ.get('SETLYZE_SQL_TRACE', '0') not in ('', '0')
+
+def get_sql_template(sql):
+    """Return the template for SQL statement `sql`.
+
+    White space is collapsed and literal numbers and strings are replaced by
+    ``?``. Lists of values, like in ``IN (1,2,3)``, are replaced by
+    ``(?...)``. Statements that only differ in their values have the same
+    template.
+    """
+    sql = re.sub(r"\s+", " ", sql).strip()
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?...)", sql)
+    return sql
+
+class Cursor(sqlite.Cursor):
+    """SQLite cursor that counts the statements it executes.
+
+    Each executed statement is passed to
+    :meth:`Connection.add_statement` of the connection the cursor belongs
+    to. Note that the time spent fetching the rows of a query is not
+    included.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.time()
+        try:
+            return super(Cursor, self).execute(sql, parameters)
+        finally:
+            self.connection.add_statement(time.time() - start, self, sql,
+                parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.time()
+        try:
+            return super(Cursor, self).executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.add_statement(time.time() - start, self, sql)
+
+class TracingCursor(Cursor):
+    """SQLite cursor that also counts the rows fetched from queries.
+
+    This cursor is used when tracing is enabled for the connection. The
+    fetched rows and the time spent fetching them are added to the statement
+    template of the last executed statement.
+    """
+
+    template = None
+
+    def next(self):
+        start = time.time()
+        row = super(TracingCursor, self).next()
+        self.connection.add_rows(self.template, 1, time.time() - start)
+        return row
+
+    def fetchone(self):
+        start = time.time()
+        row = super(TracingCursor, self).fetchone()
+        if row is not None:
+            self.connection.add_rows(self.template, 1, time.time() - start)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.time()
+        rows = super(TracingCursor, self).fetchmany(*args, **kwargs)
+        self.connection.add_rows(self.template, len(rows), time.time() - start)
+        return rows
+
+    def fetchall(self):
+        start = time.time()
+        rows = super(TracingCursor, self).fetchall()
+        self.connection.add_rows(self.template, len(rows), time.time() - start)
+        return rows
+
+class Connection(sqlite.Connection):
+    """SQLite connection that keeps track of the executed statements.
+
+    Attribute `n_statements` is the number of statements executed on this
+    connection and `statement_time` is the time in seconds spent executing
+    them. These are used to profile the analyses. Use it as the `factory` for
+    :py:func:`sqlite3.connect`.
+
+    Statements can also be traced with :meth:`set_trace`. Tracing keeps
+    the number of executes, the total time and the number of rows for each
+    statement template (see :func:`get_sql_template`) and logs slow queries
+    together with their query plan.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Connection, self).__init__(*args, **kwargs)
+        self.n_statements = 0
+        self.statement_time = 0.0
+        self.trace = False
+        self.slow_query_time = None
+        # Statistics for each statement template. Format:
+        # {template: [executes, seconds, rows], ...}
+        self.statements = {}
+
+    def set_trace(self, enabled=True, slow_query_time=None):
+        """Enable or disable tracing of the executed statements.
+
+        If `slow_query_time` is set, statements that take at least this
+        many seconds to execute are logged with their query plan.
+        """
+        self.trace = enabled
+        self.slow_query_time = slow_query_time
+
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = TracingCursor if self.trace else Cursor
+        return super(Connection, self).cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def add_statement(self, seconds, cursor=None, sql=None, parameters=None):
+        """Count a statement that took `seconds` seconds to execute.
+
+        If tracing is enabled, the statement `sql` executed on cursor
+        `cursor` with parameters `parameters` is added to the statistics
+        for its template.
+        """
+        self.n_statements += 1
+        self.statement_time += seconds
+        if not self.trace or sql is None:
+            return
+
+        template = get_sql_template(sql)
+        stats = self.statements.setdefault(template, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+        # The row count is only set for data modifying statements.
+        if cursor.rowcount > 0:
+            stats[2] += cursor.rowcount
+        if isinstance(cursor, TracingCursor):
+            cursor.template = template
+
+        if self.slow_query_time is not None and seconds >= self.slow_query_time:
+            self.log_slow_query(sql, parameters, seconds)
+
+    def add_rows(self, template, n, seconds):
+        """Add `n` rows fetched in `seconds` seconds to the statistics for
+        statement template `template`.
+        """
+        stats = self.statements.get(template)
+        if stats:
+            stats[1] += seconds
+            stats[2] += n
+
+    def log_slow_query(self, sql, parameters, seconds):
+        """Log the slow statement `sql` with its query plan.
+
+        The query plan is obtained by executing the statement with
+        parameters `parameters` with ``EXPLAIN QUERY PLAN``. If `parameters`
+        is None (e.g. for :py:meth:`~sqlite3.Cursor.executemany`), no query
+        plan is logged.
+        """
+        plan = []
+        if parameters is not None:
+            # Use a plain cursor, so this isn't traced.
+            cursor = super(Connection, self).cursor()
+            try:
+                cursor.execute("EXPLAIN QUERY PLAN %s" % sql, parameters)
+                plan = [str(row[-1]) for row in cursor]
+            except sqlite.Error:
+                # Not all statements have a query plan.
+                pass
+            finally:
+                cursor.close()
+        logging.warning("Slow query (%.3f seconds): %s%s" % (seconds,
+            re.sub(r"\s+", " ", sql).strip(),
+            "".join(["\n\t%s" % line for line in plan])))
+
+    def get_trace_summary(self):
+        """Return the statistics for the traced statements.
+
+        Returns a list of ``(template, executes, seconds, rows)`` tuples,
+        sorted by the total time spent, slowest first.
+        """
+        summary = [(template, stats[0], stats[1], stats[2]) for
+            template, stats in self.statements.iteritems()]
+        summary.sort(key=lambda x: x[2], reverse=True)
+        return summary
+
+    def log_trace_summary(self, title, limit=10):
+        """Log the `limit` statement templates on which most time was spent.
+
+        Argument `title` is used to identify the connection in the log.
+        """
+        summary = self.get_trace_summary()
+        logging.info("SQL trace for %s: %d statements, %d templates, "
+            "%.3f seconds" % (title, self.n_statements, len(summary),
+            self.statement_time))
+        for template, executes, seconds, rows in summary[:limit]:
+            logging.info("\t%6d executes %9.3fs %9d rows  %s" % (executes,
+                seconds, rows, template))
+
+class ConnectionManager(object):
+    """Pool of connections to the local database for this process.
+
+    Opening a connection and warming its page cache is repeated for each
+    :class:`AccessDBGeneric` instance otherwise, while the selection
+    dialogs, the analyses and the reports each create one. A connection is
+    taken from the pool with :meth:`acquire` and returned with
+    :meth:`release`, after which it is reset (open transactions are rolled
+    back and the TEMP tables are dropped) so the next user gets a clean
+    connection. At most configuration ``connection-pool-size`` idle
+    connections are kept.
+
+    Connections are opened with ``check_same_thread=False``. This is safe
+    because a connection is only used by one thread at a time: the one that
+    acquired it. The pragmas (see :meth:`configure`) are applied once, when
+    a connection is opened.
+
+    Idle connections are closed when the database file is replaced (e.g.
+    when a new local database is made). Connections inherited from the
+    parent process are never used; a child process starts with an empty
+    pool.
+
+    Worker processes of a batch only read from the database, so they open
+    it read-only (see :meth:`set_read_only`). Together with write-ahead
+    logging, the readers never wait for each other or for a writer.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all connections and reset the counters."""
+        self.pid = os.getpid()
+        self.key = None
+        self.idle = []
+        self.read_only = False
+        self.wal_keys = set()
+        self.n_opened = 0
+        self.n_reused = 0
+
+    def set_read_only(self, read_only=True):
+        """Open the database read-only in this process if `read_only` is
+        True.
+
+        The database file is opened with the URI ``file:...?mode=ro`` if
+        the SQLite library supports URI filenames. TEMP tables can still be
+        created, as they are stored separately. Idle connections are closed.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            self.close_idle()
+            self.key = None
+            self.read_only = read_only
+
+    def get_key(self, dbfile):
+        """Return a key that changes when database file `dbfile` is
+        replaced.
+        """
+        try:
+            return (dbfile, os.stat(dbfile).st_ino)
+        except OSError:
+            return (dbfile, None)
+
+    def acquire(self, dbfile):
+        """Return a connection to database file `dbfile` from the pool,
+        or a new connection if there is no idle connection.
+        """
+        key = self.get_key(dbfile)
+        with self.lock:
+            if self.pid != os.getpid():
+                # Don't touch connections inherited from the parent process.
+                self.reset()
+            if key != self.key:
+                self.close_idle()
+                self.key = key
+            if self.idle:
+                self.n_reused += 1
+                return self.idle.pop()
+            self.n_opened += 1
+            read_only = self.read_only
+
+        if read_only and sqlite_supports_uri():
+            uri = "file:%s?mode=ro" % urllib.pathname2url(os.path.abspath(dbfile))
+            conn = sqlite.connect(uri, factory=Connection,
+                check_same_thread=False)
+        else:
+            conn = sqlite.connect(dbfile, factory=Connection,
+                check_same_thread=False)
+        conn.pool_key = key
+        conn.read_only = read_only
+        self.configure(conn)
+        return conn
+
+    def configure(self, conn):
+        """Apply the pragmas to the new connection `conn`.
+
+        The page cache size, the maximum size of the memory-mapped part of
+        the database and the storage of TEMP tables are set from
+        configurations ``sqlite-cache-size``, ``sqlite-mmap-size`` and
+        ``sqlite-temp-store``. If configuration ``sqlite-wal`` is set, the
+        database is switched to write-ahead logging, which lets readers
+        and a writer work at the same time. The journal mode is stored in
+        the database file, so this is done once per file, and not by
+        read-only connections.
+        """
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA cache_size = %d" %
+            setlyze.config.cfg.get('sqlite-cache-size'))
+        cursor.execute("PRAGMA mmap_size = %d" %
+            setlyze.config.cfg.get('sqlite-mmap-size'))
+        cursor.execute("PRAGMA temp_store = %s" %
+            setlyze.config.cfg.get('sqlite-temp-store'))
+        if setlyze.config.cfg.get('sqlite-wal') and not conn.read_only and \
+                conn.pool_key not in self.wal_keys:
+            try:
+                cursor.execute("PRAGMA journal_mode = WAL")
+                self.wal_keys.add(conn.pool_key)
+            except sqlite.DatabaseError as e:
+                # For example if the file is read-only or locked by
+                # another process. The default journal mode is fine.
+                logging.warning("Could not enable WAL for %s: %s" %
+                    (conn.pool_key[0], e))
+        cursor.close()
+
+    def release(self, conn):
+        """Reset connection `conn` and return it to the pool.
+
+        The connection is closed instead if the pool is full, if the
+        database file was replaced or if it can't be reset.
+        """
+        try:
+            conn.rollback()
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM sqlite_temp_master "
+                "WHERE type = 'table'")
+            for name, in cursor.fetchall():
+                cursor.execute('DROP TABLE temp."%s"' % name)
+            cursor.close()
+            conn.commit()
+        except sqlite.Error as e:
+            logging.warning("Failed to reset a database connection: %s" % e)
+            conn.close()
+            return
+
+        # Start the statistics of the next user from zero.
+        conn.set_trace(False)
+        conn.n_statements = 0
+        conn.statement_time = 0.0
+        conn.statements = {}
+
+        with self.lock:
+            if self.pid == os.getpid() and conn.pool_key == self.key and \
+                    conn.read_only == self.read_only and \
+                    len(self.idle) < setlyze.config.cfg.get('connection-pool-size'):
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close_idle(self):
+        """Close the idle connections. The caller must hold the lock."""
+        for conn in self.idle:
+            conn.close()
+        self.idle = []
+
+    def close(self):
+        """Close all idle connections of this process."""
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            self.close_idle()
+            self.key = None
+
+    def get_stats(self):
+        """Return a dictionary with the number of connections opened and
+        reused by this process, and the number of idle connections.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                return {'opened': 0, 'reused': 0, 'idle': 0}
+            return {'opened': self.n_opened, 'reused': self.n_reused,
+                'idle': len(self.idle)}
+
+# The connection pool of this process.
+connections = ConnectionManager()
+
+# Whether the SQLite library accepts URI filenames (see sqlite_supports_uri).
+uri_support = None
+
+def sqlite_supports_uri():
+    """Return True if the SQLite library interprets URI filenames.
+
+    The :py:mod:`sqlite3` module of Python 2 has no option to enable URI
+    filenames, so they only work if SQLite was compiled with
+    ``SQLITE_USE_URI``. Otherwise a URI would be used as a file name.
+    """
+    global uri_support
+    if uri_support is None:
+        conn = sqlite.connect(':memory:')
+        options = [row[0] for row in conn.execute("PRAGMA compile_options")]
+        conn.close()
+        uri_support = 'USE_URI' in options or 'USE_URI=1' in options
+        if not uri_support:
+            logging.info("SQLite doesn't support URI filenames, the "
+                "database can't be opened read-only")
+    return uri_support
+
+def init_worker_storage():
+    """Prepare the database access of a batch worker process.
+
+    If configuration ``sqlite-worker-read-only`` is set, the local database
+    is opened read-only by this process (see
+    :meth:`ConnectionManager.set_read_only`). The temporary files of SQLite
+    (e.g. for TEMP tables if ``sqlite-temp-store`` is ``FILE``, and for
+    large sorts) and of Python are kept in a new folder of this process
+    instead of the shared temporary folder. The folder is removed when the
+    process exits. Returns the path to the folder.
+    """
+    if setlyze.config.cfg.get('sqlite-worker-read-only'):
+        connections.set_read_only(True)
+
+    path = tempfile.mkdtemp(prefix='setlyze-worker-%d-' % os.getpid())
+    # SQLite looks up this variable each time it creates a temporary file.
+    os.environ['SQLITE_TMPDIR'] = path
+    tempfile.tempdir = path
+    # Finalizers with an exit priority run when a process started by
+    # multiprocessing exits.
+    multiprocessing.util.Finalize(None, shutil.rmtree, args=(path, True),
+        exitpriority=0)
+    return path
+
 class AccessDBGeneric(object):
     """Super class for :class:`AccessLocalDB` and :class:`AccessRemoteDB`.
 
@@ -830,9 +1676,27 @@ class AccessDBGeneric(object):
     def __init__(self):
         self.progress_dialog = None
         self.dbfile = setlyze.config.cfg.get('db-file')
-        self.conn = sqlite.connect(self.dbfile)
+        # Take a connection from the pool of this process. It is returned
+        # to the pool with close().
+        self.conn = connections.acquire(self.dbfile)
+        if sql_trace_enabled():
+            self.conn.set_trace(True,
+                setlyze.config.cfg.get('sql-slow-query-time'))
         self.cursor = self.conn.cursor()
 
+    def close(self):
+        """Return the database connection to the connection pool.
+
+        The TEMP tables created on the connection are dropped. The object
+        can no longer be used after this.
+        """
+        if self.conn is None:
+            return
+        self.cursor.close()
+        connections.release(self.conn)
+        self.conn = None
+        self.cursor = None
+
     def get_database_info(self):
         """Return database information.
 
@@ -851,6 +1715,23 @@ class AccessDBGeneric(object):
 
         return info
 
+    def get_data_fingerprint(self):
+        """Return a fingerprint of the SETL data in the local database.
+
+        See :func:`get_data_fingerprint`.
+        """
+        return get_data_fingerprint(self.conn)
+
+    def checkpoint_wal(self):
+        """Copy all changes in the write-ahead log to the database file, so
+        a copy of the file contains all data.
+
+        Nothing is done if the database doesn't use write-ahead logging.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA wal_checkpoint(FULL)")
+        cursor.close()
+
     def get_locations(self):
         """Return a list of all locations from the local database.
 
@@ -1072,44 +1953,26 @@ class AccessDBGeneric(object):
             # If spots_n is a negative number, get all distances
             # up to the absolute number. So if we find -5, get all
             # distances up to 5.
-            cursor.execute("SELECT distance FROM %s" % distance_table)
-
-            # Get the plate IDs that have n spots lower or equal to the
-            # absolute spots number.
-            cursor.execute( "SELECT pla_id "
-                            "FROM plate_spot_totals "
-                            "WHERE n_spots_a <= %d" %
-                            (abs(spots_n))
-                            )
-            plate_ids = cursor.fetchall()
-            plate_ids_str = ",".join([str(item[0]) for item in plate_ids])
-
-            # Get the distances that match the plate IDs.
-            cursor.execute( "SELECT distance "
-                            "FROM %s "
-                            "WHERE rec_pla_id IN (%s)" %
-                            (distance_table, plate_ids_str)
-                            )
+            where = "n_spots_a <= %d" % abs(spots_n)
         else:
-            # Get the plate IDs that match the provided total spots number.
-            cursor.execute( "SELECT pla_id "
-                            "FROM plate_spot_totals "
-                            "WHERE n_spots_a = %d" %
-                            (spots_n)
-                            )
-            plate_ids = cursor.fetchall()
-            plate_ids_str = ",".join([str(item[0]) for item in plate_ids])
-
-            # Get the distances that match the plate IDs.
-            cursor.execute( "SELECT distance "
-                            "FROM %s "
-                            "WHERE rec_pla_id IN (%s)" %
-                            (distance_table, plate_ids_str)
-                            )
+            # Get the distances for the plates that match the provided
+            # total spots number.
+            where = "n_spots_a = %d" % spots_n
+
+        # Save the number of matching plates.
+        cursor.execute( "SELECT COUNT(*) "
+                        "FROM plate_spot_totals "
+                        "WHERE %s" % (where)
+                        )
+        self.matching_plates_total = cursor.fetchone()[0]
 
-        # Save the number of matching plates. Note that this variable can only
-        # be called after the iter that this generator returns was used.
-        self.matching_plates_total = len(plate_ids)
+        # Get the distances that match the plate IDs.
+        cursor.execute( "SELECT distance "
+                        "FROM %s "
+                        "WHERE rec_pla_id IN "
+                            "(SELECT pla_id FROM plate_spot_totals WHERE %s)" %
+                        (distance_table, where)
+                        )
 
         # Return all matching distances.
         for distance in cursor:
@@ -1126,7 +1989,9 @@ class AccessDBGeneric(object):
         The ratio A:B is considered the same as B:A.
 
         This is a generator, meaning that this method returns an
-        iterator. This iterator returns the distances.
+        iterator. This iterator returns the distances. The distances are
+        read before the first one is returned, so the temporary ID table
+        can be reused while iterating.
         """
         cursor = self.conn.cursor()
         plate_ids = []
@@ -1167,68 +2032,22 @@ class AccessDBGeneric(object):
         # be called after the iter that this generator returns was used.
         self.matching_plates_total = len(plate_ids)
 
-        # Turn the list of plate IDs into a string.
-        plate_ids_str = ",".join([str(x) for x in plate_ids])
+        # Put the plate IDs in a temporary table.
+        fill_id_table(cursor, 'ids_plates', plate_ids)
 
         # Get the distances that match the plate IDs.
         cursor.execute( "SELECT distance "
                         "FROM %s "
-                        "WHERE rec_pla_id IN (%s)" %
-                        (distance_table, plate_ids_str)
+                        "WHERE rec_pla_id IN (SELECT id FROM temp.ids_plates)" %
+                        (distance_table)
                         )
+        distances = cursor.fetchall()
+        cursor.close()
 
         # Return all matching distances.
-        for distance in cursor:
+        for distance in distances:
             yield distance[0]
 
-        # Close connection with the local database.
-        cursor.close()
-
-    def get_area_totals(self, plate_area_totals_table, area_group):
-        """Return total number of positive spots per area group per plate.
-
-        Argument `plate_area_totals_table` is either
-        ``plate_area_totals_observed`` or ``plate_area_totals_expected``.
-        The area group `area_group` can be a sequence containing a
-        combination of the letters A, B, C, and D. Each letter is one of
-        the default areas on a SETL plate.
-        """
-        cursor = self.conn.cursor()
-
-        # Compile a string containing the area fields for 'area_group'.
-        fields = []
-        for area in area_group:
-            if area == 'A':
-                fields.append('area_a')
-            elif area == 'B':
-                fields.append('area_b')
-            elif area == 'C':
-                fields.append('area_c')
-            elif area == 'D':
-                fields.append('area_d')
-        fields_str = ",".join(fields)
-
-        # Get the area totals for the areas in area group.
-        cursor.execute( "SELECT %s FROM %s" %
-                        (fields_str, plate_area_totals_table)
-                        )
-
-        if len(fields) > 1:
-            # We're dealing with combined areas, so we will return the total of
-            # the areas combined.
-            for totals in cursor:
-                total = 0
-                for t in totals:
-                    total += t
-                yield total
-        else:
-            # One field, so one total is returned per row.
-            for total in cursor:
-                yield total[0]
-
-        # Close connection with the local database.
-        cursor.close()
-
     def get_plates_total_matching_spots_total(self, n_spots, slot=0):
         """Return the number of plates that match the provided number of
         positive spots `n_spots`.
@@ -1279,6 +2098,9 @@ class AccessLocalDB(AccessDBGeneric):
 
     def __init__(self):
         super(AccessLocalDB, self).__init__()
+        # Use the snapshot of the records table if there is one. It is
+        # loaded once per process.
+        self.snapshot = setlyze.snapshot.load_snapshot(self)
 
     def create_table_species_spots_1(self):
         """Create temporary table "species_spots_1".
@@ -1409,81 +2231,81 @@ class AccessLocalDB(AccessDBGeneric):
             n_spots_b INTEGER \
         )")
 
-    def create_table_plate_area_totals_observed(self):
-        """Create temporary table "plate_area_totals_observed".
+    def get_species(self, locations):
+        """Return species that match a locations selection `locations`.
+
+        Species are returned as tuples in the format
+        ``(id, 'common_name', 'latin_name', invasive_in_nl, 'phylum',
+        'class', 'order', 'family', 'genus', 'species', 'subspecies',
+        n_plates, n_records)``, where `n_plates` and `n_records` are the
+        number of plates and records for the species in the selected
+        locations. Argument `locations` is a list of location IDs.
 
-        This table is used to store the total of positive spots per plate area
-        per plate ID.
+        The species are obtained from the "location_species" index table,
+        which is filled when SETL data is imported.
 
-        Design Part:
+        Design Part: 1.96
         """
+        cursor = self.conn.cursor()
 
-        # Design Part:
-        self.cursor.execute("CREATE TEMP TABLE plate_area_totals_observed (\
-            pla_id INTEGER PRIMARY KEY, \
-            area_a INTEGER, \
-            area_b INTEGER, \
-            area_c INTEGER, \
-            area_d INTEGER \
-        )")
+        # Put the location IDs in a temporary table.
+        fill_id_table(cursor, 'ids_locations', locations)
+
+        # Select information from the species that are found in the
+        # selected locations. Plates belong to a single location, so the
+        # counts for the locations can be summed.
+        cursor.execute("SELECT s.spe_id,s.spe_name_venacular,s.spe_name_latin,"
+            "s.spe_invasive_in_nl,s.spe_phylum,s.spe_class,s.spe_order,"
+            "s.spe_family,s.spe_genus,s.spe_species,s.spe_subspecies,"
+            "SUM(ls.n_plates),SUM(ls.n_records) "
+            "FROM location_species AS ls "
+            "INNER JOIN species AS s ON s.spe_id = ls.spe_id "
+            "WHERE ls.loc_id IN (SELECT id FROM temp.ids_locations) "
+            "GROUP BY s.spe_id")
+        species = cursor.fetchall()
 
-    def create_table_plate_area_totals_expected(self):
-        """Create temporary table "plate_area_totals_expected".
+        cursor.close()
+        return species
 
-        This table is used to store the total of expected positive spots per
-        plate area per plate ID.
+    def get_species_spot_totals(self, locations):
+        """Return the spot totals for each species in a locations selection.
 
-        Design Part: TODO
+        Returns a dictionary ``{spe_id: (n_records, n_spots, n_spots_sq), ...}``
+        where `n_records` is the number of records of the species in the
+        locations with IDs in the list `locations`, `n_spots` is the total
+        number of positive spots of these records and `n_spots_sq` is the
+        sum of the squared number of positive spots per record. These are
+        used to estimate the cost of an analysis (see
+        :func:`setlyze.analysis.common.schedule_jobs`).
         """
-        self.cursor.execute("CREATE TEMP TABLE plate_area_totals_expected (\
-            pla_id INTEGER PRIMARY KEY, \
-            area_a INTEGER, \
-            area_b INTEGER, \
-            area_c INTEGER, \
-            area_d INTEGER \
-        )")
+        cursor = self.conn.cursor()
 
-    def get_species(self, locations):
-        """Return species that match a locations selection `locations`.
+        # Put the location IDs in a temporary table.
+        fill_id_table(cursor, 'ids_locations', locations)
 
-        Species are returned as tuples in the format
-        ``(id, 'common_name', 'latin_name')``. Argument `locations` is a list
-        of location IDs.
+        spots = "+".join(["r.rec_sur%d" % i for i in range(1, 26)])
+        cursor.execute("SELECT rec_spe_id, COUNT(*), TOTAL(n), TOTAL(n*n) "
+            "FROM (SELECT r.rec_spe_id AS rec_spe_id, %s AS n "
+                "FROM records AS r "
+                "INNER JOIN plates AS p ON r.rec_pla_id = p.pla_id "
+                "WHERE p.pla_loc_id IN (SELECT id FROM temp.ids_locations)) "
+            "GROUP BY rec_spe_id" % spots)
+        totals = dict((row[0], tuple(row[1:])) for row in cursor)
 
-        Design Part: 1.96
+        cursor.close()
+        return totals
+
+    def get_plates_total(self, locations):
+        """Return the number of plates in the locations with IDs in the list
+        `locations`.
         """
         cursor = self.conn.cursor()
-
-        # Select all plate IDs from plates that are from the selected
-        # locations.
-        placeholders = ','.join('?' * len(locations))
-        cursor.execute("SELECT pla_id FROM plates WHERE pla_loc_id IN (%s)" %
-            (placeholders), locations)
-        # Construct a list with the IDs
-        pla_ids = [row[0] for row in cursor]
-        # Remove duplicates.
-        pla_ids = setlyze.std.uniqify(pla_ids)
-        # Create a string of the IDs for the query.
-        pla_ids_str = ",".join([str(id) for id in pla_ids])
-
-        # Select all species IDs from records with those plate IDs.
-        cursor.execute("SELECT rec_spe_id FROM records WHERE rec_pla_id IN (%s) AND rec_spe_id != ''" % pla_ids_str)
-        # Construct a list with the IDs
-        spe_ids = [row[0] for row in cursor]
-        # Remove duplicates.
-        spe_ids = setlyze.std.uniqify(spe_ids)
-        # Create a string of the IDs for the query.
-        spe_ids_str = ",".join([str(id) for id in spe_ids]) # Turn the list into a string
-        #print "spe_ids: ", spe_ids
-
-        # Select information from species that match those species IDs.
-        cursor.execute("SELECT spe_id,spe_name_venacular,spe_name_latin,"
-            "spe_invasive_in_nl,spe_phylum,spe_class,spe_order,spe_family,"
-            "spe_genus,spe_species,spe_subspecies FROM species WHERE spe_id IN (%s)" % spe_ids_str)
-        species = cursor.fetchall()
-
+        fill_id_table(cursor, 'ids_locations', locations)
+        cursor.execute("SELECT COUNT(*) FROM plates "
+            "WHERE pla_loc_id IN (SELECT id FROM temp.ids_locations)")
+        n_plates = cursor.fetchone()[0]
         cursor.close()
-        return species
+        return n_plates
 
     def get_record_ids(self, locations, species):
         """Return records that match the locations and species selections.
@@ -1496,33 +2318,25 @@ class AccessLocalDB(AccessDBGeneric):
 
         Design Part: 1.41
         """
-        # Create strings containing all the selected locations and
-        # species IDs. These will be part of the queries below.
-        if isinstance(locations, int):
-            loc_ids_str = str(locations)
-        else:
-            loc_ids_str = ",".join([str(id) for id in locations])
-
-        if isinstance(species, int):
-            spe_ids_str = str(species)
-        else:
-            spe_ids_str = ",".join([str(id) for id in species])
-
-        # Get the plate IDs that match the selected locations.
+        if self.snapshot:
+            if isinstance(locations, int):
+                locations = [locations]
+            if isinstance(species, int):
+                species = [species]
+            return self.snapshot.get_record_ids(locations, species)
+
+        # Put the selected locations and species IDs in temporary tables.
         cursor = self.conn.cursor()
-        cursor.execute("SELECT pla_id FROM plates WHERE pla_loc_id IN (%s)"
-            % (loc_ids_str))
-
-        # Construct a list with the plate IDs.
-        pla_ids = [row[0] for row in cursor]
-        pla_ids_str = ",".join([str(id) for id in pla_ids])
-
-        # Select all record IDs that match the plate IDs and the
-        # selected species.
-        cursor.execute( "SELECT rec_id FROM records "
-                        "WHERE rec_pla_id IN (%s) "
-                        "AND rec_spe_id IN (%s)"
-                        % (pla_ids_str, spe_ids_str)
+        fill_id_table(cursor, 'ids_locations', locations)
+        fill_id_table(cursor, 'ids_species', species)
+
+        # Select all record IDs that match the plates from the selected
+        # locations and the selected species.
+        cursor.execute( "SELECT r.rec_id FROM records AS r "
+                        "INNER JOIN plates AS p ON r.rec_pla_id = p.pla_id "
+                        "WHERE p.pla_loc_id IN (SELECT id FROM temp.ids_locations) "
+                        "AND r.rec_spe_id IN (SELECT id FROM temp.ids_species) "
+                        "ORDER BY r.rec_id"
                         )
 
         # Construct a list with the record IDs.
@@ -1537,26 +2351,33 @@ class AccessLocalDB(AccessDBGeneric):
 
         This is a generator, meaning that this method returns an
         iterator. This iterator returns tuples with the 25 spot booleans for
-        all matching records.
+        all matching records. The records are read before the first one is
+        returned, so the temporary ID table can be reused while iterating.
         """
-        # Create a string of the IDs for the query.
-        rec_ids_str = ",".join([str(id) for id in rec_ids])
+        if self.snapshot:
+            for record in self.snapshot.get_spots(rec_ids).tolist():
+                yield tuple(record)
+            return
+
+        # Put the record IDs in a temporary table.
+        cursor = self.conn.cursor()
+        fill_id_table(cursor, 'ids_records_spots', rec_ids)
 
         # Get all 25 spots from each record that matches the list of
         # record IDs.
-        cursor = self.conn.cursor()
         cursor.execute( "SELECT rec_sur1,rec_sur2,rec_sur3,rec_sur4,rec_sur5,"
                         "rec_sur6,rec_sur7,rec_sur8,rec_sur9,rec_sur10,"
                         "rec_sur11,rec_sur12,rec_sur13,rec_sur14,rec_sur15,"
                         "rec_sur16,rec_sur17,rec_sur18,rec_sur19,rec_sur20,"
                         "rec_sur21,rec_sur22,rec_sur23,rec_sur24,rec_sur25 "
                         "FROM records "
-                        "WHERE rec_id IN (%s)" % (rec_ids_str)
+                        "WHERE rec_id IN (SELECT id FROM temp.ids_records_spots)"
                         )
+        records = cursor.fetchall()
+        cursor.close()
 
-        for record in cursor:
+        for record in records:
             yield record
-        cursor.close()
 
     def set_species_spots(self, rec_ids, slot):
         """Create a table in the local database containing the spots
@@ -1575,15 +2396,26 @@ class AccessLocalDB(AccessDBGeneric):
         # The available tables to save the spots to.
         tables = ('species_spots_1','species_spots_2')
 
-        # Turn the list into a string, as it'll be included in the query.
-        rec_ids_str = ",".join([str(item) for item in rec_ids])
-
         # Empty the required tables before we start.
         cursor.execute( "DELETE FROM %s" % (tables[slot]) )
 
         # Commit the database transaction.
         self.conn.commit()
 
+        # Insert the spots from the snapshot if there is one.
+        placeholders = ','.join('?' * 26)
+        if self.snapshot:
+            cursor.executemany("INSERT INTO %s VALUES (null,%s)" %
+                (tables[slot], placeholders),
+                self.snapshot.get_plates_and_spots(rec_ids))
+            self.conn.commit()
+            cursor.close()
+            cursor2.close()
+            return
+
+        # Put the record IDs in a temporary table.
+        fill_id_table(cursor, 'ids_records', rec_ids)
+
         # Get plate ID and all 25 spots from each record that matches
         # the list of record IDs.
         cursor.execute( "SELECT rec_pla_id,"
@@ -1593,12 +2425,10 @@ class AccessLocalDB(AccessDBGeneric):
                         "rec_sur16,rec_sur17,rec_sur18,rec_sur19,rec_sur20,"
                         "rec_sur21,rec_sur22,rec_sur23,rec_sur24,rec_sur25 "
                         "FROM records "
-                        "WHERE rec_id IN (%s)" %
-                        (rec_ids_str)
+                        "WHERE rec_id IN (SELECT id FROM temp.ids_records)"
                         )
 
         # Insert each resulting row in the species_spots table.
-        placeholders = ','.join('?' * 26)
         for row in cursor:
             cursor2.execute("INSERT INTO %s VALUES (null,%s)" %
                 (tables[slot], placeholders), row)
@@ -0,0 +1,671 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2010-2013, GiMaRIS <info@gimaris.com>
+#
+#  This file is part of SETLyze - A tool for analyzing the settlement
+#  of species on SETL plates.
+#
+#  SETLyze is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SETLyze is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run the analyses of a batch on worker processes on other hosts.
+
+The number of analyses that can run at the same time in batch mode is
+limited by the number of CPUs of one computer. If configuration
+``distributed-batches`` is set, the jobs of a batch are not added to a local
+process pool but served over TCP by a :class:`Coordinator`, which listens on
+the address set with configurations ``coordinator-host`` and
+``coordinator-port``. Worker processes on any number of hosts connect to the
+coordinator, run the jobs and send the reports back as soon as they are
+finished. A worker is started on each host with: ::
+
+    setlyze-worker --processes 8 coordinator.example.org:6650
+
+Workers need the same version of SETLyze as the coordinator; a worker exits
+if the coordinator runs a different version. They don't need a copy of the
+SETL data. When a worker connects, it checks whether it
+has a copy of the local database of the coordinator with the same data
+fingerprint (see
+:meth:`setlyze.database.AccessDBGeneric.get_data_fingerprint`) in the folder
+set with configuration ``worker-cache-path``. If not, the coordinator sends
+its database file, which is then used for all following batches on the same
+data. A database on a shared file system can be used instead with option
+``--db``.
+
+Coordinator and workers authenticate each other with the secret key set with
+configuration ``coordinator-authkey`` (or environment variable
+``SETLYZE_AUTHKEY`` for workers). Jobs and reports are exchanged as pickles,
+so only share this key with hosts that you trust. The coordinator doesn't
+start if no key is set.
+
+Workers stay connected until all jobs of the batch are finished, so they can
+take over the jobs of workers that lose their connection. Then they wait for
+the next batch. To try this on a single computer, enable
+``distributed-batches`` and run one or more workers on localhost: ::
+
+    SETLYZE_AUTHKEY=secret setlyze-worker --processes 2 localhost:6650
+"""
+
+import os
+import sys
+import time
+import Queue
+import socket
+import logging
+import argparse
+import threading
+import collections
+import multiprocessing
+from multiprocessing.connection import Listener, Client, \
+    AuthenticationError, answer_challenge, deliver_challenge
+from multiprocessing.managers import BaseProxy
+
+import setlyze
+import setlyze.config
+
+# The configurations that are sent to the workers, so the analyses on all
+# hosts are performed with the same options.
+SHARED_CONFIG = ('alpha-level', 'test-repeats', 'spot-dist-to-prob-intra',
+    'spot-dist-to-prob-inter', 'sql-trace', 'sql-slow-query-time')
+
+# The number of times a task is handed out before it is given up. A task is
+# handed out again if the connection with the worker running it is lost.
+MAX_ATTEMPTS = 3
+
+# The size in bytes of the pieces in which the database file is sent.
+PIECE_SIZE = 1 << 20
+
+# The connection to the coordinator of the current worker process. It is set
+# by :func:`work`.
+connection = None
+
+class ExecuteQueue(object):
+    """Execute queue for analyses that run on a remote worker.
+
+    The execute queue of :class:`~setlyze.analysis.common.ProcessGateway`
+    can't be used on other hosts, so the coordinator replaces it with an
+    instance of this class before a job is sent to a worker. Tasks put on
+    this queue are sent to the coordinator, which puts them on the original
+    execute queue. This way the progress dialog is updated by remote
+    analyses as well.
+    """
+
+    def put(self, item):
+        """Send the task `item` to the coordinator."""
+        if not connection:
+            return
+        connection.send(('task',) + tuple(item))
+        # Tasks are put on the queue regularly while an analysis runs, so
+        # this is a good moment to check if the batch was canceled.
+        while connection.poll():
+            receive(connection)
+
+def receive(conn):
+    """Return the next message from the coordinator on connection `conn`.
+
+    Cancel messages are handled here: they set the cancel event of the
+    worker process, so the running analysis stops at the next stage or
+    repeat (see :meth:`setlyze.analysis.common.AnalysisWorker.stopped`).
+    Returns None if the message was a cancel message.
+    """
+    import setlyze.analysis.common
+
+    message = conn.recv()
+    if message[0] == 'cancel':
+        logging.info("The batch was canceled")
+        if setlyze.analysis.common.cancel_event:
+            setlyze.analysis.common.cancel_event.set()
+        return None
+    return message
+
+def strip_proxies(obj, queues):
+    """Return `obj` with the execute queues replaced by
+    :class:`ExecuteQueue` instances.
+
+    Tuples and lists in `obj` are searched recursively. The execute queues
+    that were found (proxies for a queue of a
+    :py:class:`multiprocessing.Manager`) are appended to the list `queues`.
+    """
+    if isinstance(obj, BaseProxy):
+        queues.append(obj)
+        return ExecuteQueue()
+    if isinstance(obj, tuple):
+        return tuple([strip_proxies(x, queues) for x in obj])
+    if isinstance(obj, list):
+        return [strip_proxies(x, queues) for x in obj]
+    return obj
+
+class Coordinator(object):
+    """Serve the tasks of a batch to workers on other hosts.
+
+    The coordinator listens on address `address`, a tuple ``(host, port)``,
+    for connections from workers that know the secret key `authkey`.
+    Workers that have no copy of the database with data fingerprint
+    `fingerprint` get a copy of database file `db_file`. The tasks are no
+    longer handed out once the :py:class:`threading.Event` `cancel_event` is
+    set, and the running tasks are then asked to stop.
+
+    The interface is a subset of :py:class:`multiprocessing.Pool`, so it can
+    be used in place of a local process pool. Use :meth:`imap_unordered` to
+    add the tasks; the listening socket is bound when the instance is
+    created, so :py:class:`socket.error` is raised if the address is in use.
+    Use port 0 to listen on a free port; attribute `address` is set to the
+    address that is actually used.
+    """
+
+    def __init__(self, address, authkey, cancel_event, db_file, fingerprint):
+        self.address = address
+        self.attempts = {}
+        self.authkey = authkey
+        self.cancel_event = cancel_event
+        self.cancel_sent = False
+        self.condition = threading.Condition()
+        self.connections = {}
+        self.db_file = db_file
+        self.done = set()
+        self.execute_queue = None
+        self.fingerprint = fingerprint
+        self.func = None
+        self.listener = Listener(address)
+        self.address = self.listener.address
+        self.pending = collections.deque()
+        self.remaining = 0
+        self.results = Queue.Queue()
+        self.stopped = False
+        self.tasks = {}
+        self.thread = None
+        self.workers = set()
+
+    def __str__(self):
+        return "%s(%s:%d)" % (self.__class__.__name__, self.address[0],
+            self.address[1])
+
+    def imap_unordered(self, func, iterable):
+        """Serve the tasks in `iterable` to the workers.
+
+        The workers call `func` for each task. Like `func`, the tasks must
+        be picklable. Returns an iterator over the results in the order in
+        which they are received. The iterator stops when all tasks are
+        finished, after which the coordinator stops listening.
+        """
+        queues = []
+        for i, task in enumerate(iterable):
+            self.tasks[i] = strip_proxies(task, queues)
+            self.attempts[i] = 0
+            self.pending.append(i)
+        if queues:
+            self.execute_queue = queues[0]
+        self.func = func
+        self.remaining = len(self.tasks)
+
+        self.thread = threading.Thread(target=self.accept)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.iter_results()
+
+    def iter_results(self):
+        """Yield the results of the tasks as they are received."""
+        try:
+            while True:
+                self.check_canceled()
+                try:
+                    result = self.results.get(True, 1.0)
+                except Queue.Empty:
+                    with self.condition:
+                        if self.stopped or (self.remaining == 0 and
+                                self.results.empty()):
+                            break
+                    continue
+                if result is None:
+                    # Set by terminate().
+                    break
+                yield result
+        finally:
+            self.shutdown()
+
+    def check_canceled(self):
+        """Stop handing out tasks and ask the workers to stop their running
+        tasks if the cancel event is set.
+        """
+        if self.cancel_sent or not self.cancel_event.is_set():
+            return
+        self.cancel_sent = True
+        with self.condition:
+            self.remaining -= len(self.pending)
+            self.pending.clear()
+            self.condition.notify_all()
+            connections = self.connections.items()
+        for conn, lock in connections:
+            try:
+                with lock:
+                    conn.send(('cancel',))
+            except (IOError, EOFError):
+                pass
+
+    def accept(self):
+        """Accept connections from workers until the coordinator is stopped.
+
+        Each worker is served in a separate thread (see :meth:`serve`).
+        """
+        logging.info("%s: Waiting for workers" % self)
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (IOError, socket.error) as e:
+                if not self.stopped:
+                    logging.warning("%s: Failed to accept connection: %s" %
+                        (self, e))
+                    continue
+                break
+            if self.stopped:
+                conn.close()
+                break
+            t = threading.Thread(target=self.serve, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def serve(self, conn):
+        """Handle the messages of a worker on connection `conn`.
+
+        Workers send the following messages:
+
+        ``('hello', hostname, processes)``
+          Answered with ``('welcome', version, fingerprint, settings)``,
+          where `settings` holds the configurations from
+          :data:`SHARED_CONFIG`.
+
+        ``('database',)``
+          Answered with the database file (see :meth:`send_database`).
+
+        ``('ready',)``
+          Answered with ``('task', task_id, func, task)``, or with
+          ``('stop',)`` if all tasks are finished.
+
+        ``('task', task, args, kwargs)``
+          A task for the execute queue (see :class:`ExecuteQueue`).
+
+        ``('result', task_id, result)``
+          The result of a task.
+
+        If the connection is lost while the worker is running a task, the
+        task is handed out again.
+        """
+        try:
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+        except (AuthenticationError, IOError, EOFError) as e:
+            logging.warning("%s: Refused connection: %s" % (self, e))
+            conn.close()
+            return
+
+        lock = threading.Lock()
+        with self.condition:
+            self.connections[conn] = lock
+        task_id = None
+        try:
+            while True:
+                message = conn.recv()
+                kind = message[0]
+                if kind == 'hello':
+                    logging.info("%s: Worker %s connected with %d processes" %
+                        (self, message[1], message[2]))
+                    settings = dict([(key, setlyze.config.cfg.get(key)) for
+                        key in SHARED_CONFIG])
+                    with lock:
+                        conn.send(('welcome', setlyze.__version__,
+                            self.fingerprint, settings))
+                elif kind == 'database':
+                    self.send_database(conn, lock)
+                elif kind == 'task':
+                    if self.execute_queue:
+                        self.execute_queue.put(message[1:])
+                elif kind == 'result':
+                    self.add_result(message[1], message[2])
+                    task_id = None
+                elif kind == 'ready':
+                    task_id = self.get_task(conn)
+                    with lock:
+                        if task_id is None:
+                            conn.send(('stop',))
+                            break
+                        conn.send(('task', task_id, self.func,
+                            self.tasks[task_id]))
+                else:
+                    logging.warning("%s: Unknown message %r" % (self, kind))
+                    break
+        except (IOError, EOFError) as e:
+            if task_id is not None:
+                logging.warning("%s: Lost connection with a worker: %s" %
+                    (self, e))
+        finally:
+            with self.condition:
+                del self.connections[conn]
+            if task_id is not None:
+                self.retry_task(task_id)
+            conn.close()
+
+    def send_database(self, conn, lock):
+        """Send the database file to a worker on connection `conn`.
+
+        A message ``('database', size)`` is sent first, followed by the
+        file in pieces of :data:`PIECE_SIZE` bytes and an empty piece.
+        """
+        logging.info("%s: Sending the database to a worker" % self)
+        with lock:
+            conn.send(('database', os.path.getsize(self.db_file)))
+            with open(self.db_file, 'rb') as f:
+                while True:
+                    piece = f.read(PIECE_SIZE)
+                    conn.send_bytes(piece)
+                    if not piece:
+                        break
+
+    def get_task(self, conn):
+        """Return the ID of the next task to hand out to the worker on
+        connection `conn`.
+
+        If no tasks are pending, wait for tasks that are handed out again
+        because a worker was lost. Returns None when all tasks are finished
+        or the coordinator is stopped.
+        """
+        with self.condition:
+            while True:
+                if self.stopped:
+                    return None
+                if self.pending:
+                    task_id = self.pending.popleft()
+                    self.attempts[task_id] += 1
+                    self.workers.add(conn)
+                    return task_id
+                if self.remaining <= 0:
+                    return None
+                self.condition.wait(1.0)
+
+    def add_result(self, task_id, result):
+        """Add the result `result` of task `task_id` to the results."""
+        with self.condition:
+            if task_id in self.done:
+                return
+            self.done.add(task_id)
+            self.remaining -= 1
+            self.results.put(result)
+            self.condition.notify_all()
+
+    def retry_task(self, task_id):
+        """Hand out task `task_id` again after its worker was lost.
+
+        The task is given up if it was handed out :data:`MAX_ATTEMPTS`
+        times or if the batch was canceled.
+        """
+        with self.condition:
+            if task_id in self.done:
+                return
+            if self.cancel_event.is_set() or \
+                    self.attempts[task_id] >= MAX_ATTEMPTS:
+                logging.error("%s: Giving up task %d" % (self, task_id))
+                self.done.add(task_id)
+                self.remaining -= 1
+                self.condition.notify_all()
+                return
+            # Put it in front, so it isn't left until the end of the batch.
+            self.pending.appendleft(task_id)
+            self.condition.notify_all()
+
+    def shutdown(self):
+        """Stop handing out tasks and stop listening for workers."""
+        with self.condition:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.condition.notify_all()
+        # Connect to the listener to wake up accept().
+        host, port = self.address
+        if host in ('', '0.0.0.0'):
+            host = '127.0.0.1'
+        try:
+            socket.create_connection((host, port), 5).close()
+        except socket.error:
+            pass
+        self.listener.close()
+
+    @property
+    def n_workers(self):
+        """The number of worker processes that ran tasks."""
+        return len(self.workers)
+
+    def close(self):
+        """Do nothing; tasks are only added with :meth:`imap_unordered`."""
+        pass
+
+    def terminate(self):
+        """Stop the coordinator without waiting for the running tasks."""
+        self.results.put(None)
+        self.shutdown()
+
+    def join(self):
+        """Wait for the coordinator to stop listening."""
+        if self.thread:
+            self.thread.join()
+
+def get_database_fingerprint(path):
+    """Return the data fingerprint of the local database file `path`."""
+    import setlyze.database
+
+    setlyze.config.cfg.set('db-file', path)
+    db = setlyze.database.get_database_accessor()
+    try:
+        return db.get_data_fingerprint()
+    finally:
+        db.close()
+
+def remove_database(path):
+    """Remove database file `path` and its write-ahead log files."""
+    for filename in (path, path + '-wal', path + '-shm'):
+        if os.path.isfile(filename):
+            os.remove(filename)
+
+def prepare_database(conn, fingerprint, db_file=None):
+    """Return the path to a database with data fingerprint `fingerprint`.
+
+    If the database file `db_file` is set and has the right fingerprint, it
+    is used. Otherwise the copy in the folder set with configuration
+    ``worker-cache-path`` is used, which is obtained from the coordinator
+    on connection `conn` if needed. The configurations ``db-file`` and
+    ``snapshot-path`` are set for the database.
+    """
+    import setlyze.database
+    import setlyze.snapshot
+
+    cache = setlyze.config.cfg.get('worker-cache-path')
+    if not os.path.isdir(cache):
+        os.makedirs(cache)
+    path = os.path.join(cache, "%s.db" % fingerprint)
+    snapshot_path = os.path.join(cache, "%s.snapshot" % fingerprint)
+    # Don't use the snapshot of the records table of this host.
+    setlyze.config.cfg.set('snapshot-path', snapshot_path)
+
+    if db_file:
+        if get_database_fingerprint(db_file) == fingerprint:
+            return db_file
+        logging.warning("Database %s has different data than the "
+            "coordinator, using a copy instead" % db_file)
+
+    if not os.path.isfile(path):
+        conn.send(('database',))
+        message = conn.recv()
+        logging.info("Receiving the database (%d bytes)" % message[1])
+        part = "%s.part" % path
+        with open(part, 'wb') as f:
+            while True:
+                piece = conn.recv_bytes()
+                if not piece:
+                    break
+                f.write(piece)
+        # Close the pooled connections to the received file first, so they
+        # don't keep its write-ahead log.
+        fingerprint_ok = get_database_fingerprint(part) == fingerprint
+        setlyze.database.connections.close()
+        if not fingerprint_ok:
+            remove_database(part)
+            raise ValueError("The received database has a different "
+                "fingerprint")
+        for suffix in ('-wal', '-shm'):
+            if os.path.isfile(part + suffix):
+                os.remove(part + suffix)
+        os.rename(part, path)
+
+        # Only keep the database of the last batch.
+        for filename in os.listdir(cache):
+            if filename.endswith('.db') and filename != os.path.basename(path):
+                remove_database(os.path.join(cache, filename))
+
+        if setlyze.snapshot.is_available():
+            import sqlite3
+            connection = sqlite3.connect(path)
+            try:
+                setlyze.snapshot.write_snapshot(connection, fingerprint,
+                    snapshot_path)
+            except Exception as e:
+                logging.warning("Failed to write snapshot: %s" % e)
+            finally:
+                connection.close()
+
+    setlyze.config.cfg.set('db-file', path)
+    return path
+
+def work(address, authkey, db_file, settings):
+    """Run tasks from the coordinator at `address` until the batch is
+    finished.
+
+    The analyses use the database file `db_file` and the configurations
+    in the dictionary `settings`. This function runs in each worker
+    process started by :func:`run_worker`.
+    """
+    global connection
+    import setlyze.analysis.common
+
+    for key, value in settings.iteritems():
+        setlyze.config.cfg.set(key, value)
+    setlyze.config.cfg.set('db-file', db_file)
+    setlyze.analysis.common.init_worker(threading.Event())
+
+    try:
+        connection = Client(address, authkey=authkey)
+    except (IOError, socket.error) as e:
+        logging.info("Cannot connect to %s:%d: %s" % (address + (e,)))
+        return
+
+    try:
+        while True:
+            connection.send(('ready',))
+            message = None
+            while message is None:
+                message = receive(connection)
+            if message[0] == 'stop':
+                break
+            task_id, func, task = message[1:]
+            connection.send(('result', task_id, func(task)))
+    except (IOError, EOFError) as e:
+        logging.warning("Lost connection with the coordinator: %s" % e)
+    finally:
+        connection.close()
+        connection = None
+
+def run_worker(address, authkey, processes, db_file=None, once=False,
+        retry=5):
+    """Run the tasks of the coordinator at `address` with `processes`
+    worker processes.
+
+    The worker connects with secret key `authkey`, makes sure that it has
+    a copy of the database of the coordinator (see
+    :func:`prepare_database`) and then starts the worker processes (see
+    :func:`work`). If the coordinator is not running, connecting is tried
+    again every `retry` seconds. After a batch is finished the worker waits
+    for the next batch, unless `once` is set.
+
+    The jobs and options of the coordinator are only compatible with the
+    same version of SETLyze, so ValueError is raised if the coordinator runs
+    a different version.
+    """
+    while True:
+        try:
+            conn = Client(address, authkey=authkey)
+        except (IOError, socket.error):
+            time.sleep(retry)
+            continue
+
+        try:
+            conn.send(('hello', socket.gethostname(), processes))
+            kind, version, fingerprint, settings = conn.recv()
+            if version != setlyze.__version__:
+                raise ValueError("The coordinator runs SETLyze %s, but this "
+                    "worker runs SETLyze %s" % (version, setlyze.__version__))
+            db_file = prepare_database(conn, fingerprint, db_file)
+        except (IOError, EOFError) as e:
+            logging.warning("Lost connection with the coordinator: %s" % e)
+            time.sleep(retry)
+            continue
+        finally:
+            conn.close()
+
+        logging.info("Starting %d worker processes" % processes)
+        workers = [multiprocessing.Process(target=work, args=(address,
+            authkey, db_file, settings)) for i in range(processes)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+        logging.info("The batch is finished")
+        if once:
+            return
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the analyses of "
+        "SETLyze batches served by a coordinator on another host.")
+    parser.add_argument('address', help="Address of the coordinator in the "
+        "format host:port.")
+    parser.add_argument('--processes', type=int,
+        default=setlyze.config.cfg.get('concurrent-processes'),
+        help="Number of worker processes (default: %(default)s).")
+    parser.add_argument('--authkey', default=os.environ.get('SETLYZE_AUTHKEY',
+        setlyze.config.cfg.get('coordinator-authkey')),
+        help="Secret key shared with the coordinator (default: environment "
+        "variable SETLYZE_AUTHKEY or configuration coordinator-authkey).")
+    parser.add_argument('--db', help="Use this local database file if it "
+        "has the same data as the coordinator, instead of a copy.")
+    parser.add_argument('--once', action='store_true', help="Exit after one "
+        "batch.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    host, sep, port = args.address.rpartition(':')
+    if not sep or not port.isdigit():
+        sys.exit("Invalid address %s, expected host:port" % args.address)
+    if not args.authkey:
+        sys.exit("No secret key set, use option --authkey or environment "
+            "variable SETLYZE_AUTHKEY")
+
+    try:
+        run_worker((host, int(port)), args.authkey, args.processes, args.db,
+            args.once)
+    except AuthenticationError:
+        sys.exit("The coordinator refused the secret key")
+    except ValueError as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
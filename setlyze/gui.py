@@ -48,9 +48,11 @@ then do the following to get a list of the selected locations.
 """
 
 import logging
+import itertools
 import os
 import re
 import sys
+import threading
 import time
 import webbrowser
 
@@ -269,8 +271,10 @@ class SelectAnalysis(object):
             try:
                 info = db.get_database_info()
             except:
+                db.close()
                 self.on_make_local_db()
                 return
+            db.close()
 
             # Check the database verion.
             min_version = setlyze.config.cfg.get('minimum-db-version')
@@ -743,6 +747,7 @@ class SelectLocations(SelectionWindow):
         self.store = gtk.ListStore(gobject.TYPE_INT, gobject.TYPE_STRING)
         for id,name in db.get_locations():
             self.store.append([id,name])
+        db.close()
         self.model = gtk.TreeModelSort(self.store)
         self.model.set_sort_column_id(1, gtk.SORT_ASCENDING)
 
@@ -765,14 +770,21 @@ class SelectSpecies(SelectionWindow):
     Design Part: 1.88
     """
 
+    #: Number of species added to the tree model per idle callback.
+    chunk_size = 250
+
     def __init__(self, locations, title="Species Selection",
             description="Select the species:", width=600, slot=0):
         self.locations = locations
+        self.destroyed = False
         super(SelectSpecies, self).__init__(title, description, width, slot)
         self.back_signal = 'species-dialog-back'
         self.saved_signal = 'species-selection-saved'
         self.info_key = 'info-spe-selection'
 
+        # Stop loading species when the dialog is closed.
+        self.connect('destroy', self.on_destroy)
+
         # This button should not be pressed now, so hide it.
         self.button_load_data.hide()
 
@@ -780,25 +792,86 @@ class SelectSpecies(SelectionWindow):
         """Create a model for the tree view from the species IDs and
         names.
 
+        If the species for the locations selection are not cached yet (see
+        :func:`setlyze.database.get_species`), they are loaded in a separate
+        thread and added to the model from idle callbacks, so the dialog is
+        displayed right away. The description shows a placeholder message
+        while the species are being loaded.
+
         Design Part: 1.43
         """
-        db = setlyze.database.AccessLocalDB()
         self.store = gtk.ListStore(gobject.TYPE_INT,
                                    gobject.TYPE_STRING,gobject.TYPE_STRING,
                                    gobject.TYPE_STRING,gobject.TYPE_STRING,
                                    gobject.TYPE_STRING,gobject.TYPE_STRING,
                                    gobject.TYPE_STRING,gobject.TYPE_STRING,
                                    gobject.TYPE_STRING,gobject.TYPE_BOOLEAN,
+                                   gobject.TYPE_INT,gobject.TYPE_INT,
        )
-        for id,common,latin,invasive_in_nl,phylum,cls,order,family,genus,species,subspecies in db.get_species(self.locations):
-            self.store.append([id,latin,common,phylum,cls,order,family,genus,species,subspecies,invasive_in_nl])
+
+        # Species that are cached are added before the store is sorted,
+        # which is faster than inserting them in a sorted model.
+        species = setlyze.database.get_cached_species(self.locations)
+        if species is not None:
+            for row in species:
+                self.append_species(self.store, row)
 
         self.model = gtk.TreeModelSort(self.store)
         self.model.set_sort_column_id(1, gtk.SORT_ASCENDING)
+        if species is not None:
+            return
+
+        self.set_description("Loading species...")
+        thread = threading.Thread(target=self.load_species, args=(self.store,))
+        thread.daemon = True
+        thread.start()
+
+    def append_species(self, store, row):
+        """Append a species `row` from the database to `store`."""
+        id,common,latin,invasive_in_nl,phylum,cls,order,family,genus,species,subspecies,n_plates,n_records = row
+        store.append([id,latin,common,phylum,cls,order,family,genus,species,subspecies,invasive_in_nl,n_plates,n_records])
+
+    def load_species(self, store):
+        """Get the species for the locations selection and add them to
+        `store` from an idle callback.
+
+        This method is called in a separate thread.
+        """
+        try:
+            species = setlyze.database.get_species(self.locations)
+        except Exception as e:
+            logging.error("Failed to load the species: %s" % e)
+            gobject.idle_add(self.set_description, "Failed to load the "
+                "species: %s" % e)
+            return
+        gobject.idle_add(self.fill_model, store, iter(species))
+
+    def fill_model(self, store, rows):
+        """Add the next :attr:`chunk_size` species from iterator `rows` to
+        `store`.
+
+        Returns True while there are species left, so this can be used as
+        an idle callback. Stops if the dialog was closed or if the model
+        was replaced in the meantime.
+        """
+        if self.destroyed or store is not self.store:
+            return False
+        n = 0
+        for row in itertools.islice(rows, self.chunk_size):
+            self.append_species(store, row)
+            n += 1
+        if n == self.chunk_size:
+            return True
+        self.set_description(self.description)
+        return False
+
+    def on_destroy(self, widget):
+        """Stop adding species to the tree model."""
+        self.destroyed = True
 
     def create_columns(self, treeview):
         """Create columns for the tree view."""
-        columns = ("Species (Latin)","Species (common)","Phylum","Class","Order","Family","Genus","Species","Subspecies","Invasive in NL")
+        columns = ("Species (Latin)","Species (common)","Phylum","Class","Order","Family","Genus","Species","Subspecies","Invasive in NL","Plates","Records")
         renderer_text = gtk.CellRendererText()
         renderer_toggle = gtk.CellRendererToggle()
         for i,name in enumerate(columns, start=1):
@@ -1668,6 +1741,8 @@ class ProgressDialogHandler(object):
         """Set the progress dialog's action string to `action`. This action
         string is showed in italics below the progress bar.
         """
+        if not self.pdialog:
+            return
         action = "<span style='italic'>%s</span>" % (action)
         gobject.idle_add(self.pdialog.action.set_markup, action)
 
@@ -1777,6 +1852,134 @@ class ProgressDialogHandler(object):
         # automatically removed from the list of event sources.
         return False
 
+class SummaryModel(gtk.GenericTreeModel):
+    """Virtual tree model for the rows of a batch summary.
+
+    The rows of a batch summary can run into the thousands, and filling a
+    :class:`gtk.ListStore` with all of them (including the background
+    colors of the cells) blocks the GUI while the report dialog is being
+    opened. This model instead reads the cell values from the `rows` of the
+    statistics object when the tree view asks for them, so only the visible
+    rows are ever looked at. The background colors are derived from the
+    values on demand.
+
+    The rows are made available to the tree view in chunks of
+    :attr:`chunk_size` rows from an idle callback (see
+    :meth:`start_loading`), so the dialog is displayed right away and the
+    remaining rows appear while the GUI stays responsive.
+
+    The first columns of the model, with types `column_types`, are the
+    values of the rows. Each value from column `first` on has a background
+    color column, which follow the value columns. A value
+    matching the regular expression `positive` gets a green background,
+    a value starting with ``ns;`` gets a red background.
+    """
+
+    #: Number of rows added to the model per idle callback.
+    chunk_size = 500
+
+    def __init__(self, rows, column_types, first, positive):
+        gtk.GenericTreeModel.__init__(self)
+        self.rows = rows
+        self.first = first
+        self.n_values = len(column_types)
+        self.column_types = list(column_types) + \
+            [gobject.TYPE_STRING] * (self.n_values - first)
+        self.positive = re.compile(positive)
+        self.negative = re.compile('^(ns);')
+        # The number of rows that are visible to the tree view.
+        self.n_loaded = 0
+        self.source_id = None
+
+    def get_background(self, val):
+        """Return the background color for cell value `val`."""
+        if not val:
+            return None
+        elif self.positive.match(val):
+            return '#B4EEB4'
+        elif self.negative.match(val):
+            return '#FFC1C1'
+        return None
+
+    def start_loading(self):
+        """Add the first chunk of rows to the model and schedule an idle
+        callback which adds the remaining rows.
+        """
+        if self.load_rows():
+            self.source_id = gobject.idle_add(self.load_rows,
+                priority=gobject.PRIORITY_LOW)
+
+    def stop_loading(self):
+        """Cancel the idle callback that adds rows to the model."""
+        if self.source_id is not None:
+            gobject.source_remove(self.source_id)
+            self.source_id = None
+
+    def load_rows(self):
+        """Add the next chunk of rows to the model.
+
+        Returns True if there are rows left to be added, so this can be
+        used as an idle callback.
+        """
+        end = min(self.n_loaded + self.chunk_size, len(self.rows))
+        for i in xrange(self.n_loaded, end):
+            self.n_loaded = i + 1
+            path = (i,)
+            self.row_inserted(path, self.get_iter(path))
+        if self.n_loaded < len(self.rows):
+            return True
+        self.source_id = None
+        return False
+
+    def on_get_flags(self):
+        return gtk.TREE_MODEL_LIST_ONLY | gtk.TREE_MODEL_ITERS_PERSIST
+
+    def on_get_n_columns(self):
+        return len(self.column_types)
+
+    def on_get_column_type(self, n):
+        return self.column_types[n]
+
+    def on_get_iter(self, path):
+        if path[0] < self.n_loaded:
+            return path[0]
+        return None
+
+    def on_get_path(self, rowref):
+        return (rowref,)
+
+    def on_get_value(self, rowref, column):
+        row = self.rows[rowref]
+        if column < self.n_values:
+            return row[column]
+        return self.get_background(row[column - self.n_values + self.first])
+
+    def on_iter_next(self, rowref):
+        if rowref + 1 < self.n_loaded:
+            return rowref + 1
+        return None
+
+    def on_iter_children(self, parent):
+        if parent is None and self.n_loaded:
+            return 0
+        return None
+
+    def on_iter_has_child(self, rowref):
+        return False
+
+    def on_iter_n_children(self, rowref):
+        if rowref is None:
+            return self.n_loaded
+        return 0
+
+    def on_iter_nth_child(self, parent, n):
+        if parent is None and n < self.n_loaded:
+            return n
+        return None
+
+    def on_iter_parent(self, child):
+        return None
+
 class Report(object):
     """Display a dialog visualizing the elements in a report object.
 
@@ -1787,6 +1990,7 @@ class Report(object):
     def __init__(self, report, header="Report", help_section='analysis-report-dialog'):
         self.report = None
         self.report_saved = False
+        self.summary_models = []
         self.set_report(report)
 
         # Get some GTK objects.
@@ -1803,6 +2007,7 @@ class Report(object):
         # Connect the window signals to the handlers.
         self.builder.connect_signals(self)
         self.window.connect('delete-event', on_quit)
+        self.window.connect('destroy', self.on_window_destroy)
 
         # Modify some widgets.
         self.window.maximize()
@@ -1910,6 +2115,11 @@ class Report(object):
         # Close the filechooser.
         chooser.destroy()
 
+    def on_window_destroy(self, window):
+        """Stop loading rows into the summary tables."""
+        for model in self.summary_models:
+            model.stop_loading()
+
     def on_save_all(self, button):
         """Emit the 'save-individual-reports' signal."""
         setlyze.sender.emit('save-individual-reports')
@@ -2760,6 +2970,18 @@ class Report(object):
         # Add the ScrolledWindow to the vertcal box.
         self.vbox_elements.pack_start(expander, expand=False, fill=True, padding=0)
 
+    def set_summary_model(self, tree, rows, column_types, first, positive):
+        """Set a :class:`SummaryModel` for summary `rows` on tree view
+        `tree` and start loading the rows.
+
+        The model is wrapped in a :class:`gtk.TreeModelSort` so the columns
+        remain sortable.
+        """
+        model = SummaryModel(rows, column_types, first, positive)
+        self.summary_models.append(model)
+        tree.set_model(gtk.TreeModelSort(model))
+        model.start_loading()
+
     def add_plate_areas_summary(self, statistics):
         """Add a summary report for spot preference to the displayer.
 
@@ -2809,39 +3031,12 @@ class Report(object):
             if i == 0: column.set_expand(True)
             tree.append_column(column)
 
-        # To store the data, we use the ListStore object.
-        liststore = gtk.ListStore(
-            gobject.TYPE_STRING,
-            gobject.TYPE_INT,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            # Background colors for columns 3-11
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-        )
-
-        for row in statistics['results']:
-            # Create a separate list for the background colors so we don't
-            # affect the statistics object.
-            bg = []
-            # Set the background colors based on the values.
-            for i in range(1,10):
-                val = row[i+1]
-                if not val:
-                    bg.append(None)
-                elif re.match('^(s|pr|rj);', val):
-                    bg.append('#B4EEB4')
-                elif re.match('^(ns);', val):
-                    bg.append('#FFC1C1')
-                else:
-                    bg.append(None)
-
-            liststore.append(row+bg)
-
-        # Set the tree model.
-        tree.set_model(liststore)
+        # The rows are added to the model from an idle callback, so the
+        # dialog doesn't block on summaries with thousands of rows.
+        column_types = [gobject.TYPE_STRING, gobject.TYPE_INT] + \
+            [gobject.TYPE_STRING] * 9
+        self.set_summary_model(tree, statistics['results'], column_types,
+            2, '^(s|pr|rj);')
 
         # Add the tree to the scrolled window.
         scrolled_window.add(tree)
@@ -2898,64 +3093,12 @@ class Report(object):
             if i == 0: column.set_expand(True)
             tree.append_column(column)
 
-        # To store the data, we use the ListStore object.
-        liststore = gtk.ListStore(
-            gobject.TYPE_STRING,
-            gobject.TYPE_INT,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            # Background colors for columns 3-50
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-        )
-
-        for row in statistics['results']:
-            # Create a separate list for the background colors so we don't
-            # affect the statistics object.
-            bg = []
-            # Set the background colors based on the values.
-            for i in range(1,49):
-                val = row[i+1]
-                if not val:
-                    bg.append(None)
-                elif re.match('^(s|at|rp);', val):
-                    bg.append('#B4EEB4')
-                elif re.match('^(ns);', val):
-                    bg.append('#FFC1C1')
-                else:
-                    bg.append(None)
-            liststore.append(row+bg)
-
-        # Set the tree model.
-        tree.set_model(liststore)
+        # The rows are added to the model from an idle callback, so the
+        # dialog doesn't block on summaries with thousands of rows.
+        column_types = [gobject.TYPE_STRING, gobject.TYPE_INT] + \
+            [gobject.TYPE_STRING] * 48
+        self.set_summary_model(tree, statistics['results'], column_types,
+            2, '^(s|at|rp);')
 
         # Add the tree to the scrolled window.
         scrolled_window.add(tree)
@@ -3012,41 +3155,12 @@ class Report(object):
             if i in (0,1): column.set_expand(True)
             tree.append_column(column)
 
-        # To store the data, we use the ListStore object.
-        liststore = gtk.ListStore(
-            gobject.TYPE_STRING,
-            gobject.TYPE_STRING,
-            gobject.TYPE_INT,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            # Background colors for columns 4-15
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-            gobject.TYPE_STRING,gobject.TYPE_STRING,gobject.TYPE_STRING,
-        )
-
-        for row in statistics['results']:
-            # Create a separate list for the background colors so we don't
-            # affect the statistics object.
-            bg = []
-            # Set the background colors based on the values.
-            for i in range(1,13):
-                val = row[i+2]
-                if not val:
-                    bg.append(None)
-                elif re.match('^(s|at|rp);', val):
-                    bg.append('#B4EEB4')
-                elif re.match('^(ns);', val):
-                    bg.append('#FFC1C1')
-                else:
-                    bg.append(None)
-            liststore.append(row+bg)
-
-        # Set the tree model.
-        tree.set_model(liststore)
+        # The rows are added to the model from an idle callback, so the
+        # dialog doesn't block on summaries with thousands of rows.
+        column_types = [gobject.TYPE_STRING, gobject.TYPE_STRING, gobject.TYPE_INT] + \
+            [gobject.TYPE_STRING] * 12
+        self.set_summary_model(tree, statistics['results'], column_types,
+            3, '^(s|at|rp);')
 
         # Add the tree to the scrolled window.
         scrolled_window.add(tree)
@@ -21,15 +21,54 @@
 
 """This module provides functions for generating analysis reports."""
 
+import os
+import sys
+import csv
+import copy
+import gzip
+import json
+import array
+import base64
+import argparse
+import bisect
 import collections
 import datetime
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 from sqlite3 import dbapi2 as sqlite
 
 from setlyze import __version__
 import setlyze.config
+import setlyze.snapshot
 from setlyze.std import make_remarks
 
+# The version of the compact report format (see :func:`write_compact`).
+REPORT_FORMAT_VERSION = 1
+
+# The report elements that are saved in the compact report format, besides
+# the statistics.
+REPORT_ELEMENTS = ('analysis_name', 'options', 'definitions',
+    'locations_selections', 'species_selections', 'plate_areas_definition',
+    'area_totals_observed', 'area_totals_expected', 'spot_distances_observed',
+    'spot_distances_expected', 'instrumentation')
+
+# The location and species names of the local database, shared by all reports
+# of a process (see :func:`get_metadata`).
+metadata = None
+
+# Lock for loading `metadata`.
+metadata_lock = threading.Lock()
+
+# The buffer size in bytes of the files to which reports are exported.
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+# The results of the statistical tests that are written to the statistics
+# table of a batch (see :func:`iter_statistics_rows`).
+STATISTICS_FIELDS = ('n_plates', 'n_values', 'n_distances', 'p_value',
+    'mean_observed', 'mean_expected', 'statistic', 'chi_squared', 'df',
+    'n_significant', 'n_preference', 'n_rejection', 'n_attraction',
+    'n_repulsion')
 
 def export(report, path, type):
     """Export the data from a :class:`Report` object `report` to a data file.
@@ -38,6 +77,7 @@ def export(report, path, type):
     values for `type` are currently supported:
 
         * ``rst`` (reStructuredText)
+        * ``jsonl`` (compact report format, see :func:`write_compact`)
 
     Design Part: 1.17
     """
@@ -47,10 +87,213 @@ def export(report, path, type):
             path += ".rst"
         exporter = ExportRstReport(report)
         exporter.export(path)
+    elif type == 'jsonl':
+        if not path.endswith((".jsonl", ".jsonl.gz")):
+            path += ".jsonl"
+        write_compact(report, path)
     else:
         raise ValueError("Unsupported file type specified.")
     logging.info("Analysis report saved to %s" % path)
 
+def export_reports(reports, path, get_filename, type='rst', threads=None):
+    """Export the reports from the iterable `reports` to folder `path`.
+
+    The file name of each report is obtained by calling `get_filename` with
+    the report. The reports are exported with :func:`export` in file type
+    `type` by a pool of `threads` threads (configuration
+    ``export-threads`` by default), so the files of several reports are
+    written at the same time. The reports are taken from `reports` as the
+    threads are ready for them, so if `reports` is a generator, only a few
+    reports are in memory at a time. Returns the paths of the exported
+    files.
+    """
+    threads = threads or setlyze.config.cfg.get('export-threads')
+    pool = ThreadPool(threads)
+    # Limit the number of reports waiting to be exported.
+    slots = threading.BoundedSemaphore(threads * 2)
+    results = []
+
+    def export_report(report):
+        try:
+            filename = os.path.join(path, get_filename(report))
+            export(report, filename, type)
+            return filename
+        finally:
+            slots.release()
+
+    try:
+        for report in reports:
+            slots.acquire()
+            results.append(pool.apply_async(export_report, (report,)))
+    finally:
+        pool.close()
+        pool.join()
+    return [r.get() for r in results]
+
+class Metadata(object):
+    """Read-only lookup tables for the locations and species in the local
+    database file `dbfile`.
+
+    The tables are loaded with one query each when the instance is
+    created. Attribute `locations` is a dictionary
+    ``{loc_id: {'nr': loc_nr, 'name': loc_name}, ...}`` and attribute
+    `species` a dictionary
+    ``{spe_id: {'name_latin': ..., 'name_common': ...}, ...}``.
+    """
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.key = setlyze.snapshot.get_file_key(dbfile)
+
+        connection = sqlite.connect(dbfile)
+        cursor = connection.cursor()
+        cursor.execute("SELECT loc_id,loc_nr,loc_name FROM localities")
+        self.locations = dict([(loc_id, {'nr':loc_nr, 'name':loc_name}) for
+            loc_id,loc_nr,loc_name in cursor])
+        cursor.execute("SELECT spe_id,spe_name_latin,spe_name_venacular "
+            "FROM species")
+        self.species = dict([(spe_id, {'name_latin':name_latin,
+            'name_common':name_common}) for
+            spe_id,name_latin,name_common in cursor])
+        cursor.close()
+        connection.close()
+
+    def get_locations(self, ids):
+        """Return a dictionary with the information of the locations with
+        the IDs in `ids`. Unknown IDs are left out.
+        """
+        return dict([(i, dict(self.locations[i])) for i in ids if
+            i in self.locations])
+
+    def get_species(self, ids):
+        """Return a dictionary with the information of the species with
+        the IDs in `ids`. Unknown IDs are left out.
+        """
+        return dict([(i, dict(self.species[i])) for i in ids if
+            i in self.species])
+
+def get_metadata(dbfile=None):
+    """Return the :class:`Metadata` for the local database file `dbfile`.
+
+    The metadata is loaded once per process and shared by all reports. It
+    is loaded again if a different database file is used or if the file was
+    modified since. The parent process loads it before the worker processes
+    of a batch are started, so the workers inherit it. If `dbfile` is not
+    set, configuration ``db-file`` is used.
+    """
+    global metadata
+    dbfile = dbfile or setlyze.config.cfg.get('db-file')
+    with metadata_lock:
+        key = setlyze.snapshot.get_file_key(dbfile)
+        if not metadata or metadata.key != key:
+            metadata = Metadata(dbfile)
+        return metadata
+
+class SpotDistances(object):
+    """Compact, read-only container for the spot distances of plates.
+
+    The plate IDs and distances from the iterable `rows` of
+    ``(pla_id, distance)`` tuples are stored in arrays. Because there are
+    only a few possible distances on a SETL plate, each distance is stored
+    as a two byte index into the list of distinct distances. This takes far
+    less memory than a dictionary of lists, and the arrays are pickled as
+    plain bytes. The rows must be sorted by plate ID.
+
+    The distances of a plate are only turned into a list when they are
+    requested, so an instance can be used like the dictionary it replaces
+    ::
+
+        {
+            63: [1.0, 2.0, ...],
+            229: [3.16, ...],
+            ...
+        }
+
+    Where the dictionary keys are plate numbers and the values are lists
+    with distances for the corresponding plates.
+    """
+
+    # The names and type codes of the arrays.
+    ARRAYS = (('plates', 'i'), ('offsets', 'i'), ('codes', 'H'))
+
+    def __init__(self, rows=()):
+        for name, typecode in self.ARRAYS:
+            setattr(self, name, array.array(typecode))
+        self.values = []
+        codes = {}
+        for pla_id, distance in rows:
+            if not self.plates or self.plates[-1] != pla_id:
+                self.plates.append(pla_id)
+                self.offsets.append(len(self.codes))
+            code = codes.get(distance)
+            if code is None:
+                code = codes[distance] = len(self.values)
+                self.values.append(distance)
+            self.codes.append(code)
+        self.offsets.append(len(self.codes))
+
+    def __getstate__(self):
+        state = dict([(name, getattr(self, name).tostring()) for
+            name, typecode in self.ARRAYS])
+        state['values'] = self.values
+        return state
+
+    def __setstate__(self, state):
+        for name, typecode in self.ARRAYS:
+            a = array.array(typecode)
+            a.fromstring(state[name])
+            setattr(self, name, a)
+        self.values = state['values']
+
+    def __len__(self):
+        return len(self.plates)
+
+    def __iter__(self):
+        return iter(self.plates)
+
+    def __contains__(self, pla_id):
+        return self.index(pla_id) is not None
+
+    def __getitem__(self, pla_id):
+        i = self.index(pla_id)
+        if i is None:
+            raise KeyError(pla_id)
+        return self.get_distances(i)
+
+    def index(self, pla_id):
+        """Return the index of plate `pla_id`, or None if the plate has no
+        spot distances.
+        """
+        i = bisect.bisect_left(self.plates, pla_id)
+        if i < len(self.plates) and self.plates[i] == pla_id:
+            return i
+        return None
+
+    def get_distances(self, i):
+        """Return the list of distances for the plate with index `i`."""
+        values = self.values
+        return [values[c] for c in self.codes[self.offsets[i]:self.offsets[i+1]]]
+
+    def keys(self):
+        """Return a list of the plate IDs."""
+        return self.plates.tolist()
+
+    def iteritems(self):
+        """Yield a tuple ``(pla_id, distances)`` for each plate."""
+        for i, pla_id in enumerate(self.plates):
+            yield (pla_id, self.get_distances(i))
+
+    def items(self):
+        """Return a list of tuples ``(pla_id, distances)``."""
+        return list(self.iteritems())
+
+    def get_histogram(self):
+        """Return a dictionary with the number of times each distance
+        occurs on all plates.
+        """
+        counts = collections.Counter(self.codes)
+        return dict([(self.values[c], n) for c, n in counts.iteritems()])
+
 class Report(object):
     """Create a report object.
 
@@ -64,6 +307,7 @@ class Report(object):
         self.statistics = {}
         self.options = None
         self.definitions = None
+        self.instrumentation = None
 
     def is_empty(self):
         """Return True if this is an empty report."""
@@ -79,6 +323,15 @@ class Report(object):
             self.options = collections.OrderedDict()
         self.options[name] = value
 
+    def set_instrumentation(self, instrumentation):
+        """Set the resource usage of the analysis to `instrumentation`.
+
+        This is a dictionary with the time spent in each stage of the
+        analysis, as created by
+        :meth:`~setlyze.analysis.common.AnalysisWorker.run_instrumented`.
+        """
+        self.instrumentation = instrumentation
+
     def set_definitions(self, definitions):
         """Set the definitions dictionary `definitions`.
 
@@ -113,33 +366,12 @@ class Report(object):
                 }
             ]
         """
-        connection = sqlite.connect(self.dbfile)
-        cursor = connection.cursor()
-
+        metadata = get_metadata(self.dbfile)
         self.locations_selections = []
         for selection in selections:
             if not isinstance(selection, (list, tuple)):
                 continue
-
-            # Fetch all information about the locations selection.
-            selection_str = ",".join([str(id) for id in selection])
-            cursor.execute( "SELECT loc_id,loc_nr,loc_name "
-                            "FROM localities "
-                            "WHERE loc_id IN (%s)" %
-                            (selection_str)
-                            )
-
-            # Create a dictionary for the selection.
-            selection_dict = {}
-            for loc_id,loc_nr,loc_name in cursor:
-                selection_dict[loc_id] = {'nr':loc_nr, 'name':loc_name}
-
-            # Add the selection to the main variable.
-            self.locations_selections.append(selection_dict)
-
-        # Close connection with the local database.
-        cursor.close()
-        connection.close()
+            self.locations_selections.append(metadata.get_locations(selection))
 
     def set_species_selections(self, selections):
         """Set the species selections.
@@ -160,9 +392,7 @@ class Report(object):
                 }
             ]
         """
-        connection = sqlite.connect(self.dbfile)
-        cursor = connection.cursor()
-
+        metadata = get_metadata(self.dbfile)
         self.species_selections = []
         for selection in selections:
             if not isinstance(selection, (list, tuple, int)):
@@ -174,57 +404,34 @@ class Report(object):
             if isinstance(selection, int):
                 selection = [selection]
 
-            # Fetch all information about the locations selection.
-            selection_str = ",".join([str(id) for id in selection])
-            cursor.execute( "SELECT spe_id,spe_name_latin,spe_name_venacular "
-                            "FROM species "
-                            "WHERE spe_id IN (%s)" %
-                            (selection_str)
-                            )
-
-            # Create a dictionary for the selection.
-            selection_dict = {}
-            for spe_id,name_latin,name_common in cursor:
-                selection_dict[spe_id] = {'name_latin':name_latin, 'name_common':name_common}
-
-            # Add the selection to the main variable.
-            self.species_selections.append(selection_dict)
-
-        # Close connection with the local database.
-        cursor.close()
-        connection.close()
+            self.species_selections.append(metadata.get_species(selection))
 
     def set_spot_distances_observed(self):
         """Set the observed spot distances.
 
-        This element will be filled with the observed spot distances.
+        This element will be filled with the observed spot distances, as a
+        :class:`SpotDistances` instance that can be used as follows ::
 
-        The spot distances will be saved as follows ::
+            self.spot_distances_observed[63] == [1.0, 2.0, ...]
+            self.spot_distances_observed[229] == [3.16, ...]
 
-            self.spot_distances_observed = {
-                63: [1.0, 2.0, ...],
-                229: [3.16, ...],
-                ...
-            }
+        Where the keys are plate numbers and the values are lists with
+        distances for the corresponding plates.
 
-        Where the dictionary keys are plate numbers and the values are lists
-        with distances for the corresponding plates.
+        The distances are read from table "spot_distances_observed" in the
+        local database.
         """
         connection = sqlite.connect(self.dbfile)
         cursor = connection.cursor()
 
-        # Fetch all the observed distances.
+        # Fetch all the observed distances, grouped by plate.
         cursor.execute( "SELECT rec_pla_id,distance "
-                        "FROM spot_distances_observed"
+                        "FROM spot_distances_observed "
+                        "ORDER BY rec_pla_id"
                         )
 
         # Populate the main variable.
-        self.spot_distances_observed = {}
-        for pla_id,distance in cursor:
-            if pla_id in self.spot_distances_observed:
-                self.spot_distances_observed[pla_id].append(distance)
-            else:
-                self.spot_distances_observed[pla_id] = [distance]
+        self.spot_distances_observed = SpotDistances(cursor)
 
         # Close connection with the local database.
         cursor.close()
@@ -233,34 +440,29 @@ class Report(object):
     def set_spot_distances_expected(self):
         """Set the expected spot distances.
 
-        This element will be filled with the expected spot distances.
+        This element will be filled with the expected spot distances, as a
+        :class:`SpotDistances` instance that can be used as follows ::
 
-        The spot distances will be saved as follows ::
+            self.spot_distances_expected[63] == [1.0, 3.16, ...]
+            self.spot_distances_expected[229] == [4.47, ...]
 
-            self.spot_distances_expected = {
-                63: [1.0, 3.16, ...],
-                229: [4.47, ...],
-                ...
-            }
+        Where the keys are plate numbers and the values are lists with
+        distances for the corresponding plates.
 
-        Where the dictionary keys are plate numbers and the values are lists
-        with distances for the corresponding plates.
+        The distances are read from table "spot_distances_expected" in the
+        local database.
         """
         connection = sqlite.connect(self.dbfile)
         cursor = connection.cursor()
 
-        # Fetch all the expected distances.
+        # Fetch all the expected distances, grouped by plate.
         cursor.execute( "SELECT rec_pla_id,distance "
-                        "FROM spot_distances_expected"
+                        "FROM spot_distances_expected "
+                        "ORDER BY rec_pla_id"
                         )
 
         # Populate the main variable.
-        self.spot_distances_expected = {}
-        for pla_id,distance in cursor:
-            if pla_id in self.spot_distances_expected:
-                self.spot_distances_expected[pla_id].append(distance)
-            else:
-                self.spot_distances_expected[pla_id] = [distance]
+        self.spot_distances_expected = SpotDistances(cursor)
 
         # Close connection with the local database.
         cursor.close()
@@ -437,6 +639,109 @@ class Report(object):
         else:
             self.statistics[name] = [data]
 
+def get_species_names(report):
+    """Return a list with the name of the species of each species selection
+    of report `report`.
+
+    In batch mode there is one species per selection. The latin name is used,
+    or the common name if the latin name is not set.
+    """
+    names = []
+    for selection in getattr(report, 'species_selections', None) or []:
+        species = [s for s in selection.values()]
+        if not species:
+            continue
+        names.append(species[0]['name_latin'] or species[0]['name_common'])
+    return names
+
+def get_table_headers(attr):
+    """Return the column headers for a batch summary with attributes
+    `attr`.
+
+    The names of the columns in ``attr['columns']`` are not unique, so
+    they are prefixed with the name of the column group from
+    ``attr['columns_over']`` they fall under (see
+    :meth:`ExportRstReport.add_batch_summary`).
+    """
+    columns = list(attr['columns'])
+    over = attr.get('columns_over')
+    if not over:
+        return columns
+    headers = []
+    i = 0
+    for name, span in zip(over, attr['columns_over_spans']):
+        for column in columns[i:i+span]:
+            if name == '..':
+                headers.append(column)
+            else:
+                headers.append("%s %s" % (name, column))
+        i += span
+    headers.extend(columns[i:])
+    return headers
+
+def iter_statistics_rows(report):
+    """Yield a row for each group of the statistics of report `report`.
+
+    The rows are lists with the names of species A and B (B is None for
+    analyses on a single species), the name of the statistics, the test
+    method, the group (see :meth:`Report.set_statistics`) and the values of
+    :data:`STATISTICS_FIELDS`. These are the columns of
+    :data:`STATISTICS_HEADERS`.
+    """
+    species = get_species_names(report) + [None, None]
+    for name in sorted(report.statistics):
+        for data in report.statistics[name]:
+            method = data['attr'].get('method')
+            results = data['results']
+            if data['attr'].get('groups'):
+                groups = sorted(results.iteritems())
+            else:
+                groups = [(None, results)]
+            for group, values in groups:
+                if not isinstance(values, dict):
+                    continue
+                yield species[:2] + [name, method, group] + \
+                    [values.get(field) for field in STATISTICS_FIELDS]
+
+# The column headers of the rows from :func:`iter_statistics_rows`.
+STATISTICS_HEADERS = ('Species A', 'Species B', 'Statistics', 'Method',
+    'Group') + STATISTICS_FIELDS
+
+class TableWriter(object):
+    """Write a table to a CSV file row by row.
+
+    The table is saved to `path` with the column headers `headers`. Fields
+    are separated by `delimiter`; use a tab for a TSV file. Each row is
+    flushed as soon as it is written, so the file can be read while a batch
+    is still running.
+    """
+
+    def __init__(self, path, headers, delimiter=','):
+        self.path = path
+        self.f = open(path, 'wb')
+        self.writer = csv.writer(self.f, delimiter=delimiter,
+            lineterminator='\n')
+        self.write_row(headers)
+
+    def write_row(self, row):
+        """Write the row `row` to the file."""
+        self.writer.writerow([self.format(value) for value in row])
+        self.f.flush()
+
+    def format(self, value):
+        """Return `value` as a string for the CSV file."""
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        if isinstance(value, float):
+            return repr(value)
+        return value
+
+    def close(self):
+        """Close the file."""
+        self.f.close()
+
 class ExportRstReport(object):
     """Export an analysis report in reStructuredText format.
 
@@ -1127,7 +1432,290 @@ class ExportRstReport(object):
         yield t_footer
 
     def export(self, path, elements=None):
-        """Generate and export the report to a file."""
-        f = open(path, 'w')
-        f.writelines(self.get_lines())
+        """Generate and export the report to a file.
+
+        The lines are written to the file as they are generated (see
+        :meth:`write`), so the report is never held in memory as a whole.
+        """
+        f = open(path, 'w', EXPORT_BUFFER_SIZE)
+        try:
+            self.write(f)
+        finally:
+            f.close()
+
+    def write(self, f):
+        """Write the report to the file object `f`, section by section."""
+        for line in self.get_lines():
+            f.write(line)
+
+def encode(obj):
+    """Return `obj` encoded as a JSON compatible object.
+
+    Dictionaries with keys other than strings, ordered dictionaries, tuples
+    and :class:`SpotDistances` instances are encoded as objects with a
+    single key (``__dict__``, ``__odict__``, ``__tuple__`` and
+    ``__spot_distances__``), so :func:`decode` can restore them exactly.
+    The arrays of a :class:`SpotDistances` instance are saved as base64
+    encoded little-endian bytes.
+    """
+    if isinstance(obj, SpotDistances):
+        state = {'values': obj.values}
+        for name, typecode in obj.ARRAYS:
+            a = getattr(obj, name)
+            if sys.byteorder == 'big':
+                a = array.array(typecode, a)
+                a.byteswap()
+            state[name] = base64.b64encode(a.tostring())
+        return {'__spot_distances__': state}
+    if isinstance(obj, collections.OrderedDict):
+        return {'__odict__': [[encode(k), encode(v)] for k, v in obj.iteritems()]}
+    if isinstance(obj, dict):
+        if all([isinstance(k, basestring) and not k.startswith('__') for
+                k in obj]):
+            return dict([(k, encode(v)) for k, v in obj.iteritems()])
+        return {'__dict__': [[encode(k), encode(v)] for k, v in obj.iteritems()]}
+    if isinstance(obj, tuple):
+        return {'__tuple__': [encode(x) for x in obj]}
+    if isinstance(obj, list):
+        return [encode(x) for x in obj]
+    if hasattr(obj, 'tolist'):
+        # NumPy arrays and scalars.
+        return encode(obj.tolist())
+    return obj
+
+def decode(obj):
+    """Restore an object encoded with :func:`encode`.
+
+    This is used as the `object_hook` for :py:func:`json.loads`, so it is
+    called for each JSON object, innermost first.
+    """
+    if len(obj) != 1:
+        return obj
+    key, value = obj.items()[0]
+    if key == '__tuple__':
+        return tuple(value)
+    if key == '__odict__':
+        return collections.OrderedDict([(to_key(k), v) for k, v in value])
+    if key == '__dict__':
+        return dict([(to_key(k), v) for k, v in value])
+    if key == '__spot_distances__':
+        state = {'values': value['values']}
+        distances = SpotDistances()
+        for name, typecode in distances.ARRAYS:
+            a = array.array(typecode)
+            a.fromstring(base64.b64decode(value[name]))
+            if sys.byteorder == 'big':
+                a.byteswap()
+            state[name] = a.tostring()
+        distances.__setstate__(state)
+        return distances
+    return obj
+
+def to_key(key):
+    """Return `key` as a dictionary key. Lists are turned into tuples."""
+    if isinstance(key, list):
+        return tuple(key)
+    return key
+
+def open_compact(path, mode='rb'):
+    """Open the compact report file `path`. Files ending with ``.gz`` are
+    compressed with gzip.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+def write_compact(report, path):
+    """Save report `report` to `path` in the compact report format.
+
+    The file is in the JSON lines format: each line is a JSON object. The
+    first line is the header ``{"format": "setlyze-report", "version": 1,
+    "setlyze": "..."}``. It is followed by a line ``{"element": name,
+    "value": value}`` for each element from :data:`REPORT_ELEMENTS` that is
+    set and a line ``{"statistics": name, "value": data}`` for each entry
+    of the statistics (see :meth:`Report.set_statistics`), in the order in
+    which they were set. Values are encoded with :func:`encode`. The file
+    is compressed if `path` ends with ``.gz``. Use :func:`load` to load
+    the report.
+    """
+    f = open_compact(path, 'wb')
+    try:
+        for item in iter_compact(report):
+            f.write(json.dumps(item, separators=(',', ':')))
+            f.write('\n')
+    finally:
+        f.close()
+
+def iter_compact(report):
+    """Yield the lines of report `report` in the compact report format as
+    dictionaries (see :func:`write_compact`).
+    """
+    yield collections.OrderedDict([('format', 'setlyze-report'),
+        ('version', REPORT_FORMAT_VERSION), ('setlyze', __version__)])
+    for name in REPORT_ELEMENTS:
+        value = getattr(report, name, None)
+        if value is not None:
+            yield collections.OrderedDict([('element', name),
+                ('value', encode(value))])
+    for name in sorted(report.statistics):
+        for data in report.statistics[name]:
+            yield collections.OrderedDict([('statistics', name),
+                ('value', encode(data))])
+
+def load(path):
+    """Return the report saved to `path` in the compact report format as a
+    :class:`Report` instance.
+
+    Raises ValueError if the file is not in the compact report format or
+    if it was saved in a newer version of the format.
+    """
+    f = open_compact(path, 'rb')
+    try:
+        header = json.loads(f.readline() or '{}')
+        if header.get('format') != 'setlyze-report':
+            raise ValueError("%s is not a SETLyze report" % path)
+        if header.get('version') > REPORT_FORMAT_VERSION:
+            raise ValueError("%s was saved in a newer report format "
+                "(version %s)" % (path, header.get('version')))
+
+        report = Report()
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line, object_hook=decode)
+            if 'element' in item:
+                setattr(report, item['element'], item['value'])
+            elif 'statistics' in item:
+                report.statistics.setdefault(item['statistics'],
+                    []).append(item['value'])
+    finally:
         f.close()
+    return report
+
+def diff(a, b, tolerance=0.0):
+    """Return the differences between reports `a` and `b`.
+
+    The report elements from :data:`REPORT_ELEMENTS` and the statistics are
+    compared. Numbers are considered equal if they differ by at most
+    `tolerance`. Returns a list of tuples ``(path, value_a, value_b)``, where
+    `path` is a string like ``statistics.wilcoxon_areas[0].results.A`` that
+    points to the differing values. The resource usage
+    (``instrumentation``) is not compared, because it differs for each run.
+    """
+    differences = []
+    for name in REPORT_ELEMENTS:
+        if name == 'instrumentation':
+            continue
+        diff_values(name, getattr(a, name, None), getattr(b, name, None),
+            tolerance, differences)
+    diff_values('statistics', a.statistics, b.statistics, tolerance,
+        differences)
+    return differences
+
+def diff_values(path, a, b, tolerance, differences):
+    """Add the differences between values `a` and `b` at `path` to the list
+    `differences`. See :func:`diff`.
+    """
+    if isinstance(a, SpotDistances):
+        a = dict(a.iteritems())
+    if isinstance(b, SpotDistances):
+        b = dict(b.iteritems())
+
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key in sorted(set(a) | set(b)):
+            diff_values("%s.%s" % (path, key), a.get(key), b.get(key),
+                tolerance, differences)
+    elif isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)) and \
+            len(a) == len(b):
+        for i, (x, y) in enumerate(zip(a, b)):
+            diff_values("%s[%d]" % (path, i), x, y, tolerance, differences)
+    elif isinstance(a, (int, long, float)) and \
+            isinstance(b, (int, long, float)) and \
+            not isinstance(a, bool) and not isinstance(b, bool):
+        # NaN is not equal to itself, but two NaNs are no difference.
+        if a != b and not abs(a - b) <= tolerance and \
+                not (a != a and b != b):
+            differences.append((path, a, b))
+    elif a != b:
+        differences.append((path, a, b))
+
+def merge(reports):
+    """Return a report with the results of the reports `reports` merged.
+
+    This is used to combine the summary reports of batches that were run in
+    parts. The elements from :data:`REPORT_ELEMENTS` are taken from the
+    first report in which they are set. Statistics with the same name and
+    attributes are combined: result lists (the rows of a batch summary) are
+    joined and sorted, result dictionaries are updated. Other statistics
+    are added as they are.
+    """
+    merged = Report()
+    for report in reports:
+        for name in REPORT_ELEMENTS:
+            value = getattr(report, name, None)
+            if value is not None and getattr(merged, name, None) is None:
+                setattr(merged, name, value)
+
+        for name, entries in report.statistics.iteritems():
+            target = merged.statistics.setdefault(name, [])
+            for data in entries:
+                for existing in target:
+                    if existing['attr'] != data['attr']:
+                        continue
+                    if isinstance(existing['results'], list) and \
+                            isinstance(data['results'], list):
+                        existing['results'] = sorted(existing['results'] +
+                            data['results'])
+                        break
+                    if isinstance(existing['results'], dict) and \
+                            isinstance(data['results'], dict):
+                        existing['results'].update(data['results'])
+                        break
+                else:
+                    target.append({'attr': data['attr'],
+                        'results': copy.deepcopy(data['results'])})
+    return merged
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare, merge and "
+        "convert reports saved in the compact report format.")
+    subparsers = parser.add_subparsers(dest='command')
+    parser_diff = subparsers.add_parser('diff', help="Print the differences "
+        "between two reports.")
+    parser_diff.add_argument('a', help="Path to the first report.")
+    parser_diff.add_argument('b', help="Path to the second report.")
+    parser_diff.add_argument('--tolerance', type=float, default=0.0,
+        help="Maximum difference between numbers that are considered equal "
+        "(default: %(default)s).")
+    parser_merge = subparsers.add_parser('merge', help="Merge reports.")
+    parser_merge.add_argument('reports', nargs='+', help="Paths to the "
+        "reports.")
+    parser_merge.add_argument('-o', '--output', required=True, help="Save "
+        "the merged report to this file.")
+    parser_rst = subparsers.add_parser('rst', help="Export a report in "
+        "reStructuredText format.")
+    parser_rst.add_argument('report', help="Path to the report.")
+    parser_rst.add_argument('-o', '--output', required=True, help="Save "
+        "the exported report to this file.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    try:
+        if args.command == 'diff':
+            differences = diff(load(args.a), load(args.b), args.tolerance)
+            for path, a, b in differences:
+                print "%s: %r != %r" % (path, a, b)
+            sys.exit(1 if differences else 0)
+        elif args.command == 'merge':
+            write_compact(merge([load(p) for p in args.reports]), args.output)
+        elif args.command == 'rst':
+            export(load(args.report), args.output, 'rst')
+    except (IOError, ValueError) as e:
+        sys.exit(str(e))
+
+if __name__ == "__main__":
+    # Use the functions of the imported module, so the reports are instances
+    # of setlyze.report.Report.
+    import setlyze.report
+    setlyze.report.main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2010-2013, GiMaRIS <info@gimaris.com>
+#
+#  This file is part of SETLyze - A tool for analyzing the settlement
+#  of species on SETL plates.
+#
+#  SETLyze is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  SETLyze is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Columnar snapshot of the records table in the local database.
+
+After SETL data is imported into the local database, a compact copy of the
+columns of the ``records`` table needed by the analyses is written to a
+folder next to the database file. Each column is saved as a NumPy array
+(``.npy`` file):
+
+``rec_id``
+  The record IDs, sorted.
+
+``pla_id``
+  The plate ID for each record.
+
+``spe_id``
+  The species ID for each record.
+
+``spots``
+  The 25 spot booleans of each record as a bit mask. Bit 0 is set if
+  spot 1 is positive, bit 1 for spot 2, and so on.
+
+``plate_ids``, ``plate_loc_ids``
+  The plate IDs (sorted) and the location ID for each plate.
+
+Missing (NULL or empty) plate, species and location IDs are saved as
+:data:`NULL_ID`. The file ``header.json`` contains the data fingerprint of
+the database the snapshot was made from (see
+:meth:`setlyze.database.AccessDBGeneric.get_data_fingerprint`) and the
+number of records. A snapshot is only used for a database with the same
+fingerprint.
+
+The snapshot is opened memory-mapped and read-only, so processes in batch
+mode share the same pages instead of each running the same queries on the
+database.
+
+NumPy is an optional dependency. If it is not installed, no snapshot is
+written and all data is obtained from the database.
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import setlyze.config
+
+# The names of the arrays in a snapshot.
+ARRAYS = ('rec_id', 'pla_id', 'spe_id', 'spots', 'plate_ids', 'plate_loc_ids')
+
+# The name of the file with the snapshot information.
+HEADER = 'header.json'
+
+# The value saved for missing plate, species and location IDs. The IDs in
+# SETL data are positive, so this doesn't match any ID.
+NULL_ID = -1
+
+# The number of spots on a SETL plate.
+N_SPOTS = 25
+
+# Cache for the snapshots loaded by this process (see load_snapshot).
+snapshot_cache = {}
+snapshot_cache_lock = threading.Lock()
+
+def is_available():
+    """Return True if snapshots are supported (NumPy is installed)."""
+    return numpy is not None
+
+def get_id(value):
+    """Return ID `value` as saved in a snapshot, which is :data:`NULL_ID`
+    if the ID is missing.
+    """
+    if value is None or value == '':
+        return NULL_ID
+    return value
+
+def write_snapshot(connection, fingerprint, path=None):
+    """Write a snapshot of the records table to folder `path`.
+
+    The data is read through the SQLite connection `connection`, and
+    `fingerprint` is the data fingerprint of that database, which is saved
+    in the snapshot header. If `path` is not set, configuration
+    ``snapshot-path`` is used. The arrays are first written to a temporary
+    folder, which replaces the old snapshot once all arrays are written.
+
+    A :exc:`ValueError` is raised if a record has no record ID.
+    """
+    if not is_available():
+        raise RuntimeError("NumPy is required for creating a snapshot.")
+    if not path:
+        path = setlyze.config.cfg.get('snapshot-path')
+
+    cursor = connection.cursor()
+
+    # Get the record IDs, plate IDs, species IDs and spots.
+    cursor.execute("SELECT COUNT(*) FROM records")
+    n = cursor.fetchone()[0]
+    rec_id = numpy.empty(n, dtype=numpy.int32)
+    pla_id = numpy.empty(n, dtype=numpy.int32)
+    spe_id = numpy.empty(n, dtype=numpy.int32)
+    spots = numpy.zeros(n, dtype=numpy.uint32)
+
+    spot_columns = ",".join(["rec_sur%d" % i for i in range(1, N_SPOTS+1)])
+    cursor.execute("SELECT rec_id,rec_pla_id,rec_spe_id,%s "
+        "FROM records ORDER BY rec_id" % spot_columns)
+    for i, row in enumerate(cursor):
+        if row[0] is None:
+            raise ValueError("Records without a record ID can't be saved "
+                "in a snapshot.")
+        rec_id[i] = row[0]
+        pla_id[i] = get_id(row[1])
+        spe_id[i] = get_id(row[2])
+        mask = 0
+        for bit, spot in enumerate(row[3:]):
+            if spot:
+                mask |= 1 << bit
+        spots[i] = mask
+
+    # Get the location ID for each plate.
+    cursor.execute("SELECT pla_id,pla_loc_id FROM plates ORDER BY pla_id")
+    plates = cursor.fetchall()
+    cursor.close()
+    plate_ids = numpy.array([p[0] for p in plates], dtype=numpy.int32)
+    plate_loc_ids = numpy.array([get_id(p[1]) for p in plates],
+        dtype=numpy.int32)
+
+    # Write the arrays to a temporary folder first, so a failed write
+    # doesn't leave an incomplete snapshot behind.
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    arrays = {'rec_id': rec_id, 'pla_id': pla_id, 'spe_id': spe_id,
+        'spots': spots, 'plate_ids': plate_ids,
+        'plate_loc_ids': plate_loc_ids}
+    for name in ARRAYS:
+        numpy.save(os.path.join(tmp_path, name + '.npy'), arrays[name])
+    with open(os.path.join(tmp_path, HEADER), 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'records': n}, f)
+
+    remove_snapshot(path)
+    os.rename(tmp_path, path)
+    clear_snapshot_cache()
+
+    logging.info("Snapshot of %d records written to %s" % (n, path))
+
+def remove_snapshot(path=None):
+    """Remove the snapshot in folder `path` if it exists."""
+    if not path:
+        path = setlyze.config.cfg.get('snapshot-path')
+    clear_snapshot_cache()
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+def get_file_key(path):
+    """Return a key that changes when the file `path` is replaced or
+    modified, or None if the file doesn't exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_ino, st.st_size, st.st_mtime)
+
+def load_snapshot(db, path=None):
+    """Return the snapshot in folder `path` as a :class:`RecordsSnapshot`
+    instance.
+
+    Returns None if NumPy is not installed, if there is no snapshot, or if
+    the snapshot was not made from the data in the database that is
+    accessed through `db`, a :class:`setlyze.database.AccessDBGeneric`
+    instance. The data fingerprint of the database is compared with the
+    fingerprint in the snapshot header.
+
+    The snapshot is loaded and checked once per process, so creating a
+    database accessor stays cheap. It is loaded again if the snapshot or
+    the database file was replaced or modified since.
+    """
+    if not is_available():
+        return None
+    if not path:
+        path = setlyze.config.cfg.get('snapshot-path')
+    key = (get_file_key(os.path.join(path, HEADER)), get_file_key(db.dbfile))
+    if key[0] is None:
+        return None
+
+    with snapshot_cache_lock:
+        if path in snapshot_cache and snapshot_cache[path][0] == key:
+            return snapshot_cache[path][1]
+
+        try:
+            snapshot = RecordsSnapshot(path)
+        except Exception as e:
+            logging.warning("Failed to load snapshot %s: %s" % (path, e))
+            return None
+
+        # Check if the snapshot is for the current data.
+        if snapshot.header.get('fingerprint') != db.get_data_fingerprint():
+            logging.warning("Snapshot %s is outdated and will not be used." %
+                path)
+            snapshot = None
+
+        snapshot_cache[path] = (key, snapshot)
+        return snapshot
+
+def clear_snapshot_cache():
+    """Remove all snapshots cached by :func:`load_snapshot`."""
+    with snapshot_cache_lock:
+        snapshot_cache.clear()
+
+class RecordsSnapshot(object):
+    """Read-only access to a snapshot of the records table.
+
+    The arrays of the snapshot in folder `path` are memory-mapped and
+    available as attributes with the names from :data:`ARRAYS`. Attribute
+    `header` is a dictionary with the snapshot information.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER)) as f:
+            self.header = json.load(f)
+        for name in ARRAYS:
+            setattr(self, name, numpy.load(os.path.join(path, name + '.npy'),
+                mmap_mode='r'))
+
+    def get_plate_ids(self, locations):
+        """Return an array of the plate IDs for the locations IDs in the
+        list `locations`.
+        """
+        return self.plate_ids[numpy.in1d(self.plate_loc_ids, locations)]
+
+    def get_record_ids(self, locations, species):
+        """Return a list of the record IDs that match the locations IDs in
+        the list `locations` and the species IDs in the list `species`.
+        """
+        pla_ids = self.get_plate_ids(locations)
+        match = numpy.in1d(self.pla_id, pla_ids) & \
+            numpy.in1d(self.spe_id, species)
+        return self.rec_id[match].tolist()
+
+    def get_indices(self, rec_ids):
+        """Return the sorted array indices for the records with IDs matching
+        the list of record IDs `rec_ids`.
+        """
+        rec_ids = numpy.asarray(rec_ids, dtype=numpy.int32)
+        indices = numpy.searchsorted(self.rec_id, rec_ids)
+        # Skip record IDs that are not in the snapshot.
+        indices = indices[indices < len(self.rec_id)]
+        indices = indices[numpy.in1d(self.rec_id[indices], rec_ids)]
+        return numpy.unique(indices)
+
+    def get_spots(self, rec_ids):
+        """Return a 2D array with the 25 spot booleans (as 0 or 1) for each
+        record with ID matching the list of record IDs `rec_ids`.
+        """
+        return self.get_spots_by_index(self.get_indices(rec_ids))
+
+    def get_spots_by_index(self, indices):
+        """Return a 2D array with the 25 spot booleans (as 0 or 1) for the
+        records at array indices `indices`.
+        """
+        masks = self.spots[indices]
+        bits = numpy.arange(N_SPOTS, dtype=numpy.uint32)
+        return ((masks[:, numpy.newaxis] >> bits) & 1).astype(numpy.int8)
+
+    def get_plates_and_spots(self, rec_ids):
+        """Return a generator yielding tuples with the plate ID followed by
+        the 25 spot booleans for each record with ID matching the list of
+        record IDs `rec_ids`.
+        """
+        indices = self.get_indices(rec_ids)
+        pla_ids = self.pla_id[indices]
+        spots = self.get_spots_by_index(indices)
+        for pla_id, row in zip(pla_ids.tolist(), spots.tolist()):
+            yield tuple([pla_id] + row)
@@ -23,12 +23,11 @@
 
 import itertools
 import random
+import time
 
-from pandas.core.series import Series
-from pandas.rpy.common import convert_robj
 import rpy2.robjects as robjects
 from rpy2.rinterface import NULL
-from rpy2.robjects import FloatVector
+from rpy2.robjects import FloatVector, StrVector
 from rpy2.robjects.packages import importr
 
 # Get the R singleton.
@@ -38,51 +37,84 @@ r = robjects.r
 # the `warnings` function.
 r['options'](warn=-1)
 
+# The number of calls to the statistical functions in this module and the
+# total time (in seconds) spent in these calls by the current process. This
+# includes the time spent in R and the conversion of the results. Used by
+# :meth:`setlyze.analysis.common.AnalysisWorker.stage`.
+r_usage = {'calls': 0, 'time': 0.0}
+
+# The fields of the test results from R that are returned by the functions
+# in this module. Other fields are not converted.
+RESULT_FIELDS = ('method', 'alternative', 'statistic', 'parameter', 'p.value',
+    'expected')
+
+def get_fields(robj, fields=RESULT_FIELDS):
+    """Return the fields `fields` of the R list `robj` as a dictionary.
+
+    The fields are looked up by name in the ``ListVector`` `robj` and are
+    converted directly, without converting the other fields. A field that is
+    missing or ``NULL`` is set to None. Vectors with a single unnamed value
+    are returned as that value, named vectors as a dictionary and other
+    vectors as a list. For example, the result of ``wilcox.test`` is returned
+    as ::
+
+        {
+            'method': 'Wilcoxon rank sum test with continuity correction',
+            'alternative': 'two.sided',
+            'statistic': {'W': 1.0},
+            'parameter': None,
+            'p.value': 0.000810583642587086,
+            'expected': None
+        }
+    """
+    names = list(robj.names)
+    result = {}
+    for field in fields:
+        try:
+            value = robj[names.index(field)]
+        except ValueError:
+            result[field] = None
+            continue
+        result[field] = vector_to_python(value)
+    return result
+
+def vector_to_python(value):
+    """Return R vector `value` as a Python object.
+
+    See :func:`get_fields` for the conversion rules.
+    """
+    if value is NULL:
+        return None
+    items = list(value)
+    names = value.names
+    if isinstance(names, StrVector):
+        return dict(zip(names, items))
+    if len(items) == 1:
+        return items[0]
+    return items
+
 class ListVectorAsDict(object):
 
-    """Function decorator to return type ``ListVector`` as ``dict``."""
+    """Function decorator to return type ``ListVector`` as ``dict``.
+
+    The fields from :data:`RESULT_FIELDS` are obtained with
+    :func:`get_fields`. Calls to decorated functions are counted in
+    :data:`r_usage`.
+    """
 
     def __init__(self, f):
         self.f = f
 
     def __call__(self, *args, **kwargs):
-        out = self.f(*args, **kwargs)
-        if isinstance(out, robjects.vectors.ListVector):
-            return self.simplify( convert_robj(out) )
-        return out
-
-    def simplify(self, obj):
-        """Return a simplified version of the statistics dictionary `obj`.
-
-        Lists containing only a single item are returned as single items and
-        ``rpy2.rinterface.NULL`` values are converted to None.
-        """
-        if obj is NULL:
-            return None
-        if isinstance(obj, Series):
-            obj = dict(obj)
-
-        # Return the original object if it is not iterable.
+        start = time.time()
         try:
-            _ = (x for x in obj)
-        except TypeError:
-            return obj
-
-        if isinstance(obj, dict):
-            # Recurse into dictionary values.
-            for k in obj:
-                obj[k] = self.simplify(obj[k])
-        elif len(obj) == 1:
-            # Return the first item if the list contains just one object.
-            if obj[0] is NULL:
-                return None
-            return obj[0]
-        elif isinstance(obj, list):
-            # Recurse into the list items.
-            for i, e in enumerate(obj):
-                obj[i] = self.simplify(e)
-
-        return obj
+            out = self.f(*args, **kwargs)
+            if isinstance(out, robjects.vectors.ListVector):
+                return get_fields(out)
+            return out
+        finally:
+            r_usage['calls'] += 1
+            r_usage['time'] += time.time() - start
 
 @ListVectorAsDict
 def t_test(x, y=NULL, **kwargs):
@@ -91,25 +123,19 @@ def t_test(x, y=NULL, **kwargs):
     This is a wrapper function for the ``t.test`` function from R. It depends on
     R and RPy. The latter provides an interface to the R Programming Language.
 
-    This function returns a dictionary containing the results. Below is the
-    format of the dictionary with example results ::
+    This function returns a dictionary containing the results (see
+    :func:`get_fields`). Below is the format of the dictionary with example
+    results ::
 
         {
-            'null.value': {
-                'difference in means': 0
-            },
             'method': 'Welch Two Sample t-test',
-            'p.value': 0.97053139295765201,
+            'alternative': 'two.sided',
             'statistic': {
                 't': -0.037113583386291726
             },
-            'estimate': {
-                'mean of y': 2.552142857142857,
-                'mean of x': 2.5417857142857141
-            },
-            'conf.int': [-0.56985924418141154, 0.54914495846712563],
             'parameter': {'df': 53.965197921982607},
-            'alternative': 'two.sided'
+            'p.value': 0.97053139295765201,
+            'expected': None
         }
     """
     x = FloatVector(x)
@@ -126,24 +152,19 @@ def wilcox_test(x, y=NULL, **kwargs):
     depends on R and RPy. The latter provides an interface to the R Programming
     Language.
 
-    This function returns a dictionary containing the results. Below is the
-    format of the dictionary with example results ::
+    This function returns a dictionary containing the results (see
+    :func:`get_fields`). Below is the format of the dictionary with example
+    results ::
 
         {
-            'estimate': {
-                'difference in location': -2.0000005809455006
-            },
-            'null.value': {
-                'location shift': 0
-            },
-            'p.value': 0.000810583642587086,
+            'method': 'Wilcoxon rank sum test with continuity correction',
+            'alternative': 'two.sided',
             'statistic': {
                 'W': 1.0
             },
-            'alternative': 'two.sided',
-            'conf.int': [-3.1200287512799796, -1.2399735289828238],
             'parameter': None,
-            'method': 'Wilcoxon rank sum test with continuity correction'
+            'p.value': 0.000810583642587086,
+            'expected': None
         }
     """
     x = FloatVector(x)
@@ -164,13 +185,17 @@ def shapiro_test(x):
     ValueError is raised. If the length of `x` is above 5000,
     :py:meth:`random.sample` is used to get 5000 random values from `x`.
 
-    This function returns a dictionary containing the results. Below is the
-    format of the dictionary with example results ::
+    This function returns a dictionary containing the results (see
+    :func:`get_fields`). Below is the format of the dictionary with example
+    results ::
 
         {
             'method': 'Shapiro-Wilk normality test',
+            'alternative': None,
+            'statistic': {'W': 0.75000003111895985},
+            'parameter': None,
             'p.value': 6.862712394148655e-08,
-            'statistic': {'W': 0.75000003111895985}
+            'expected': None
         }
     """
     if len(x) > 5000:
@@ -189,27 +214,21 @@ def chisq_test(x, y=NULL, **kwargs):
     depends on R and RPy. The latter provides an interface to the R
     Programming Language.
 
-    This function returns a dictionary containing the results. Below
-    is the format of the dictionary with example results ::
+    This function returns a dictionary containing the results (see
+    :func:`get_fields`). Below is the format of the dictionary with example
+    results ::
 
         {
-            'null.value': {
-                'difference in means': 0
-            },
-            'method': 'Welch Two Sample t-test',
-            'p.value': 0.97053139295765201,
+            'method': 'Chi-squared test for given probabilities',
+            'alternative': None,
             'statistic': {
-                't': -0.037113583386291726
+                'X-squared': 4.4
             },
-            'estimate': {
-                'mean of y': 2.552142857142857,
-                'mean of x': 2.5417857142857141
-            },
-            'conf.int': [-0.56985924418141154, 0.54914495846712563],
             'parameter': {
-                'df': 53.965197921982607
+                'df': 3.0
             },
-            'alternative': 'two.sided'
+            'p.value': 0.22146941306710923,
+            'expected': [5.0, 5.0, 5.0, 5.0]
         }
     """
     if 'p' not in kwargs:
@@ -221,3 +240,98 @@ def chisq_test(x, y=NULL, **kwargs):
         y = FloatVector(y)
 
     return r('chisq.test')(x, y, **kwargs)
+
+# R function that performs the Wilcoxon test on each pair of samples from the
+# lists `x` and `y`. Returns a list with a matrix that has the statistic and
+# the p-value for each pair as a row, and a vector with the names of the
+# methods. Failed tests result in NA values and an empty method name.
+_wilcox_test_batch = r('''
+function(x, y, ...) {
+    res <- lapply(seq_along(x), function(i) {
+        tryCatch(wilcox.test(x[[i]], y[[i]], ...), error=function(e) NULL)
+    })
+    stats <- vapply(res, function(test) {
+        if (is.null(test)) c(NA_real_, NA_real_) else c(test$statistic, test$p.value)
+    }, numeric(2))
+    methods <- vapply(res, function(test) if (is.null(test)) "" else test$method, "")
+    list(t(stats), methods)
+}
+''')
+
+# R function that performs the Chi-squared test for given probabilities `p`
+# on each sample from list `x`. Returns a list with a matrix that has the
+# statistic, the degrees of freedom and the p-value for each sample as a
+# row, and a vector with the names of the methods.
+_chisq_test_batch = r('''
+function(x, p) {
+    res <- lapply(x, function(xi) {
+        tryCatch(chisq.test(xi, p=p), error=function(e) NULL)
+    })
+    stats <- vapply(res, function(test) {
+        if (is.null(test)) c(NA_real_, NA_real_, NA_real_)
+        else c(test$statistic, test$parameter, test$p.value)
+    }, numeric(3))
+    methods <- vapply(res, function(test) if (is.null(test)) "" else test$method, "")
+    list(t(stats), methods)
+}
+''')
+
+def _matrix_rows(matrix, methods):
+    """Return the rows of R matrix `matrix` as tuples, each followed by the
+    method name from R vector `methods`.
+
+    Values of the matrix are obtained in one go, instead of converting the
+    matrix to a Python object.
+    """
+    n = len(methods)
+    values = list(matrix)
+    columns = [values[i*n:(i+1)*n] for i in range(len(values) // n)]
+    return [tuple(row) for row in zip(*(columns + [list(methods)]))]
+
+@ListVectorAsDict
+def wilcox_test_batch(samples, **kwargs):
+    """Performs two sample Wilcoxon tests on each pair of samples in a single
+    call to R.
+
+    Argument `samples` is a list of ``(x, y)`` tuples, where `x` and `y` are
+    sequences of data. Keyword arguments are passed to the ``wilcox.test``
+    function from R for each pair. Underscores in the argument names are
+    replaced by dots (e.g. `conf_level` becomes ``conf.level``).
+
+    This function returns a list with a tuple
+    ``(statistic, p_value, method)`` for each pair of samples, in the same
+    order as `samples`. Example ::
+
+        [(1.0, 0.000810583642587086,
+          'Wilcoxon rank sum test with continuity correction'), ...]
+
+    If the test fails for a pair, the statistic and the p-value are NaN and
+    the method is an empty string.
+
+    Compared to calling :func:`wilcox_test` for each pair, R is called just
+    once and only the statistics and the p-values are converted.
+    """
+    if not samples:
+        return []
+    x = robjects.r['list'](*[FloatVector(s[0]) for s in samples])
+    y = robjects.r['list'](*[FloatVector(s[1]) for s in samples])
+    kwargs = dict((k.replace('_', '.'), v) for k, v in kwargs.iteritems())
+    out = _wilcox_test_batch(x, y, **kwargs)
+    return _matrix_rows(out[0], out[1])
+
+@ListVectorAsDict
+def chisq_test_batch(samples, p):
+    """Performs Chi-squared goodness-of-fit tests with given probabilities
+    `p` on each sample in a single call to R.
+
+    Argument `samples` is a list of sequences of data. This function returns
+    a list with a tuple ``(statistic, df, p_value, method)`` for each
+    sample, in the same order as `samples`. If the test fails for a sample,
+    the statistic, the degrees of freedom and the p-value are NaN and the
+    method is an empty string.
+    """
+    if not samples:
+        return []
+    x = robjects.r['list'](*[FloatVector(s) for s in samples])
+    out = _chisq_test_batch(x, FloatVector(list(p)))
+    return _matrix_rows(out[0], out[1])
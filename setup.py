@@ -32,11 +32,10 @@ setup(
         "Natural Language :: English",
     ],
     keywords = 'gimaris setl settlement marine species',
-    packages=find_packages(exclude=['build','docs','env','tests']),
+    packages=find_packages(exclude=['benchmarks','build','docs','env','tests']),
     install_requires=[
         'appdirs',
         #'PyGTK>=2.24.0,!=2.24.8,!=2.24.10',
-        'pandas',
         'RPy2',
         'xlrd>=0.8',
     ],
@@ -49,6 +48,10 @@ setup(
     entry_points={
         'gui_scripts': [
             'setlyze = setlyze.main:main',
+        ],
+        'console_scripts': [
+            'setlyze-checkpoint = setlyze.checkpoint:main',
+            'setlyze-worker = setlyze.distributed:main',
         ]
     }
 )
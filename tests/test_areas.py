@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Unit test for :mod:`setlyze.areas`."""
+
+import os
+import sys
+import random
+import sqlite3
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+sys.path.insert(0, os.path.abspath('.'))
+
+import setlyze.areas as areas
+
+# From plate area to spot numbers.
+area2spots = {'A': (1,5,21,25),
+    'B': (2,3,4,6,10,11,15,16,20,22,23,24),
+    'C': (7,8,9,12,14,17,18,19),
+    'D': (13,),
+    }
+
+def get_area_totals(record):
+    """Return the number of positive spots per default plate area for the
+    25 spot values of `record`, the way the analysis used to count them.
+    """
+    area_totals = {'A': 0, 'B': 0, 'C': 0, 'D': 0}
+    for spot, precence in enumerate(record, start=1):
+        if not precence:
+            continue
+        for area, area_spots in area2spots.iteritems():
+            if spot in area_spots:
+                area_totals[area] += 1
+                break
+    return area_totals
+
+class TestAreas(unittest.TestCase):
+
+    """Unit tests for :mod:`setlyze.areas`."""
+
+    def setUp(self):
+        # Spots tables contain integers, NULL and empty strings.
+        rand = random.Random(1)
+        self.records = [[rand.choice((0, 1, 1, None, ''))
+            for spot in range(areas.N_SPOTS)] for i in range(300)]
+        self.records.append([0] * areas.N_SPOTS)
+        self.records.append([1] * areas.N_SPOTS)
+
+        self.connection = sqlite3.connect(':memory:')
+        columns = ",".join(["rec_sur%d INTEGER" % i
+            for i in range(1, areas.N_SPOTS+1)])
+        self.connection.execute("CREATE TABLE species_spots_1 (%s)" % columns)
+        self.connection.executemany("INSERT INTO species_spots_1 VALUES (%s)" %
+            ",".join('?' * areas.N_SPOTS), self.records)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def get_masks(self):
+        cursor = self.connection.execute("SELECT %s FROM species_spots_1" %
+            areas.get_mask_sql())
+        return [row[0] for row in cursor]
+
+    def check_totals(self, groups):
+        masks = self.get_masks()
+        expected = [get_area_totals(record) for record in self.records]
+        matrix = areas.AreaMatrix(groups)
+
+        # Both with the lookups and, if available, with NumPy.
+        for n in (10, len(masks)):
+            totals = matrix.apply(masks[:n])
+            for name, group in groups:
+                self.assertEqual(totals[name],
+                    [sum([t[area] for area in group]) for t in expected[:n]])
+
+    def test_default_areas(self):
+        groups = [("+".join(g), g) for g in (('A',),('B',),('C',),('D',),
+            ('A','B'),('C','D'),('A','B','C'),('B','C','D'))]
+        self.check_totals(groups)
+
+    def test_defined_areas(self):
+        definition = {'area1': ['A','D'], 'area2': ['B'], 'area3': ['C']}
+        self.check_totals(sorted(definition.items()))
+
+    def test_random_masks(self):
+        masks = self.get_masks()
+        counts = map(areas.count_spots, masks)
+        random_masks = areas.get_random_masks(counts, random.Random(2))
+        self.assertEqual(map(areas.count_spots, random_masks), counts)
+
+if __name__ == '__main__':
+    unittest.main()
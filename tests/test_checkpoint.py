@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Unit test for :mod:`setlyze.checkpoint`."""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+sys.path.insert(0, os.path.abspath('.'))
+
+import setlyze.checkpoint as checkpoint
+import setlyze.report
+
+class TestCheckpoint(unittest.TestCase):
+
+    """Unit tests for :class:`setlyze.checkpoint.Checkpoint`."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.checkpoint = checkpoint.Checkpoint(os.path.join(self.path,
+            'spot_preference-0123456789ab'))
+        self.checkpoint.create('spot_preference', {'species': [1, 2, 3]}, 4,
+            '0123456789abcdef')
+
+        self.report = setlyze.report.Report()
+        self.report.set_analysis('spot_preference')
+        self.report.set_statistics('chisq_areas', {'attr': {'method': 'chisq'},
+            'results': {'p_value': 0.5}})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def reload(self):
+        c = checkpoint.Checkpoint(self.checkpoint.path)
+        c.load()
+        return c
+
+    def test_add_and_load(self):
+        self.checkpoint.add('1', self.report)
+        self.checkpoint.add('2', setlyze.report.Report())
+        self.checkpoint.add('3', None)
+
+        c = self.reload()
+        self.assertEqual(c.manifest['parameters'], {'species': [1, 2, 3]})
+        self.assertEqual(c.completed, {'1': checkpoint.STATUS_DONE,
+            '2': checkpoint.STATUS_EMPTY, '3': checkpoint.STATUS_EMPTY})
+        self.assertEqual(c.get_report('1').statistics,
+            self.report.statistics)
+        self.assertEqual(c.get_report('2'), None)
+        self.assertFalse(c.is_complete())
+
+        c.add('4', self.report)
+        self.assertTrue(c.is_complete())
+
+    def test_missing_report(self):
+        self.checkpoint.add('1', self.report)
+        os.remove(self.checkpoint.get_report_path('1'))
+        self.assertEqual(self.reload().completed, {})
+
+    def test_truncated_line(self):
+        self.checkpoint.add('1', self.report)
+        with open(os.path.join(self.checkpoint.path, 'completed.log'),
+                'a') as f:
+            f.write("2\tdo")
+        self.assertEqual(self.reload().completed,
+            {'1': checkpoint.STATUS_DONE})
+
+        # Resuming the batch continues after the incomplete line.
+        c = self.reload()
+        c.add('2', None)
+        c.add('3', self.report)
+        self.assertEqual(self.reload().completed, {
+            '1': checkpoint.STATUS_DONE, '2': checkpoint.STATUS_EMPTY,
+            '3': checkpoint.STATUS_DONE})
+
+    def test_unsupported_version(self):
+        manifest = os.path.join(self.checkpoint.path, 'manifest.json')
+        with open(manifest, 'w') as f:
+            f.write('{"version": %d}' % (checkpoint.CHECKPOINT_VERSION + 1))
+        self.assertRaises(ValueError, self.reload)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Unit test for :mod:`setlyze.analysis.common`."""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+sys.path.insert(0, os.path.abspath('.'))
+
+import setlyze.config
+import setlyze.database
+import setlyze.analysis.common as common
+
+class Analysis(common.AnalysisWorker):
+    """Analysis that runs a few queries on the local database."""
+
+    def run(self):
+        self.db = setlyze.database.get_database_accessor()
+        with self.stage('locations') as stage:
+            stage['rows'] = len(self.db.get_locations())
+            self.db.get_locations()
+        self.result.set_statistics('test', {'attr': {'method': 'test'},
+            'results': {'n_locations': stage['rows']}})
+        self.on_exit()
+        return self.result
+
+class TestCommon(unittest.TestCase):
+
+    """Unit tests for :mod:`setlyze.analysis.common`."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.config = {}
+        for name, value in (
+                ('data-source', 'data-files'),
+                ('db-file', os.path.join(self.path, 'setl_local.db')),
+                ('snapshot-path', os.path.join(self.path, 'setl_local.snapshot')),
+                ('sql-trace', True),
+            ):
+            self.config[name] = setlyze.config.cfg.get(name)
+            setlyze.config.cfg.set(name, value)
+
+        connection = sqlite3.connect(setlyze.config.cfg.get('db-file'))
+        connection.executescript("""
+            CREATE TABLE localities (loc_id INTEGER PRIMARY KEY,
+                loc_name TEXT);
+            INSERT INTO localities VALUES (1, 'Aquadome, Grevelingen');
+            INSERT INTO localities VALUES (2, 'Haringvliet');
+        """)
+        connection.close()
+
+    def tearDown(self):
+        setlyze.database.connections.close()
+        for name, value in self.config.iteritems():
+            setlyze.config.cfg.set(name, value)
+        shutil.rmtree(self.path)
+
+    def test_run_instrumented(self):
+        result = Analysis().run_instrumented()
+        instrumentation = result.instrumentation
+
+        # The SQL statements are counted after the connection was returned
+        # to the pool by on_exit().
+        stage = instrumentation['stages']['locations']
+        self.assertEqual(stage['rows'], 2)
+        self.assertEqual(stage['sql_statements'], 2)
+        self.assertTrue(instrumentation['total']['sql_statements'] >=
+            stage['sql_statements'])
+        self.assertTrue(result.get_option('SQL statements').startswith(
+            "%d " % instrumentation['total']['sql_statements']))
+
+        # The trace summary has the locations query.
+        self.assertEqual([(t['executes'], t['rows']) for t in
+            instrumentation['sql'] if 'localities' in t['template']],
+            [(2, 4)])
+
+    def test_schedule_jobs(self):
+        overhead = common.JOB_OVERHEAD
+        jobs = [(i, 'job%d' % i) for i in range(10)]
+        costs = dict((i, 2 * overhead) for i in range(10))
+        costs[3] = 200 * overhead
+
+        chunks = common.schedule_jobs(jobs, costs, 2)
+
+        # The heaviest job comes first in a chunk of its own, and the cheap
+        # jobs are combined in chunks that stay below 1/16th of the total
+        # cost.
+        self.assertEqual(chunks, [
+            [(3, 'job3')],
+            [(0, 'job0'), (1, 'job1'), (2, 'job2'), (4, 'job4')],
+            [(5, 'job5'), (6, 'job6'), (7, 'job7'), (8, 'job8')],
+            [(9, 'job9')],
+        ])
+
+    def test_schedule_jobs_without_costs(self):
+        jobs = [('a', 1), ('b', 2), ('c', 3)]
+
+        # Jobs without an estimate get the mean cost.
+        chunks = common.schedule_jobs(jobs, {'a': 0, 'c': 1000}, 1)
+        scheduled = [job for chunk in chunks for job in chunk]
+        self.assertEqual(scheduled, [('c', 3), ('b', 2), ('a', 1)])
+
+        chunks = common.schedule_jobs(jobs, {}, 1)
+        self.assertEqual(sorted([job for chunk in chunks for job in chunk]),
+            jobs)
+        self.assertEqual(common.schedule_jobs([], {}, 1), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Unit test for the data file parsers of :mod:`setlyze.database`."""
+
+import os
+import sys
+import shutil
+import tempfile
+import zipfile
+import unittest
+from xml.etree import cElementTree as ElementTree
+
+sys.path.insert(0, os.path.abspath('..'))
+sys.path.insert(0, os.path.abspath('.'))
+
+import setlyze.database as database
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="%s"
+    xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+  <sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>
+</workbook>""" % NS_MAIN
+
+WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+  <Relationship Id="rId1" Target="worksheets/sheet1.xml"
+    Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>
+</Relationships>"""
+
+SHARED_STRINGS = """<?xml version="1.0" encoding="UTF-8"?>
+<sst xmlns="%s">
+  <si><t>LOC_id</t></si>
+  <si><t>LOC_name</t></si>
+  <si><r><t>Aquadome, </t></r><r><t>Grevelingen</t></r></si>
+</sst>""" % NS_MAIN
+
+# A header row, a row with a gap and a row that is shorter than the
+# dimension of the sheet.
+SHEET = """<?xml version="1.0" encoding="UTF-8"?>
+<worksheet xmlns="%s">
+  <dimension ref="A1:D3"/>
+  <sheetData>
+    <row r="1">
+      <c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c>
+      <c r="C1" t="inlineStr"><is><t>LOC_nr</t></is></c>
+      <c r="D1" t="inlineStr"><is><t>LOC_remarks</t></is></c>
+    </row>
+    <row r="2">
+      <c r="A2"><v>1</v></c><c r="B2" t="s"><v>2</v></c>
+      <c r="D2" t="b"><v>1</v></c>
+    </row>
+    <row r="3">
+      <c r="A3"><v>2.5</v></c>
+    </row>
+  </sheetData>
+</worksheet>""" % NS_MAIN
+
+def make_cell(xml):
+    """Return the cell element for the XML string `xml` of a ``c``
+    element without a namespace.
+    """
+    return ElementTree.fromstring(xml.replace('<c', '<c xmlns="%s"' % NS_MAIN, 1))
+
+class TestDataFiles(unittest.TestCase):
+
+    """Unit tests for the data file parsers of :mod:`setlyze.database`."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.xlsx_file = os.path.join(self.path, 'SETL_localities.xlsx')
+        archive = zipfile.ZipFile(self.xlsx_file, 'w')
+        archive.writestr('xl/workbook.xml', WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+        archive.writestr('xl/sharedStrings.xml', SHARED_STRINGS)
+        archive.writestr('xl/worksheets/sheet1.xml', SHEET)
+        archive.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_iter_xlsx_rows(self):
+        rows = list(database.iter_xlsx_rows(self.xlsx_file))
+        self.assertEqual(rows, [
+            [u'LOC_id', u'LOC_name', u'LOC_nr', u'LOC_remarks'],
+            [1.0, u'Aquadome, Grevelingen', '', 1],
+            [2.5, '', '', ''],
+        ])
+
+    def test_iter_xls_rows_skips_header(self):
+        rows = list(database.iter_xls_rows(self.xlsx_file))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][0], 1.0)
+
+    def test_get_xlsx_cell_value(self):
+        strings = [u'Aurelia aurita']
+        test_data = (
+            ('<c r="A1"><v>135306</v></c>', 135306.0),
+            ('<c r="A1" t="n"><v>0.5</v></c>', 0.5),
+            ('<c r="A1" t="s"><v>0</v></c>', u'Aurelia aurita'),
+            ('<c r="A1" t="str"><v>TRUE</v></c>', u'TRUE'),
+            ('<c r="A1" t="b"><v>0</v></c>', 0),
+            ('<c r="A1" t="e"><v>#N/A</v></c>', ''),
+            ('<c r="A1" t="inlineStr"><is><t>Scyphozoa</t></is></c>',
+                u'Scyphozoa'),
+            ('<c r="A1"/>', ''),
+        )
+
+        for xml, expected in test_data:
+            value = database._get_xlsx_cell_value(make_cell(xml), strings)
+            self.assertEqual(value, expected)
+            self.assertEqual(type(value), type(expected))
+
+    def test_validate_localities_rows(self):
+        row = [1, 'Aquadome, Grevelingen', 1, '', '']
+        self.assertEqual(list(database.validate_localities_rows([row])), [row])
+        self.assertRaises(ValueError, list,
+            database.validate_localities_rows([row[:4]]))
+
+    def test_validate_plates_rows(self):
+        row = range(10)
+        self.assertEqual(list(database.validate_plates_rows([row])), [row])
+        self.assertRaises(ValueError, list,
+            database.validate_plates_rows([row + [10]]))
+
+    def test_validate_records_rows(self):
+        row = range(40)
+        self.assertEqual(list(database.validate_records_rows([row], True)),
+            [row[:38]])
+        self.assertEqual(list(database.validate_records_rows([row[:38]])),
+            [row[:38]])
+        self.assertRaises(ValueError, list,
+            database.validate_records_rows([row[:38]], True))
+        self.assertRaises(ValueError, list,
+            database.validate_records_rows([row[:37]]))
+
+    def test_validate_species_rows(self):
+        row = [1, 'Kwalpoliepjes', 'Aurelia aurita', 'FALSE', '', 'TRUE']
+        rows = list(database.validate_species_rows([row]))
+        self.assertEqual(rows, [[1, 'Kwalpoliepjes', 'Aurelia aurita', False,
+            None, True] + [None] * 11])
+        self.assertRaises(ValueError, list,
+            database.validate_species_rows([range(18)]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Unit test for :mod:`setlyze.distributed`."""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+import multiprocessing
+import unittest
+from multiprocessing.connection import Listener
+
+sys.path.insert(0, os.path.abspath('..'))
+sys.path.insert(0, os.path.abspath('.'))
+
+import setlyze.config
+import setlyze.database
+import setlyze.distributed as distributed
+
+AUTHKEY = 'secret'
+
+def square(task):
+    """Task for the workers in the tests."""
+    return task * task
+
+def make_database(path):
+    """Create a local database file `path` with a few SETL records."""
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE info (id INTEGER PRIMARY KEY, name TEXT, value TEXT);
+        CREATE TABLE localities (loc_id INTEGER PRIMARY KEY);
+        CREATE TABLE species (spe_id INTEGER PRIMARY KEY);
+        CREATE TABLE plates (pla_id INTEGER PRIMARY KEY, pla_loc_id INTEGER);
+        CREATE TABLE records (rec_id INTEGER PRIMARY KEY, rec_pla_id INTEGER,
+            rec_spe_id INTEGER);
+        INSERT INTO info VALUES (null, 'source', 'data-files');
+        INSERT INTO localities VALUES (1);
+        INSERT INTO species VALUES (1);
+        INSERT INTO plates VALUES (1, 1);
+        INSERT INTO records VALUES (1, 1, 1);
+        INSERT INTO records VALUES (2, 1, 1);
+    """)
+    fingerprint = setlyze.database.get_data_fingerprint(connection)
+    connection.close()
+    return fingerprint
+
+class TestDistributed(unittest.TestCase):
+
+    """Unit tests for :mod:`setlyze.distributed`."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.path, 'setl_local.db')
+        self.fingerprint = make_database(self.db_file)
+        setlyze.config.cfg.set('worker-cache-path',
+            os.path.join(self.path, 'cache'))
+        setlyze.config.cfg.set('snapshot-path',
+            os.path.join(self.path, 'setl_local.snapshot'))
+
+    def tearDown(self):
+        setlyze.database.connections.close()
+        shutil.rmtree(self.path)
+
+    def test_batch_on_localhost(self):
+        coordinator = distributed.Coordinator(('127.0.0.1', 0), AUTHKEY,
+            threading.Event(), self.db_file, self.fingerprint)
+        results = coordinator.imap_unordered(square, range(10))
+
+        workers = [multiprocessing.Process(target=distributed.run_worker,
+            args=(coordinator.address, AUTHKEY, 1, self.db_file, True, 0.1))
+            for i in range(2)]
+        for worker in workers:
+            worker.start()
+
+        self.assertEqual(sorted(results), [i * i for i in range(10)])
+        coordinator.join()
+        for worker in workers:
+            worker.join(10)
+            self.assertEqual(worker.exitcode, 0)
+
+    def test_worker_refuses_other_version(self):
+        listener = Listener(('127.0.0.1', 0), authkey=AUTHKEY)
+
+        def serve():
+            conn = listener.accept()
+            conn.recv()
+            conn.send(('welcome', 'other', self.fingerprint, {}))
+            conn.close()
+
+        t = threading.Thread(target=serve)
+        t.start()
+        self.assertRaises(ValueError, distributed.run_worker,
+            listener.address, AUTHKEY, 1, self.db_file, True, 0.1)
+        t.join()
+        listener.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Unit test for :mod:`setlyze.report`."""
+
+import os
+import sys
+import shutil
+import pickle
+import tempfile
+import collections
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+sys.path.insert(0, os.path.abspath('.'))
+
+import setlyze.report as report
+
+# Spot distances as ``(pla_id, distance)`` rows, sorted by plate.
+DISTANCES = [(63, 1.0), (63, 2.0), (63, 1.0), (229, 3.16), (1020, 1.41),
+    (1020, 2.0)]
+
+class TestSpotDistances(unittest.TestCase):
+
+    """Unit tests for :class:`setlyze.report.SpotDistances`."""
+
+    def setUp(self):
+        self.distances = report.SpotDistances(DISTANCES)
+
+    def check_distances(self, distances):
+        self.assertEqual(len(distances), 3)
+        self.assertEqual(distances.keys(), [63, 229, 1020])
+        self.assertEqual(distances[63], [1.0, 2.0, 1.0])
+        self.assertEqual(distances[229], [3.16])
+        self.assertEqual(distances[1020], [1.41, 2.0])
+        self.assertEqual(distances.items(), [(63, [1.0, 2.0, 1.0]),
+            (229, [3.16]), (1020, [1.41, 2.0])])
+
+    def test_lookup(self):
+        self.check_distances(self.distances)
+        self.assertTrue(229 in self.distances)
+        self.assertFalse(230 in self.distances)
+        self.assertFalse(5000 in self.distances)
+        self.assertRaises(KeyError, self.distances.__getitem__, 1)
+        self.assertEqual(self.distances.get_histogram(),
+            {1.0: 2, 2.0: 2, 3.16: 1, 1.41: 1})
+
+    def test_empty(self):
+        distances = report.SpotDistances()
+        self.assertEqual(len(distances), 0)
+        self.assertEqual(distances.items(), [])
+        self.assertFalse(63 in distances)
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.check_distances(pickle.loads(pickle.dumps(self.distances,
+                protocol)))
+
+class TestCompactReport(unittest.TestCase):
+
+    """Unit tests for the compact report format of :mod:`setlyze.report`."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.report = self.make_report({'A': 0.01, 'B': 0.2}, [(1, 2, 0.5)])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_report(self, results, rows):
+        r = report.Report()
+        r.set_analysis('spot_preference')
+        r.set_option("Alpha level", 0.05)
+        r.set_definitions([('n_plates', "Number of plates")])
+        r.spot_distances_observed = report.SpotDistances(DISTANCES)
+        r.area_totals_observed = {'A': 12, 'B': 4}
+        r.set_statistics('wilcoxon_areas', {
+            'attr': {'groups': 'areas', 'alpha_level': 0.05},
+            'results': results,
+        })
+        r.set_statistics('batch_summary', {
+            'attr': {'groups': 'areas'},
+            'results': rows,
+        })
+        return r
+
+    def save(self, r, name):
+        path = os.path.join(self.path, name)
+        report.write_compact(r, path)
+        return path
+
+    def test_load(self):
+        for name in ('report.jsonl', 'report.jsonl.gz'):
+            r = report.load(self.save(self.report, name))
+
+            self.assertEqual(r.analysis_name, 'spot_preference')
+            self.assertEqual(r.options, self.report.options)
+            self.assertTrue(isinstance(r.options, collections.OrderedDict))
+            self.assertEqual(r.definitions, self.report.definitions)
+            self.assertEqual(r.area_totals_observed, {'A': 12, 'B': 4})
+            self.assertEqual(r.spot_distances_observed.items(),
+                self.report.spot_distances_observed.items())
+            self.assertEqual(r.statistics, self.report.statistics)
+            # Tuples are not turned into lists.
+            self.assertEqual(r.statistics['batch_summary'][0]['results'],
+                [(1, 2, 0.5)])
+            self.assertEqual(report.diff(self.report, r), [])
+
+    def test_load_invalid(self):
+        path = os.path.join(self.path, 'report.jsonl')
+        with open(path, 'w') as f:
+            f.write('{"format": "other"}\n')
+        self.assertRaises(ValueError, report.load, path)
+
+        with open(path, 'w') as f:
+            f.write('{"format": "setlyze-report", "version": %d}\n' %
+                (report.REPORT_FORMAT_VERSION + 1))
+        self.assertRaises(ValueError, report.load, path)
+
+    def test_diff(self):
+        other = self.make_report({'A': 0.0100001, 'B': 0.3}, [(1, 2, 0.5)])
+        other.spot_distances_observed = report.SpotDistances(DISTANCES[:-1])
+
+        differences = report.diff(self.report, other, tolerance=0.001)
+        self.assertEqual(differences, [
+            ('spot_distances_observed.1020', [1.41, 2.0], [1.41]),
+            ('statistics.wilcoxon_areas[0].results.B', 0.2, 0.3),
+        ])
+        self.assertEqual(len(report.diff(self.report, other)), 3)
+
+    def test_diff_nan(self):
+        a = self.make_report({'A': float('nan')}, [])
+        b = self.make_report({'A': float('nan')}, [])
+        self.assertEqual(report.diff(a, b), [])
+
+    def test_merge(self):
+        part1 = self.make_report({'A': 0.01}, [(3, 4, 0.1), (1, 2, 0.5)])
+        part2 = self.make_report({'B': 0.2}, [(2, 3, 0.9)])
+        part2.set_statistics('chisq_areas', {'attr': {'method': 'chisq'},
+            'results': {'p_value': 0.5}})
+
+        merged = report.merge([part1, part2])
+        self.assertEqual(merged.analysis_name, 'spot_preference')
+        self.assertEqual(merged.statistics['wilcoxon_areas'], [
+            {'attr': {'groups': 'areas', 'alpha_level': 0.05},
+             'results': {'A': 0.01, 'B': 0.2}}])
+        self.assertEqual(merged.statistics['batch_summary'][0]['results'],
+            [(1, 2, 0.5), (2, 3, 0.9), (3, 4, 0.1)])
+        self.assertEqual(merged.statistics['chisq_areas'],
+            part2.statistics['chisq_areas'])
+
+        # The reports that were merged are not changed.
+        self.assertEqual(part1.statistics['wilcoxon_areas'][0]['results'],
+            {'A': 0.01})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Unit test for :mod:`setlyze.snapshot`."""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath('..'))
+sys.path.insert(0, os.path.abspath('.'))
+
+import setlyze.database
+import setlyze.snapshot as snapshot
+
+class LocalDB(object):
+    """Minimal database accessor for :func:`setlyze.snapshot.load_snapshot`."""
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile)
+
+    def get_data_fingerprint(self):
+        return setlyze.database.get_data_fingerprint(self.conn)
+
+class TestSnapshot(unittest.TestCase):
+
+    """Unit tests for :mod:`setlyze.snapshot`."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.path, 'setl_local.snapshot')
+        self.db = LocalDB(os.path.join(self.path, 'setl_local.db'))
+
+        spots = ",".join(["rec_sur%d INTEGER" % i
+            for i in range(1, snapshot.N_SPOTS+1)])
+        self.db.conn.executescript("""
+            CREATE TABLE info (id INTEGER PRIMARY KEY, name TEXT, value TEXT);
+            CREATE TABLE localities (loc_id INTEGER PRIMARY KEY);
+            CREATE TABLE species (spe_id INTEGER PRIMARY KEY);
+            CREATE TABLE plates (pla_id INTEGER PRIMARY KEY, pla_loc_id INTEGER);
+            CREATE TABLE records (rec_id INTEGER, rec_pla_id INTEGER,
+                rec_spe_id INTEGER, %s);
+            INSERT INTO info VALUES (null, 'source', 'data-files');
+            INSERT INTO localities VALUES (1);
+            INSERT INTO localities VALUES (2);
+            INSERT INTO species VALUES (1);
+            INSERT INTO plates VALUES (1, 1);
+            INSERT INTO plates VALUES (2, 2);
+            INSERT INTO plates VALUES (3, '');
+        """ % spots)
+
+        # Records are inserted out of order, with empty and missing IDs.
+        records = [
+            (3, 2, 1, [1] * snapshot.N_SPOTS),
+            (1, 1, 1, [1, 0, '', None, 1] + [0] * 20),
+            (2, '', None, [0] * 24 + [1]),
+        ]
+        for rec_id, pla_id, spe_id, values in records:
+            self.db.conn.execute("INSERT INTO records VALUES (%s)" %
+                ",".join('?' * (snapshot.N_SPOTS+3)),
+                [rec_id, pla_id, spe_id] + values)
+        self.db.conn.commit()
+
+    def tearDown(self):
+        self.db.conn.close()
+        snapshot.clear_snapshot_cache()
+        shutil.rmtree(self.path)
+
+    def write(self):
+        snapshot.write_snapshot(self.db.conn, self.db.get_data_fingerprint(),
+            self.snapshot_path)
+
+    def test_round_trip(self):
+        self.write()
+        s = snapshot.load_snapshot(self.db, self.snapshot_path)
+
+        self.assertEqual(s.header['records'], 3)
+        self.assertEqual(s.rec_id.tolist(), [1, 2, 3])
+        self.assertEqual(s.pla_id.tolist(), [1, snapshot.NULL_ID, 2])
+        self.assertEqual(s.spe_id.tolist(), [1, snapshot.NULL_ID, 1])
+        self.assertEqual(s.spots.tolist(), [0b10001, 1 << 24, 2**25 - 1])
+        self.assertEqual(s.plate_loc_ids.tolist(), [1, 2, snapshot.NULL_ID])
+
+        self.assertEqual(s.get_record_ids([1, 2], [1]), [1, 3])
+        self.assertEqual(s.get_spots([2, 4]).tolist(), [[0] * 24 + [1]])
+        self.assertEqual(list(s.get_plates_and_spots([1])),
+            [(1, 1, 0, 0, 0, 1) + (0,) * 20])
+
+    def test_cache(self):
+        self.write()
+        s = snapshot.load_snapshot(self.db, self.snapshot_path)
+        self.assertTrue(snapshot.load_snapshot(self.db, self.snapshot_path) is s)
+
+        # A new snapshot is loaded again.
+        self.write()
+        self.assertFalse(snapshot.load_snapshot(self.db, self.snapshot_path) is s)
+
+    def test_outdated(self):
+        self.write()
+        self.assertTrue(snapshot.load_snapshot(self.db, self.snapshot_path))
+
+        # Move a plate to another location, which doesn't change the
+        # number of rows in the database.
+        self.db.conn.execute("UPDATE plates SET pla_loc_id=1 WHERE pla_id=2")
+        self.db.conn.commit()
+        self.assertEqual(snapshot.load_snapshot(self.db, self.snapshot_path),
+            None)
+
+    def test_missing(self):
+        self.assertEqual(snapshot.load_snapshot(self.db, self.snapshot_path),
+            None)
+        self.write()
+        snapshot.remove_snapshot(self.snapshot_path)
+        self.assertEqual(snapshot.load_snapshot(self.db, self.snapshot_path),
+            None)
+
+    def test_null_record_id(self):
+        self.db.conn.execute("INSERT INTO records (rec_id) VALUES (NULL)")
+        self.assertRaises(ValueError, self.write)
+        self.assertFalse(os.path.exists(self.snapshot_path))
+
+    def test_get_id(self):
+        self.assertEqual(snapshot.get_id(5), 5)
+        self.assertEqual(snapshot.get_id(None), snapshot.NULL_ID)
+        self.assertEqual(snapshot.get_id(''), snapshot.NULL_ID)
+
+if __name__ == '__main__':
+    unittest.main()